@@ -5,6 +5,8 @@ country mapping synchronization and presentation.
 
 import os
 import itertools
+import shutil
+import threading
 import functools
 import operator
 import sys
@@ -12,21 +14,13 @@ import zipfile
 import time
 import datetime
 import json
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
 
-# below is needed because of https://github.com/spyoungtech/grequests/issues/103
-from gevent import monkey
-def stub(*args, **kwargs):  # pylint: disable=unused-argument
-    pass
-monkey.patch_all = stub
-#########
-
-import grequests
-import requests
 import settings
 import ocldev.oclconstants
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from . import datimexportcache
+from . import datimhttp
+from . import datimjsonstream
 
 
 class DatimBase(object):
@@ -97,6 +91,11 @@ class DatimBase(object):
     DATIM_MOH_MAP_TYPE_HAS_OPTION = 'Has Option'
     DATIM_MOH_MAP_TYPE_COUNTRY_OPTION = 'DATIM HAS OPTION'
 
+    # Custom attribute of a country source version listing the version of each country collection
+    # that makes up the IMAP version, e.g. {"HTS_TST_N_MOH": "FY19.v1"}, since an IMAP patch only
+    # creates versions of the collections it changes (see DatimImapFactory.plan_import_from_diff)
+    DATIM_MOH_COLLECTION_VERSIONS_ATTRIBUTE = 'datim_collection_versions'
+
     # DATIM-MOH NULL Disag ID and Name (used only by DATIM-MOH)
     NULL_DISAG_ID = 'null-disag'
     NULL_DISAG_NAME = 'Null Disaggregate'
@@ -105,6 +104,16 @@ class DatimBase(object):
     DATIM_DEFAULT_DISAG_ID = 'HllvX50cXC0'
     DATIM_DEFAULT_DISAG_REPLACEMENT_NAME = 'Total'
 
+    # Concurrency of the async OCL export requests (see get_ocl_exports_async). Defaults can be
+    # overridden per OCL environment with settings.ocl_export_concurrency.
+    DEFAULT_OCL_EXPORT_CONCURRENCY = 2
+    DEFAULT_OCL_EXPORT_MAX_CONCURRENCY = 8
+    OCL_EXPORT_MAX_ATTEMPTS = 3
+    OCL_EXPORT_MAX_BACKOFF_SECONDS = 30
+
+    # Status codes returned by OCL when overloaded, which lower the concurrency in adaptive mode
+    OCL_EXPORT_THROTTLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
     # Location to save temporary data files
     # NOTE: File system permissions must be set for this project to read/write from this subfolder
     DATA_SUBFOLDER_NAME = 'data'
@@ -129,6 +138,11 @@ class DatimBase(object):
         self.str_active_dataset_ids = ''
         self.run_ocl_offline = False
         self.datim_moh_source_id = ''
+        self.ocl_export_stats = None
+        self.http_engine = datimhttp.OclHttpEngine.get_default()
+        self.save_ocl_exports = getattr(settings, 'save_ocl_exports', False)
+        self.export_cache = datimexportcache.DatimExportCache.get_default(
+            self.attach_absolute_data_path(datimexportcache.DatimExportCache.DEFAULT_DIRNAME))
 
     def vlog(self, verbose_level=0, *args):
         """
@@ -261,24 +275,40 @@ class DatimBase(object):
         key_field='external_id' and more than one repository is returned by OCL
         with the same value for external_id, only one of those repositories will
         be returned by this method.
+        If OCL returns the number of pages in the "pages" header, the remaining pages are
+        fetched concurrently. Otherwise, the "next" header is followed one page at a time.
         """
         filtered_repos = {}
-        next_url = self.oclenv + endpoint
-        while next_url:
-            response = requests.get(
-                next_url, headers=self.oclapiheaders, params={"limit": str(limit)})
-            self.vlog(2, "Fetching repositories for '%s' from OCL: %s" % (endpoint, response.url))
-            response.raise_for_status()
-            repos = response.json()
-            for repo in repos:
+
+        def add_repos(repos_response):
+            repos_response.raise_for_status()
+            for repo in repos_response.json():
                 if (not require_external_id or ('external_id' in repo and repo['external_id'])) and (
                         not active_attr_name or (repo['extras'] and active_attr_name in repo['extras'] and repo[
                             'extras'][active_attr_name])):
                     filtered_repos[repo[key_field]] = repo
-            next_url = ''
-            if ('next' in response.headers and response.headers['next'] and
-                    response.headers['next'] != 'None'):
-                next_url = response.headers['next']
+
+        url = self.oclenv + endpoint
+        response = self.http_engine.get(url, headers=self.oclapiheaders, params={"limit": str(limit)})
+        self.vlog(2, "Fetching repositories for '%s' from OCL: %s" % (endpoint, response.url))
+        add_repos(response)
+        num_pages = response.headers.get('pages', '')
+        if num_pages.isdigit() and int(num_pages) > 1:
+            page_urls = ['%s?limit=%s&page=%s' % (url, limit, page) for page in range(2, int(num_pages) + 1)]
+            self.vlog(2, "Fetching %s more pages of repositories for '%s' from OCL" % (
+                len(page_urls), endpoint))
+            for page_url, response in zip(page_urls, self.http_engine.map(page_urls, headers=self.oclapiheaders)):
+                if response is None:
+                    raise Exception('ERROR: Unable to fetch repositories from "%s"' % page_url)
+                add_repos(response)
+            return filtered_repos
+        next_url = response.headers.get('next', '')
+        while next_url and next_url != 'None':
+            response = self.http_engine.get(
+                next_url, headers=self.oclapiheaders, params={"limit": str(limit)})
+            self.vlog(2, "Fetching repositories for '%s' from OCL: %s" % (endpoint, response.url))
+            add_repos(response)
+            next_url = response.headers.get('next', '')
         return filtered_repos
 
     def load_datasets_from_ocl(self):
@@ -374,21 +404,55 @@ class DatimBase(object):
             new_repo_version_url = self.oclenv + repo_version_endpoint
             self.vlog(1, 'Create new repo version request URL:', new_repo_version_url)
             self.vlog(1, json.dumps(new_repo_version_data))
-            r = requests.post(new_repo_version_url,
-                              data=json.dumps(new_repo_version_data),
-                              headers=self.oclapiheaders)
+            r = self.http_engine.post(new_repo_version_url,
+                                      data=json.dumps(new_repo_version_data),
+                                      headers=self.oclapiheaders)
             r.raise_for_status()
             repo_version_endpoint = str(
                 ocl_export_def['endpoint']) + str(new_repo_version_data['id']) + '/'
             self.vlog(1, '[OCL Export %s of %s] %s: Created new repository version "%s"' % (
                 cnt, len(self.OCL_EXPORT_DEFS), ocl_export_key, repo_version_endpoint))
 
-    def get_ocl_exports_async(self, endpoint='', period='', version=''):
+    def get_ocl_export_concurrency(self):
+        """
+        Returns the (concurrency, max_concurrency, adaptive) settings of the async OCL export
+        requests for the current OCL environment. settings.ocl_export_concurrency may be an
+        integer or a dictionary keyed by OCL API URL root, where the '' key is the default.
+        :return: <tuple>
         """
-        Retrieves all matching exports at the specified 'collections' or 'sources' endpoint
+        concurrency = getattr(settings, 'ocl_export_concurrency', None)
+        if isinstance(concurrency, dict):
+            concurrency = concurrency.get(self.oclenv.rstrip('/'), concurrency.get(''))
+        concurrency = max(1, int(concurrency or self.DEFAULT_OCL_EXPORT_CONCURRENCY))
+        max_concurrency = max(concurrency, int(getattr(
+            settings, 'ocl_export_max_concurrency', self.DEFAULT_OCL_EXPORT_MAX_CONCURRENCY)))
+        adaptive = bool(getattr(settings, 'ocl_export_adaptive_concurrency', False))
+        return concurrency, max_concurrency, adaptive
+
+    def get_ocl_exports_async(self, endpoint='', period='', version='', concurrency=None,
+                              adaptive=None, stats=None, recorded_version_ids=None,
+                              exported_version_ids=None):
+        """
+        Retrieves all matching exports at the specified 'collections' or 'sources' endpoint.
+        Exports found in the export cache are not requested from OCL. Statistics of the requests,
+        including the achieved throughput, are saved in self.ocl_export_stats.
+        A repository is exported at its version in recorded_version_ids if listed there, e.g. in
+        the DATIM_MOH_COLLECTION_VERSIONS_ATTRIBUTE of a country source version, since an IMAP
+        patch only creates versions of the collections it changes. Otherwise, or if that version
+        is not found, it is exported at the specified version, or at the latest released version
+        of the period that precedes it if the repository has no such version. Repositories
+        without any of these versions are skipped.
         :param endpoint: e.g. /orgs/DATIM-MOH-UA-FY19/collections/
         :param period: e.g. FY18, FY19
         :param version: Required, and does not support "latest" (e.g. v2, v3)
+        :param concurrency: Number of concurrent requests. Defaults to get_ocl_export_concurrency()
+        :param adaptive: Adapt concurrency to the observed latency and throttling responses (see
+            get_responses_adaptive). Defaults to get_ocl_export_concurrency()
+        :param stats: Optional <dict> updated with the statistics of the requests, for callers
+            that run several exports concurrently with the same object
+        :param recorded_version_ids: Optional <dict> repository_id: repository_version_id
+        :param exported_version_ids: Optional <dict> updated with the repository_id:
+            repository_version_id of each repository exported
         :return: <dict> repository_version_url: repository_version_export
         """
 
@@ -398,30 +462,161 @@ class DatimBase(object):
             endpoint=endpoint, require_external_id=False, active_attr_name='')
         self.vlog(1, '%s repositories returned for endpoint "%s"' % (
             len(country_collections), endpoint))
-        export_urls = []
-        for collection_id, collection in list(country_collections.items()):
-            url_ocl_export = '%s%s%s/export/' % (
-                self.oclenv, collection['url'], country_version_id)
-            self.vlog(1, 'Export URL:', url_ocl_export)
-            export_urls.append(url_ocl_export)
+        recorded_version_ids = recorded_version_ids or {}
+        repo_version_ids = dict(
+            (collection['url'], recorded_version_ids.get(collection_id, country_version_id))
+            for collection_id, collection in country_collections.items())
+
+        # Retrieve the exports, then the exports of the previous versions of the repositories
+        # not found at their recorded or the specified version
+        default_concurrency, max_concurrency, default_adaptive = self.get_ocl_export_concurrency()
+        if concurrency is None:
+            concurrency = default_concurrency
+        if adaptive is None:
+            adaptive = default_adaptive
+        start_time = time.time()
+        collection_results, not_found_repo_urls, export_stats = self.get_repository_version_exports(
+            repo_version_ids, concurrency=concurrency, max_concurrency=max_concurrency,
+            adaptive=adaptive)
+
+        # A repository not found at its recorded version is exported as if it was not recorded
+        unrecorded_version_ids = dict(
+            (repo_url, country_version_id) for repo_url in not_found_repo_urls
+            if repo_version_ids[repo_url] != country_version_id)
+        not_found_repo_urls = [
+            repo_url for repo_url in not_found_repo_urls if repo_url not in unrecorded_version_ids]
+        if unrecorded_version_ids:
+            self.vlog(1, 'WARNING: %s repositories not found at their recorded version' % (
+                len(unrecorded_version_ids)))
+            repo_version_ids.update(unrecorded_version_ids)
+            unrecorded_results, unrecorded_not_found_repo_urls, unrecorded_export_stats = (
+                self.get_repository_version_exports(
+                    unrecorded_version_ids, concurrency=concurrency, max_concurrency=max_concurrency,
+                    adaptive=adaptive))
+            collection_results.update(unrecorded_results)
+            not_found_repo_urls += unrecorded_not_found_repo_urls
+            DatimBase.add_export_stats(export_stats, unrecorded_export_stats)
+        if not_found_repo_urls:
+            previous_version_ids = self.get_previous_repo_version_ids(
+                not_found_repo_urls, country_version_id)
+            repo_version_ids.update(previous_version_ids)
+            if previous_version_ids:
+                previous_results, _, previous_export_stats = self.get_repository_version_exports(
+                    previous_version_ids, concurrency=concurrency, max_concurrency=max_concurrency,
+                    adaptive=adaptive)
+                collection_results.update(previous_results)
+                DatimBase.add_export_stats(export_stats, previous_export_stats)
+        export_stats['seconds'] = time.time() - start_time
+        export_stats['exports_per_second'] = (
+            export_stats['num_exports'] / export_stats['seconds'] if export_stats['seconds'] else 0.0)
+        self.ocl_export_stats = export_stats
+        if stats is not None:
+            stats.update(export_stats)
+        self.vlog(1, '%s exports in %.2f seconds (%.2f/s, concurrency %s-%s, %s throttled)' % (
+            export_stats['num_exports'], export_stats['seconds'], export_stats['exports_per_second'],
+            export_stats['min_concurrency'], export_stats['max_concurrency'], export_stats['num_throttled']))
+        self.vlog(1, '%s repository exports for version "%s" retrieved at endpoint "%s"' % (
+            len(collection_results), country_version_id, endpoint))
 
-        # Define exception handler for async requests
-        def export_exception_handler(request, exception):
-            print(('Request failed:', str(request), str(exception)))
-
-        # Submit sync export requests with auto-retry in case of connection pooling errors
-        s = requests.Session()
-        retries = Retry(total=5, backoff_factor=0.2)
-        s.mount('http://', HTTPAdapter(max_retries=retries))
-        s.mount('https://', HTTPAdapter(max_retries=retries))
-        export_rs = (
-            grequests.get(url, headers=self.oclapiheaders, session=s) for url in export_urls)
-        export_responses = grequests.map(
-            export_rs, size=2, exception_handler=export_exception_handler)
+        # Return the results in the order of the repositories, whether cached or not
+        export_urls = [self.get_repo_version_export_url(repo_url, repo_version_id)
+                       for repo_url, repo_version_id in repo_version_ids.items()]
+        ordered_collection_results = dict(
+            (url, collection_results.pop(url)) for url in export_urls if url in collection_results)
+        ordered_collection_results.update(collection_results)
+        if exported_version_ids is not None:
+            for collection_id, collection in country_collections.items():
+                repo_version_id = repo_version_ids[collection['url']]
+                if self.get_repo_version_export_url(
+                        collection['url'], repo_version_id) in ordered_collection_results:
+                    exported_version_ids[collection_id] = repo_version_id
+        return ordered_collection_results
+
+    @staticmethod
+    def add_export_stats(export_stats, other_export_stats):
+        """
+        Adds the statistics of another round of export requests (see
+        get_repository_version_exports) to export_stats
+        """
+        for stat_name in ('num_requests', 'num_throttled', 'num_exports', 'num_cached'):
+            export_stats[stat_name] += other_export_stats[stat_name]
+        for stat_name, stat_fn in (('min_concurrency', min), ('max_concurrency', max)):
+            export_stats[stat_name] = stat_fn(export_stats[stat_name], other_export_stats[stat_name])
+
+    def get_repo_version(self, repo_endpoint, repo_version_id):
+        """
+        Returns the OCL repository version dictionary, including its custom attributes, or None
+        if the version is not found
+        :param repo_endpoint: e.g. /orgs/DATIM-MOH-BI-FY19/sources/DATIM-Alignment-Indicators/
+        :param repo_version_id: e.g. FY19.v1
+        :return: <dict> or None
+        """
+        r = self.http_engine.get(
+            '%s%s%s/' % (self.oclenv, repo_endpoint, repo_version_id), headers=self.oclapiheaders)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r.json()
+
+    def get_repo_version_export_url(self, repo_url, repo_version_id):
+        """ Returns the export URL of a repository version """
+        return '%s%s%s/export/' % (self.oclenv, repo_url, repo_version_id)
+
+    def get_repository_version_exports(self, repo_version_ids, concurrency=DEFAULT_OCL_EXPORT_CONCURRENCY,
+                                       max_concurrency=DEFAULT_OCL_EXPORT_MAX_CONCURRENCY,
+                                       adaptive=False):
+        """
+        Retrieves the repository version exports, from the export cache if found there and
+        otherwise with async requests to OCL (see get_ocl_exports_async)
+        :param repo_version_ids: <dict> repo_url: repo_version_id, e.g.
+            {'/orgs/DATIM-MOH-BI-FY19/collections/HTS_TST_N_MOH/': 'FY19.v0'}
+        :param concurrency:
+        :param max_concurrency:
+        :param adaptive:
+        :return: <tuple> (<dict> export_url: export, <list> of repo URLs whose version was not
+            found, <dict> stats of the requests)
+        """
+        export_cache_keys = {}
+        repo_urls = {}
+        for repo_url, repo_version_id in repo_version_ids.items():
+            url_ocl_export = self.get_repo_version_export_url(repo_url, repo_version_id)
+            self.vlog(1, 'Export URL:', url_ocl_export)
+            repo_urls[url_ocl_export] = repo_url
+            if self.export_cache:
+                export_cache_keys[url_ocl_export] = self.export_cache.get_key(
+                    self.oclenv, repo_url, repo_version_id)
+
+        # Look up all the exports in the export cache at once, so that its index is read once
+        cached_exports = {}
+        if self.export_cache:
+            cached_contents = self.export_cache.get_many(list(export_cache_keys.values()))
+            for url_ocl_export, export_cache_key in export_cache_keys.items():
+                if export_cache_key in cached_contents:
+                    cached_exports[url_ocl_export] = cached_contents[export_cache_key]
+        requested_export_urls = [url for url in repo_urls if url not in cached_exports]
+        if cached_exports:
+            self.vlog(1, '%s repository exports found in the export cache' % len(cached_exports))
+
+        # Submit async export requests through the HTTP engine, which retries connection errors
+        if adaptive:
+            export_responses, export_stats = self.get_responses_adaptive(
+                requested_export_urls, concurrency=concurrency, max_concurrency=max_concurrency)
+        else:
+            export_responses = self.get_responses_async(requested_export_urls, concurrency=concurrency)
+            export_stats = {'num_requests': len(requested_export_urls), 'num_throttled': 0,
+                            'min_concurrency': concurrency, 'max_concurrency': concurrency,
+                            'final_concurrency': concurrency}
+        export_stats['num_exports'] = len(requested_export_urls)
+        export_stats['num_cached'] = len(cached_exports)
         self.vlog(1, 'Results of async query:\n%s' % export_responses)
 
         # Process collection export results
         collection_results = {}
+        not_found_repo_urls = []
+        exports_to_cache = []
+        for url_ocl_export, export_content in list(cached_exports.items()):
+            collection_results[url_ocl_export] = self.get_export_json_from_zip(
+                export_content, url_ocl_export)
         for export_response in export_responses:
             if export_response is None:
                 self.vlog(1, 'WARNING: Export value is None')
@@ -431,10 +626,11 @@ class DatimBase(object):
                     export_response.history[0].url):
                 original_export_url = export_response.history[0].url
             if export_response.status_code == 404:
-                # Repository version does not exist, so we can safely skip this one
-                # This happens when there is no country mapping for this
-                self.vlog(1, '[%s NOT FOUND] %s -- Current IMAP %s has no mapping for this data element, so we can safely skip' % (
-                    export_response.status_code, export_response.url, country_version_id))
+                # Repository version does not exist, e.g. because the collection was not changed
+                # by the IMAP patch that created the version, or was created by a later one
+                self.vlog(1, '[%s NOT FOUND] %s -- Repository version not found' % (
+                    export_response.status_code, export_response.url))
+                not_found_repo_urls.append(repo_urls.get(original_export_url, original_export_url))
                 continue
             elif export_response.status_code == 204:
                 # Export not cached for this repository version, so we need to generate it first
@@ -452,20 +648,202 @@ class DatimBase(object):
             if export_response.status_code == 200:
                 # Cached export successfully retrieved for this repository version
                 self.vlog(2, '[%s FOUND] %s' % (export_response.status_code, original_export_url))
-                export_string_handle = BytesIO(export_response.content)
-                zipref = zipfile.ZipFile(export_string_handle, "r")
-                if 'export.json' in zipref.namelist():
-                    collection_results[original_export_url] = json.loads(zipref.read('export.json'))
-                    zipref.close()
+                collection_results[original_export_url] = self.get_export_json_from_zip(
+                    export_response.content, original_export_url)
+                exports_to_cache.append(
+                    (export_cache_keys.get(original_export_url), export_response.content))
+
+        # Cache the downloaded exports at once, so that the index is written once
+        if self.export_cache and exports_to_cache:
+            self.export_cache.put_many(exports_to_cache)
+        return collection_results, not_found_repo_urls, export_stats
+
+    def get_previous_repo_version_ids(self, repo_urls, repo_version_id):
+        """
+        Returns the ID of the latest released version of each repository that precedes the
+        specified version in the same period, e.g. "FY19.v1" for "FY19.v3" if the repository has
+        no "FY19.v2" version. Repositories without such a version are omitted. The versions of
+        the repositories are requested concurrently.
+        :param repo_urls: <list> of repository endpoints, e.g. /orgs/DATIM-MOH-BI-FY19/collections/HTS_TST_N_MOH/
+        :param repo_version_id: e.g. FY19.v3
+        :return: <dict> repo_url: repo_version_id
+        """
+        period, _, minor_version = repo_version_id.partition('.')
+        if not minor_version[1:].isdigit():
+            return {}
+        minor_version_number = int(minor_version[1:])
+        repo_versions_urls = ['%s%sversions/?limit=0' % (self.oclenv, repo_url) for repo_url in repo_urls]
+        previous_version_ids = {}
+        for repo_url, response in zip(repo_urls, self.http_engine.map(
+                repo_versions_urls, headers=self.oclapiheaders)):
+            if response is None or response.status_code != 200:
+                continue
+            previous_minor_version_number = -1
+            for repo_version in response.json():
+                version_period, _, version_minor_version = repo_version['id'].partition('.')
+                if (repo_version['released'] is not True or version_period != period or
+                        not version_minor_version.startswith('v') or
+                        not version_minor_version[1:].isdigit()):
+                    continue
+                version_minor_version_number = int(version_minor_version[1:])
+                if previous_minor_version_number < version_minor_version_number < minor_version_number:
+                    previous_minor_version_number = version_minor_version_number
+                    previous_version_ids[repo_url] = repo_version['id']
+        return previous_version_ids
+
+    def get_export_json_from_zip(self, export_content, export_url=''):
+        """
+        Returns the export.json of a compressed OCL export, decompressed in memory straight into
+        the JSON parser without temporary files
+        :param export_content: <bytes> Compressed OCL export
+        :param export_url: Export URL, used in the error message
+        :return: <dict>
+        """
+        with zipfile.ZipFile(BytesIO(export_content), "r") as zipref:
+            if 'export.json' not in zipref.namelist():
+                errmsg = 'ERROR: Invalid export for "%s": export.json not found.' % export_url
+                self.vlog(1, errmsg)
+                raise Exception(errmsg)
+            with zipref.open('export.json') as handle:
+                return json.load(handle)
+
+    def get_ocl_export_resources(self, endpoint='', version='', zipfilename='', jsonfilename='',
+                                 resource_types=('concepts', 'mappings')):
+        """
+        Fetches an export of the specified repository version (see get_ocl_export_json) and
+        yields its resources one at a time while export.json is decompressed and parsed, so that
+        the whole export is never held in memory. In offline mode, the resources are read from
+        the saved jsonfilename instead.
+        :param endpoint: endpoint for repo only, e.g. '/orgs/myorg/sources/mysource/'
+        :param version: repo version ID or "latest"
+        :param zipfilename: Filename to save the compressed OCL export to
+        :param jsonfilename: Filename to save the decompressed OCL-JSON export to
+        :param resource_types: Top-level lists of the export to yield resources from
+        :return: Generator of <tuple> (resource_type, resource), e.g. ('concepts', {...})
+        """
+        if self.run_ocl_offline:
+            self.does_offline_data_file_exist(jsonfilename, exit_if_missing=True)
+            with open(self.attach_absolute_data_path(jsonfilename), 'r', encoding='utf-8') as handle:
+                for resource_type, resource in DatimBase.iter_export_resources(handle, resource_types):
+                    yield resource_type, resource
+            return
+        export_content = self.get_ocl_export_zip(endpoint=endpoint, version=version)
+        if self.save_ocl_exports:
+            self.save_ocl_export_files(
+                export_content, zipfilename=zipfilename, jsonfilename=jsonfilename)
+        with zipfile.ZipFile(BytesIO(export_content), "r") as zipref:
+            if 'export.json' not in zipref.namelist():
+                errmsg = 'ERROR: Invalid export for "%s": export.json not found.' % (
+                    self.oclenv + endpoint + version + '/export/')
+                self.vlog(1, errmsg)
+                raise Exception(errmsg)
+            with TextIOWrapper(zipref.open('export.json'), encoding='utf-8') as handle:
+                for resource_type, resource in DatimBase.iter_export_resources(handle, resource_types):
+                    yield resource_type, resource
+
+    @staticmethod
+    def iter_export_resources(handle, resource_types=('concepts', 'mappings'), chunk_size=65536):
+        """
+        Incrementally parses an OCL-formatted JSON export and yields each resource of the
+        top-level resource_types lists as soon as it is read, so that only one resource is held
+        in memory at a time. Other top-level values are parsed and skipped. Raises TypeError if
+        the top level is not an object and ValueError for malformed or truncated JSON.
+        :param handle: Text or binary file-like object of the OCL-formatted JSON export
+        :param resource_types: Top-level lists of the export to yield resources from
+        :param chunk_size: Number of characters read from the handle at a time
+        :return: Generator of <tuple> (resource_type, resource), e.g. ('concepts', {...})
+        """
+        reader = datimjsonstream.DatimJsonStreamReader(
+            handle, source_name=getattr(handle, 'name', ''), chunk_size=chunk_size)
+        for resource_type, resource in reader.iter_object_lists(resource_types):
+            yield resource_type, resource
+        reader.read_end()
+
+    def get_responses_async(self, urls, concurrency=DEFAULT_OCL_EXPORT_CONCURRENCY,
+                            retry_throttled=True):
+        """
+        Submits GET requests for the URLs with at most concurrency requests in flight
+        :param urls: <list> of URLs
+        :param concurrency:
+        :param retry_throttled: Let the HTTP engine retry 429/503 responses with a Retry-After
+            header if True. Otherwise the throttled responses are returned.
+        :return: <list> of responses in the order of the URLs, None for failed requests
+        """
+        # Define exception handler for async requests
+        def export_exception_handler(url, exception):
+            print(('Request failed:', str(url), str(exception)))
+
+        return self.http_engine.map(
+            urls, concurrency=concurrency, exception_handler=export_exception_handler,
+            headers=self.oclapiheaders, retry_throttled=retry_throttled)
+
+    def get_responses_adaptive(self, urls, concurrency=DEFAULT_OCL_EXPORT_CONCURRENCY,
+                               max_concurrency=DEFAULT_OCL_EXPORT_MAX_CONCURRENCY):
+        """
+        Submits GET requests for the URLs in waves, adapting the concurrency of each wave to the
+        previous one: concurrency is halved and the throttled requests are retried after a
+        backoff if any request failed or returned a OCL_EXPORT_THROTTLE_STATUS_CODES response,
+        lowered by one if the median latency is more than twice the best median latency seen so
+        far, and raised by one otherwise. Requests are retried up to OCL_EXPORT_MAX_ATTEMPTS
+        times, after which the last response is returned. The HTTP engine only retries
+        connection errors here, so that every throttled response reaches this controller.
+        :param urls: <list> of URLs
+        :param concurrency: Initial concurrency
+        :param max_concurrency:
+        :return: <tuple> (<list> of responses in the order of the URLs, <dict> stats)
+        """
+        responses = [None] * len(urls)
+        attempts = [0] * len(urls)
+        pending = list(range(len(urls)))
+        best_latency = None
+        num_throttled_waves = 0
+        stats = {'num_requests': 0, 'num_throttled': 0, 'min_concurrency': concurrency,
+                 'max_concurrency': concurrency, 'final_concurrency': concurrency}
+        while pending:
+            wave, pending = pending[:concurrency], pending[concurrency:]
+            wave_responses = self.get_responses_async(
+                [urls[i] for i in wave], concurrency=concurrency, retry_throttled=False)
+            stats['num_requests'] += len(wave)
+            throttled = []
+            retry_after = 0
+            latencies = []
+            for i, response in zip(wave, wave_responses):
+                attempts[i] += 1
+                responses[i] = response
+                if response is None or response.status_code in self.OCL_EXPORT_THROTTLE_STATUS_CODES:
+                    stats['num_throttled'] += 1
+                    if attempts[i] < self.OCL_EXPORT_MAX_ATTEMPTS:
+                        throttled.append(i)
+                    if response is not None and response.headers.get('Retry-After', '').isdigit():
+                        retry_after = max(retry_after, int(response.headers['Retry-After']))
                 else:
-                    zipref.close()
-                    errmsg = 'ERROR: Invalid export for "%s": export.json not found.' % (
-                        original_export_url)
-                    self.vlog(1, errmsg)
-                    raise Exception(errmsg)
-        self.vlog(1, '%s repository exports for version "%s" retrieved at endpoint "%s"' % (
-            len(collection_results), country_version_id, endpoint))
-        return collection_results
+                    latencies.append(response.elapsed.total_seconds())
+
+            if throttled or len(latencies) < len(wave):
+                num_throttled_waves += 1
+                concurrency = max(1, concurrency // 2)
+                pending = throttled + pending
+                backoff = min(retry_after or num_throttled_waves, self.OCL_EXPORT_MAX_BACKOFF_SECONDS)
+                self.vlog(1, 'THROTTLED: %s of %s requests. Concurrency lowered to %s. Waiting %s seconds...' % (
+                    len(wave) - len(latencies), len(wave), concurrency, backoff))
+                if throttled:
+                    time.sleep(backoff)
+            elif latencies:
+                num_throttled_waves = 0
+                latencies.sort()
+                latency = latencies[len(latencies) // 2]
+                if best_latency is None or latency < best_latency:
+                    best_latency = latency
+                if latency > 2 * best_latency:
+                    concurrency = max(1, concurrency - 1)
+                elif concurrency < max_concurrency:
+                    concurrency += 1
+                self.vlog(2, 'Median latency %.3f seconds (best %.3f). Concurrency set to %s' % (
+                    latency, best_latency, concurrency))
+            stats['min_concurrency'] = min(stats['min_concurrency'], concurrency)
+            stats['max_concurrency'] = max(stats['max_concurrency'], concurrency)
+        stats['final_concurrency'] = concurrency
+        return responses, stats
 
     def get_ocl_export(self, endpoint='', version='', zipfilename='', jsonfilename='',
                        delay_seconds=5, max_wait_seconds=120):
@@ -474,18 +852,55 @@ class DatimBase(object):
         Use version="latest" to fetch the most recent released repo version.
         Note that if the export is not already cached, it will attempt to generate
         the export and wait for 30 seconds before trying again. If the export still
-        does not exist, this method will fail.
+        does not exist, this method will fail. Use get_ocl_export_json to load the export
+        without writing it to file.
         :param endpoint: endpoint for repo only, e.g. '/orgs/myorg/sources/mysource/'
         :param version: repo version ID or "latest"
         :param zipfilename: Filename to save the compressed OCL export to
         :param jsonfilename: Filename to save the decompressed OCL-JSON export to
         :return: bool True upon success; False otherwise
         """
+        export_content = self.get_ocl_export_zip(
+            endpoint=endpoint, version=version, delay_seconds=delay_seconds,
+            max_wait_seconds=max_wait_seconds)
+        self.save_ocl_export_files(export_content, zipfilename=zipfilename, jsonfilename=jsonfilename)
+        return True
+
+    def get_ocl_export_json(self, endpoint='', version='', zipfilename='', jsonfilename='',
+                            delay_seconds=5, max_wait_seconds=120):
+        """
+        Fetches an export of the specified repository version and returns its export.json,
+        decompressed in memory. The export is also saved to file if self.save_ocl_exports is
+        set, e.g. for debugging or for later use with run_ocl_offline.
+        :param endpoint: endpoint for repo only, e.g. '/orgs/myorg/sources/mysource/'
+        :param version: repo version ID or "latest"
+        :param zipfilename: Filename to save the compressed OCL export to
+        :param jsonfilename: Filename to save the decompressed OCL-JSON export to
+        :return: <dict> OCL-formatted JSON export
+        """
+        export_content = self.get_ocl_export_zip(
+            endpoint=endpoint, version=version, delay_seconds=delay_seconds,
+            max_wait_seconds=max_wait_seconds)
+        if self.save_ocl_exports:
+            self.save_ocl_export_files(
+                export_content, zipfilename=zipfilename, jsonfilename=jsonfilename)
+        return self.get_export_json_from_zip(
+            export_content, export_url=self.oclenv + endpoint + version + '/export/')
+
+    def get_ocl_export_zip(self, endpoint='', version='', delay_seconds=5, max_wait_seconds=120):
+        """
+        Fetches the compressed export of the specified repository version from the export cache
+        or from OCL. Exports of versions other than "HEAD" are saved to and served from the
+        export cache (see DatimExportCache).
+        :param endpoint: endpoint for repo only, e.g. '/orgs/myorg/sources/mysource/'
+        :param version: repo version ID or "latest"
+        :return: <bytes> Compressed OCL export
+        """
         # Get the latest version of the repo
         if version == 'latest':
             url_latest_version = self.oclenv + endpoint + 'latest/'
             self.vlog(1, 'Latest version request URL:', url_latest_version)
-            response = requests.get(url_latest_version, headers=self.oclapiheaders)
+            response = self.http_engine.get(url_latest_version, headers=self.oclapiheaders)
             response.raise_for_status()
             latest_version_attr = response.json()
             repo_version_id = latest_version_attr['id']
@@ -493,10 +908,54 @@ class DatimBase(object):
         else:
             repo_version_id = version
 
-        # Get the export
+        # Get the export from the export cache, which skips "HEAD" since it changes over time
         url_ocl_export = self.oclenv + endpoint + repo_version_id + '/export/'
         self.vlog(1, 'Export URL:', url_ocl_export)
-        r = requests.get(url_ocl_export, headers=self.oclapiheaders)
+        export_cache_key = None
+        export_content = None
+        if self.export_cache:
+            export_cache_key = self.export_cache.get_key(self.oclenv, endpoint, repo_version_id)
+            export_content = self.export_cache.get(export_cache_key)
+        if export_content is not None:
+            self.vlog(1, 'Export found in the export cache')
+        else:
+            export_content = self.get_ocl_export_content(
+                url_ocl_export, delay_seconds=delay_seconds, max_wait_seconds=max_wait_seconds)
+            if self.export_cache:
+                self.export_cache.put(export_cache_key, export_content)
+        return export_content
+
+    def save_ocl_export_files(self, export_content, zipfilename='', jsonfilename=''):
+        """
+        Saves a compressed OCL export and its decompressed export.json to the data folder
+        :param export_content: <bytes> Compressed OCL export
+        :param zipfilename: Filename to save the compressed OCL export to, if set
+        :param jsonfilename: Filename to save the decompressed OCL-JSON export to, if set
+        """
+        if zipfilename:
+            with open(self.attach_absolute_data_path(zipfilename), 'wb') as handle:
+                handle.write(export_content)
+            self.vlog(1, 'Compressed export saved to: %s' % (zipfilename))
+
+        # Decompress the export file. export.json is written to a temporary file and renamed,
+        # because exports of other repositories may be decompressed concurrently.
+        if jsonfilename:
+            json_filename = self.attach_absolute_data_path(jsonfilename)
+            temp_json_filename = '%s.%s.%s.tmp' % (json_filename, os.getpid(), threading.get_ident())
+            with zipfile.ZipFile(BytesIO(export_content)) as zipref:
+                with zipref.open('export.json') as handle_export, open(temp_json_filename, 'wb') as handle:
+                    shutil.copyfileobj(handle_export, handle)
+            os.replace(temp_json_filename, json_filename)
+            self.vlog(1, 'Export decompressed to "%s"' % jsonfilename)
+
+    def get_ocl_export_content(self, url_ocl_export, delay_seconds=5, max_wait_seconds=120):
+        """
+        Fetches the compressed export at the specified export URL, generating the export in OCL
+        if it does not exist yet
+        :param url_ocl_export: e.g. https://api.openconceptlab.org/orgs/myorg/sources/mysource/v1/export/
+        :return: <bytes> Compressed OCL export
+        """
+        r = self.http_engine.get(url_ocl_export, headers=self.oclapiheaders)
         r.raise_for_status()
         if r.status_code == 200:
             # Export successfully retrieved
@@ -517,22 +976,7 @@ class DatimBase(object):
             msg = 'ERROR: Unrecognized response from OCL: %s' % str(r.status_code)
             self.vlog(1, msg)
             raise Exception(msg)
-
-        # Write compressed export to file
-        with open(self.attach_absolute_data_path(zipfilename), 'wb') as handle:
-            for block in r.iter_content(1024):
-                handle.write(block)
-        self.vlog(1, 'Compressed export saved to: %s' % (zipfilename))
-
-        # Decompress the export file and rename
-        zipref = zipfile.ZipFile(self.attach_absolute_data_path(zipfilename))
-        zipref.extractall(os.path.join(self.__location__, self.DATA_SUBFOLDER_NAME))
-        zipref.close()
-        os.rename(self.attach_absolute_data_path('export.json'),
-                  self.attach_absolute_data_path(jsonfilename))
-        self.vlog(1, 'Export decompressed to "%s"' % jsonfilename)
-
-        return True
+        return r.content
 
     def wait_for_repository_version_export(self, repo_export_url, delay_seconds=5,
                                            max_wait_seconds=120, do_wait_on_first_loop=False):
@@ -555,7 +999,7 @@ class DatimBase(object):
             is_first_loop = False
 
             # Request the export
-            r = requests.get(repo_export_url, headers=self.oclapiheaders)
+            r = self.http_engine.get(repo_export_url, headers=self.oclapiheaders)
             r.raise_for_status()
             if r.status_code == 200:
                 return r
@@ -587,13 +1031,13 @@ class DatimBase(object):
         """
 
         # Confirm that the export is still not available
-        r = requests.get(repo_export_url, headers=self.oclapiheaders)
+        r = self.http_engine.get(repo_export_url, headers=self.oclapiheaders)
         r.raise_for_status()
         if r.status_code == 200:
             return r
 
         # Make the initial request to generate the export
-        request_create_export = requests.post(
+        request_create_export = self.http_engine.post(
             repo_export_url, headers=self.oclapiheaders, allow_redirects=True)
         if request_create_export.status_code == 409:
             # 409 conflict means that repo export is already being processed, so go ahead
@@ -631,6 +1075,36 @@ class DatimBase(object):
             n -= 1
         return start
 
+    @staticmethod
+    def get_resource_fingerprint(resource):
+        """
+        Returns a canonical, hashable fingerprint of an OCL resource dictionary: its JSON
+        serialization with sorted keys. Resources with equal fingerprints are equal.
+        :param resource: <dict>
+        :return: <str>
+        """
+        return json.dumps(resource, sort_keys=True, separators=(',', ':'), default=str)
+
+    @staticmethod
+    def dedup_list(items, keep_last=False, key=None):
+        """
+        Removes duplicates from a list in linear time without changing the order of the
+        remaining items
+        :param items: <list>
+        :param keep_last: Keep the last occurrence of each item instead of the first if True
+        :param key: Function returning a hashable fingerprint of an item, e.g.
+            DatimBase.get_resource_fingerprint for OCL resources. Items must be hashable if omitted.
+        :return: <list>
+        """
+        keys = [key(item) for item in items] if key else items
+        if keep_last:
+            positions = dict((item_key, i) for i, item_key in enumerate(keys))
+        else:
+            positions = {}
+            for i, item_key in enumerate(keys):
+                positions.setdefault(item_key, i)
+        return [item for i, item in enumerate(items) if positions[keys[i]] == i]
+
     @staticmethod
     def replace_attr(str_input, attributes):
         """
@@ -653,7 +1127,7 @@ class DatimBase(object):
         repo_versions_url = '%s%sversions/?limit=0' % (self.oclenv, repo_endpoint)
         self.vlog(1, 'Fetching latest repository version for period "%s": %s' % (
             period, repo_versions_url))
-        r = requests.get(repo_versions_url, headers=self.oclapiheaders)
+        r = self.http_engine.get(repo_versions_url, headers=self.oclapiheaders)
         repo_versions = r.json()
         for repo_version in repo_versions:
             if repo_version['id'] == 'HEAD' or repo_version['released'] is not True:
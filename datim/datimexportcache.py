@@ -0,0 +1,254 @@
+"""
+Class to cache compressed OCL repository version exports on disk.
+
+Exports of a released repository version (e.g. DAA-FY23.v0) do not change, so they are
+downloaded once and then served from the cache. Exports are stored once per content in the cache
+folder, named by their SHA-256 checksum, which is verified on every read. An index file maps
+each (OCL environment, repository endpoint, version ID) key to its export, e.g.:
+    {
+        "https://api.openconceptlab.org|/orgs/PEPFAR/sources/DATIM-MOH-FY21/|FY21.v1": {
+            "sha256": "9f2c...",
+            "size": 1048576,
+            "last_used": 1591012800.0
+        }
+    }
+The least recently used exports are evicted when the cache exceeds its size limit. "latest"
+and "HEAD" are never cached, since they do not identify a fixed repository version. Content
+derived from an export is cached under the key of the export with a suffix, e.g. the DATIM-MOH
+structure of DatimImapExport.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import settings
+
+
+class DatimExportCache(object):
+    """
+    Content-addressed on-disk cache of compressed OCL repository version exports
+    """
+
+    # Default name of the cache folder in the data folder and of its index file
+    DEFAULT_DIRNAME = 'export-cache'
+    INDEX_FILENAME = 'index.json'
+
+    # Default size limit of the cache in bytes, overridden by settings.ocl_export_cache_max_bytes
+    DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+    # Version IDs that do not identify a fixed repository version
+    UNCACHED_VERSION_IDS = ('latest', 'HEAD')
+
+    # Minimum number of seconds between index writes when only the last use time changes
+    LAST_USED_RESOLUTION_SECONDS = 60
+
+    __default_caches = {}
+    __default_caches_lock = threading.Lock()
+
+    def __init__(self, dirname='', max_bytes=None):
+        """
+        :param dirname: Full path of the cache folder
+        :param max_bytes: Size limit of the cache in bytes. Defaults to
+            settings.ocl_export_cache_max_bytes, or DEFAULT_MAX_BYTES if not set.
+        """
+        self.dirname = dirname
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'ocl_export_cache_max_bytes', self.DEFAULT_MAX_BYTES)
+        self.max_bytes = max_bytes
+        self.__index = None
+        self.__lock = threading.RLock()
+
+    @classmethod
+    def get_default(cls, dirname):
+        """
+        Returns the cache shared by all DatimBase objects for the cache folder, or None if the
+        cache is disabled by setting settings.ocl_export_cache_max_bytes to 0
+        :param dirname: Full path of the cache folder
+        :return: DatimExportCache
+        """
+        if not getattr(settings, 'ocl_export_cache_max_bytes', cls.DEFAULT_MAX_BYTES):
+            return None
+        with cls.__default_caches_lock:
+            if dirname not in cls.__default_caches:
+                cls.__default_caches[dirname] = cls(dirname=dirname)
+            return cls.__default_caches[dirname]
+
+    @staticmethod
+    def get_key(oclenv, repo_endpoint, repo_version_id):
+        """
+        Returns the cache key of a repository version export, or None if the version ID does
+        not identify a fixed repository version
+        :param oclenv: e.g. https://api.openconceptlab.org
+        :param repo_endpoint: e.g. /orgs/PEPFAR/sources/DATIM-MOH-FY21/
+        :param repo_version_id: e.g. FY21.v1
+        :return: <str>
+        """
+        if not repo_version_id or repo_version_id in DatimExportCache.UNCACHED_VERSION_IDS:
+            return None
+        if not repo_endpoint.endswith('/'):
+            repo_endpoint += '/'
+        return '%s|%s|%s' % (oclenv.rstrip('/'), repo_endpoint, repo_version_id)
+
+    def get_export_filename(self, sha256):
+        """ Returns the full path of the cached export with the specified checksum """
+        return os.path.join(self.dirname, '%s.zip' % sha256)
+
+    def load(self, reload=False):
+        """
+        Loads the index from the index file. A missing file is treated as an empty cache.
+        :param reload: Re-read the index file, e.g. to see entries saved by other processes
+        :return: <dict> Index entries keyed by cache key
+        """
+        with self.__lock:
+            if self.__index is None or reload:
+                index = {}
+                index_filename = os.path.join(self.dirname, self.INDEX_FILENAME)
+                if os.path.isfile(index_filename):
+                    try:
+                        with open(index_filename, 'r') as handle:
+                            index = json.load(handle)
+                    except ValueError:
+                        index = {}
+                self.__index = index
+            return self.__index
+
+    def save(self):
+        """ Writes the index to the index file, replacing it atomically """
+        with self.__lock:
+            self.write_file(self.INDEX_FILENAME, json.dumps(self.load(), sort_keys=True).encode())
+
+    def write_file(self, filename, content):
+        """ Writes a file in the cache folder through a temporary file """
+        with self.__lock:
+            if not os.path.isdir(self.dirname):
+                os.makedirs(self.dirname, exist_ok=True)
+            full_filename = os.path.join(self.dirname, filename)
+            temp_filename = '%s.%s.%s.tmp' % (full_filename, os.getpid(), threading.get_ident())
+            with open(temp_filename, 'wb') as handle:
+                handle.write(content)
+            os.replace(temp_filename, full_filename)
+
+    def get(self, key):
+        """
+        Returns the cached compressed export for the key, or None if it is not cached or if its
+        checksum does not match, in which case the entry is removed
+        :param key: Cache key returned by get_key
+        :return: <bytes>
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Returns the cached compressed exports for the keys, omitting the keys that are not
+        cached or whose checksum does not match, whose entries are removed. The index is read
+        from disk only once, and written at most once to update the last use times.
+        :param keys: <list> of cache keys returned by get_key. Empty keys are ignored.
+        :return: <dict> key: <bytes>
+        """
+        contents = {}
+        with self.__lock:
+            index = self.load()
+            now = time.time()
+            is_index_changed = False
+            for key in keys:
+                entry = index.get(key) if key else None
+                if not entry:
+                    continue
+                try:
+                    with open(self.get_export_filename(entry['sha256']), 'rb') as handle:
+                        content = handle.read()
+                except IOError:
+                    content = None
+                if content is None or hashlib.sha256(content).hexdigest() != entry['sha256']:
+                    del index[key]
+                    self.delete_unused_export(index, entry['sha256'])
+                    is_index_changed = True
+                    continue
+                contents[key] = content
+                if now - entry.get('last_used', 0) > self.LAST_USED_RESOLUTION_SECONDS:
+                    entry['last_used'] = now
+                    is_index_changed = True
+            if is_index_changed:
+                self.save()
+        return contents
+
+    def put(self, key, content):
+        """
+        Caches a compressed export for the key and evicts the least recently used exports
+        if the cache exceeds its size limit
+        :param key: Cache key returned by get_key
+        :param content: <bytes> Compressed export
+        """
+        self.put_many([(key, content)])
+
+    def put_many(self, items):
+        """
+        Caches compressed exports and evicts the least recently used exports if the cache
+        exceeds its size limit. The index is re-read once, to keep the entries saved by other
+        processes, and written once.
+        :param items: <list> of (key, content) tuples, where key is returned by get_key and
+            content is the compressed export <bytes>. Items with an empty key are ignored.
+        """
+        items = [(key, content) for key, content in items
+                 if key and content and len(content) <= self.max_bytes]
+        if not items:
+            return
+        with self.__lock:
+            index = self.load(reload=True)
+            now = time.time()
+            for key, content in items:
+                sha256 = hashlib.sha256(content).hexdigest()
+                if not os.path.isfile(self.get_export_filename(sha256)):
+                    self.write_file('%s.zip' % sha256, content)
+                index[key] = {'sha256': sha256, 'size': len(content), 'last_used': now}
+            self.evict(index)
+            self.save()
+
+    def remove(self, key):
+        """ Removes the entry for the key and its export, unless another key shares it """
+        with self.__lock:
+            index = self.load(reload=True)
+            entry = index.pop(key, None)
+            if entry is not None:
+                self.delete_unused_export(index, entry['sha256'])
+                self.save()
+
+    def remove_prefix(self, oclenv, endpoint_prefix):
+        """
+        Removes the entries of all repositories under an endpoint, e.g. when the country org
+        /orgs/DATIM-MOH-BI-FY19/ is deleted and its repository versions are created again
+        :param oclenv: e.g. https://api.openconceptlab.org
+        :param endpoint_prefix: e.g. /orgs/DATIM-MOH-BI-FY19/
+        """
+        key_prefix = '%s|%s' % (oclenv.rstrip('/'), endpoint_prefix)
+        with self.__lock:
+            index = self.load(reload=True)
+            keys = [key for key in index if key.startswith(key_prefix)]
+            if keys:
+                sha256s = set(index.pop(key)['sha256'] for key in keys)
+                for sha256 in sha256s:
+                    self.delete_unused_export(index, sha256)
+                self.save()
+
+    def evict(self, index):
+        """ Removes least recently used entries from the index until it fits the size limit """
+        sizes = dict((entry['sha256'], entry['size']) for entry in index.values())
+        total_size = sum(sizes.values())
+        for key, entry in sorted(list(index.items()), key=lambda item: item[1]['last_used']):
+            if total_size <= self.max_bytes:
+                break
+            del index[key]
+            if self.delete_unused_export(index, entry['sha256']):
+                total_size -= entry['size']
+
+    def delete_unused_export(self, index, sha256):
+        """ Deletes the export file if no entry of the index uses it. Returns True if deleted. """
+        if any(entry['sha256'] == sha256 for entry in index.values()):
+            return False
+        try:
+            os.remove(self.get_export_filename(sha256))
+        except OSError:
+            pass
+        return True
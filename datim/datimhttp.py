@@ -0,0 +1,159 @@
+"""
+Thread-pool based HTTP engine used by DatimBase and DatimImapFactory for all OCL API requests.
+
+Requests share one connection pool, have a timeout and are retried on connection errors and on
+429/503 responses with a Retry-After header. Callers that handle throttled responses themselves,
+such as the adaptive export requests of DatimBase, can turn off the retries on responses. Independent requests can be submitted to run in the
+background (see submit), and lists of URLs can be fetched with bounded concurrency (see map).
+"""
+import concurrent.futures
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import settings
+
+
+class OclHttpEngine(object):
+    """
+    HTTP engine with a shared connection pool, per-request timeouts, retries and a thread pool
+    for overlapping independent requests
+    """
+
+    # Defaults, which can be overridden with settings of the same name in lowercase
+    DEFAULT_MAX_WORKERS = 8
+    DEFAULT_TIMEOUT = (10, 300)  # (connect, read) in seconds
+    DEFAULT_RETRIES = 5
+    DEFAULT_BACKOFF_FACTOR = 0.2
+    DEFAULT_POOL_MAXSIZE = 32
+
+    __default_engine = None
+    __default_engine_lock = threading.Lock()
+
+    def __init__(self, max_workers=None, timeout=None, retries=None, backoff_factor=None,
+                 pool_maxsize=None):
+        """
+        :param max_workers: Number of threads for requests submitted with submit() or get_async()
+        :param timeout: Default timeout in seconds of each request, or a (connect, read) tuple
+        :param retries: Number of retries on connection errors and Retry-After responses
+        :param backoff_factor: Backoff factor between retries (see urllib3 Retry)
+        :param pool_maxsize: Maximum number of connections kept per host
+        """
+        self.max_workers = max_workers or getattr(
+            settings, 'ocl_http_max_workers', self.DEFAULT_MAX_WORKERS)
+        self.timeout = timeout or getattr(settings, 'ocl_http_timeout', self.DEFAULT_TIMEOUT)
+        if retries is None:
+            retries = getattr(settings, 'ocl_http_retries', self.DEFAULT_RETRIES)
+        if backoff_factor is None:
+            backoff_factor = self.DEFAULT_BACKOFF_FACTOR
+        pool_maxsize = max(pool_maxsize or self.DEFAULT_POOL_MAXSIZE, self.max_workers)
+        self.session = OclHttpEngine.create_session(
+            Retry(total=retries, backoff_factor=backoff_factor), pool_maxsize)
+        self.connection_retry_session = OclHttpEngine.create_session(
+            Retry(total=retries, backoff_factor=backoff_factor, respect_retry_after_header=False),
+            pool_maxsize)
+        self.__executor = None
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def create_session(retry, pool_maxsize):
+        """
+        Returns a session whose requests are retried as specified
+        :param retry: urllib3 Retry
+        :param pool_maxsize: Maximum number of connections kept per host
+        :return: <requests.Session>
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @classmethod
+    def get_default(cls):
+        """ Returns the engine shared by all DatimBase objects, creating it on first use """
+        with cls.__default_engine_lock:
+            if cls.__default_engine is None:
+                cls.__default_engine = cls()
+            return cls.__default_engine
+
+    def request(self, method, url, timeout=None, retry_throttled=True, **kwargs):
+        """
+        Submits a request and returns the response
+        :param method: HTTP method, e.g. "GET"
+        :param url:
+        :param timeout: Overrides the default timeout of the engine
+        :param retry_throttled: Retry 429/503 responses with a Retry-After header if True.
+            Otherwise only connection errors are retried and the response is returned.
+        :param kwargs: Passed on to requests.Session.request, e.g. headers and params
+        :return: <Response>
+        """
+        session = self.session if retry_throttled else self.connection_retry_session
+        return session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+
+    def get(self, url, **kwargs):
+        """ Submits a GET request (see request) """
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """ Submits a POST request (see request) """
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        """ Submits a DELETE request (see request) """
+        return self.request('DELETE', url, **kwargs)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) in the thread pool of the engine, so that it overlaps with the
+        calling thread. Functions submitted here must not wait on other submitted functions.
+        :return: <concurrent.futures.Future>
+        """
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='ocl-http')
+            return self.__executor.submit(fn, *args, **kwargs)
+
+    def get_async(self, url, **kwargs):
+        """ Submits a GET request in the background (see submit) """
+        return self.submit(self.get, url, **kwargs)
+
+    def map(self, urls, method='GET', concurrency=None, exception_handler=None, **kwargs):
+        """
+        Submits a request for each URL with at most concurrency requests in flight. Uses its own
+        threads, so it is safe to call from a function running in the thread pool of the engine.
+        :param urls: <list> of URLs
+        :param method: HTTP method, e.g. "GET"
+        :param concurrency: Defaults to max_workers
+        :param exception_handler: Called as exception_handler(url, exception) for failed requests
+        :param kwargs: Passed on to request, e.g. headers or retry_throttled
+        :return: <list> of responses in the order of the URLs, None for failed requests
+        """
+        urls = list(urls)
+        if not urls:
+            return []
+        concurrency = max(1, min(concurrency or self.max_workers, len(urls)))
+        responses = [None] * len(urls)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = dict(
+                (executor.submit(self.request, method, url, **kwargs), i) for i, url in enumerate(urls))
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                try:
+                    responses[i] = future.result()
+                except requests.exceptions.RequestException as err:
+                    if exception_handler:
+                        exception_handler(urls[i], err)
+        return responses
+
+    def close(self):
+        """ Waits for submitted requests to finish and closes the connection pool """
+        with self.__lock:
+            if self.__executor is not None:
+                self.__executor.shutdown(wait=True)
+                self.__executor = None
+        self.session.close()
+        self.connection_retry_session.close()
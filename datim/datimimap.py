@@ -1,20 +1,421 @@
 """
 DATIM IMAP object and its helper classes
 """
+import array
+import collections
+import collections.abc
 import csv
+import difflib
+import hashlib
 import io
+import itertools
 import json
 import re
 import sys
-from functools import cmp_to_key
+import types
+from operator import itemgetter
 
-import deepdiff
 import ocldev.oclconstants
 import ocldev.oclcsvtojsonconverter
-import requests
 
 from . import datimbase
+from . import datimhttp
 from . import datimimapexport
+from . import datimjsonstream
+
+
+class DatimImapRowStore(object):
+    """
+    Compact columnar storage for IMAP rows. Each column is an array of integer codes that
+    index into a table of unique values shared by all columns, so indicator IDs, disag IDs
+    and names that repeat across thousands of rows are stored only once per IMAP.
+    """
+
+    # Array typecode used for the column codes (unsigned int)
+    CODE_TYPECODE = 'I'
+
+    def __init__(self, field_names):
+        """ Constructor for DatimImapRowStore class """
+        self.field_names = tuple(field_names)
+        self.__field_index = dict((field_name, i) for i, field_name in enumerate(self.field_names))
+        self.__values = []
+        self.__value_codes = {}
+        self.__columns = [array.array(self.CODE_TYPECODE) for _ in self.field_names]
+
+    def __len__(self):
+        return len(self.__columns[0]) if self.__columns else 0
+
+    def __iter__(self):
+        for row_number in range(len(self)):
+            yield self.get_row(row_number)
+
+    def encode(self, value):
+        """
+        Returns the integer code for the value, adding it to the value table if new
+        :param value: <str>
+        :return: <int>
+        """
+        code = self.__value_codes.get(value)
+        if code is None:
+            if isinstance(value, str):
+                # Interned so that values repeated across IMAPs are also shared between stores
+                value = sys.intern(value)
+            code = len(self.__values)
+            self.__values.append(value)
+            self.__value_codes[value] = code
+        return code
+
+    def append(self, row):
+        """
+        Appends a row to the store. Fields missing from the row are stored as empty strings.
+        :param row: <dict>
+        :return: None
+        """
+        for field_name, column in zip(self.field_names, self.__columns):
+            column.append(self.encode(row.get(field_name, '')))
+
+    def append_values(self, values):
+        """
+        Appends a row given as a sequence of values in the same order as field_names
+        :param values: <list> or <tuple>
+        :return: None
+        """
+        encode = self.encode
+        for value, column in zip(values, self.__columns):
+            column.append(encode(value))
+
+    def get_value(self, row_number, field_name):
+        """
+        Returns the value of a single field without building the whole row
+        :param row_number: 0-based row number
+        :param field_name: IMAP field name
+        :return: <str>
+        """
+        return self.__values[self.__columns[self.__field_index[field_name]][row_number]]
+
+    def iter_values(self, field_name):
+        """
+        Iterates over the values of a single field in row order
+        :param field_name: IMAP field name
+        :return: <generator>
+        """
+        values = self.__values
+        for code in self.__columns[self.__field_index[field_name]]:
+            yield values[code]
+
+    def get_row(self, row_number):
+        """
+        Returns a new dictionary for the specified row
+        :param row_number: 0-based row number
+        :return: <dict>
+        """
+        values = self.__values
+        return dict(zip(self.field_names, [values[column[row_number]] for column in self.__columns]))
+
+    def num_unique_values(self):
+        """ Returns the number of unique values held by the store """
+        return len(self.__values)
+
+
+class DatimImapRowView(collections.abc.Mapping):
+    """
+    Read-only view of an IMAP row. Values are read from the row store when accessed and the
+    null disag, classification, extra info and blank disag transformations are applied
+    without allocating intermediate dictionaries. Use copy() to get a mutable dict.
+    """
+    __slots__ = ('__imap', '__store', '__row_number', '__field_names', '__disag_id',
+                 '__disag_name', '__blank_disag', '__include_extra_info', '__extra_columns')
+
+    def __init__(self, imap, store, row_number, field_names, include_extra_info=False,
+                 auto_fix_null_disag=True, show_null_disag_as_blank=False):
+        """ Constructor for DatimImapRowView class """
+        self.__imap = imap
+        self.__store = store
+        self.__row_number = row_number
+        self.__field_names = field_names
+        self.__include_extra_info = include_extra_info
+        self.__extra_columns = None
+        self.__disag_id = store.get_value(row_number, DatimImap.IMAP_FIELD_MOH_DISAG_ID)
+        self.__disag_name = store.get_value(row_number, DatimImap.IMAP_FIELD_MOH_DISAG_NAME)
+        if auto_fix_null_disag and DatimImap.is_null_disag(
+                store.get_value(row_number, DatimImap.IMAP_FIELD_MOH_INDICATOR_ID), self.__disag_id):
+            self.__disag_id = datimbase.DatimBase.NULL_DISAG_ID
+            self.__disag_name = datimbase.DatimBase.NULL_DISAG_NAME
+        self.__blank_disag = (
+            show_null_disag_as_blank and self.__disag_id == datimbase.DatimBase.NULL_DISAG_ID)
+
+    def __get_value(self, field_name):
+        """ Returns the value of a core field before the blank disag transformation """
+        if field_name == DatimImap.IMAP_FIELD_MOH_DISAG_ID:
+            return self.__disag_id
+        elif field_name == DatimImap.IMAP_FIELD_MOH_DISAG_NAME:
+            return self.__disag_name
+        return self.__store.get_value(self.__row_number, field_name)
+
+    def __get_extra_columns(self):
+        if self.__extra_columns is None:
+            self.__extra_columns = self.__imap.get_extra_columns_for_key(tuple(
+                self.__get_value(field_name) for field_name in DatimImap.IMAP_EXTRA_COLUMNS_KEY_FIELDS))
+        return self.__extra_columns
+
+    def __getitem__(self, field_name):
+        if field_name in self.__field_names:
+            if self.__blank_disag and field_name in (DatimImap.IMAP_FIELD_MOH_DISAG_ID,
+                                                     DatimImap.IMAP_FIELD_MOH_DISAG_NAME):
+                return ''
+            return self.__get_value(field_name)
+        elif self.__include_extra_info:
+            return self.__get_extra_columns()[field_name]
+        raise KeyError(field_name)
+
+    def __contains__(self, field_name):
+        return field_name in self.__field_names or (
+            self.__include_extra_info and field_name in self.__get_extra_columns())
+
+    def __iter__(self):
+        for field_name in self.__field_names:
+            yield field_name
+        if self.__include_extra_info:
+            for field_name in self.__get_extra_columns():
+                yield field_name
+
+    def __len__(self):
+        if self.__include_extra_info:
+            return len(self.__field_names) + len(self.__get_extra_columns())
+        return len(self.__field_names)
+
+    def __repr__(self):
+        return 'DatimImapRowView(%r)' % self.copy()
+
+    def copy(self):
+        """ Returns the row as a new, mutable dictionary """
+        row = self.__store.get_row(self.__row_number)
+        if len(row) != len(self.__field_names):
+            row = dict((field_name, row[field_name]) for field_name in self.__field_names)
+        if self.__blank_disag:
+            row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] = ''
+            row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME] = ''
+        else:
+            row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] = self.__disag_id
+            row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME] = self.__disag_name
+        if self.__include_extra_info:
+            row.update(self.__get_extra_columns())
+        return row
+
+
+class DatimImapRowKey(collections.namedtuple('DatimImapRowKey', [
+        'datim_source', 'datim_indicator_id', 'datim_disag_id', 'operation', 'moh_org',
+        'moh_indicator_id', 'moh_disag_id'])):
+    """
+    Hashable key uniquely identifying a mapping row of an IMAP. The key is a tuple and is
+    only serialized to its CSV string form, e.g. "DATIM-MOH,TX_CURR_N_MOH_Age_Sex,xyz,ADD,
+    DATIM-MOH-UG-FY19,de1,null-disag", when output requires it.
+    """
+    __slots__ = ()
+
+    # Value of the first field of every row key
+    DATIM_SOURCE = 'DATIM-MOH'
+
+    # Characters that require the CSV writer to quote a field
+    CSV_SPECIAL_CHARACTERS = (',', '"', '\r', '\n')
+
+    @classmethod
+    def from_row(cls, row, country_org):
+        """
+        Returns the key of an IMAP row. An empty MOH disag is keyed as the null disag.
+        :param row: <dict>
+        :param country_org:
+        :return: DatimImapRowKey
+        """
+        if row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID] and not row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]:
+            disag_id = datimbase.DatimBase.NULL_DISAG_ID
+        else:
+            disag_id = row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]
+        return cls(
+            cls.DATIM_SOURCE,
+            row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID],
+            row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID],
+            row[DatimImap.IMAP_FIELD_OPERATION],
+            country_org,
+            row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID],
+            disag_id)
+
+    @classmethod
+    def from_string(cls, row_key):
+        """
+        Parses the CSV string form of a row key. Returns None if row_key is empty.
+        :param row_key: <str>
+        :return: DatimImapRowKey or None
+        """
+        if not row_key:
+            return None
+        if '"' in row_key:
+            fields = next(csv.reader(io.StringIO(row_key), delimiter=','), [])
+        else:
+            fields = row_key.split(',')
+        if len(fields) != len(cls._fields):
+            raise ValueError('Invalid IMAP row key: "%s"' % row_key)
+        return cls(*fields)
+
+    def get_mapping_key(self):
+        """
+        Returns the (DATIM_Indicator_ID, DATIM_Disag_ID, MOH_Indicator_ID, MOH_Disag_ID) part
+        of the key used to look up rows in an IMAP
+        """
+        return (self.datim_indicator_id, self.datim_disag_id, self.moh_indicator_id,
+                self.moh_disag_id)
+
+    def to_dict(self):
+        """ Returns the key as a dictionary using the IMAP field names """
+        return {
+            'DATIM_Source': self.datim_source,
+            DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID: self.datim_indicator_id,
+            DatimImap.IMAP_FIELD_DATIM_DISAG_ID: self.datim_disag_id,
+            DatimImap.IMAP_FIELD_OPERATION: self.operation,
+            'MOH_Org': self.moh_org,
+            DatimImap.IMAP_FIELD_MOH_INDICATOR_ID: self.moh_indicator_id,
+            DatimImap.IMAP_FIELD_MOH_DISAG_ID: self.moh_disag_id,
+        }
+
+    def __str__(self):
+        """ Returns the key in its CSV string form """
+        for field in self:
+            if not isinstance(field, str) or any(c in field for c in self.CSV_SPECIAL_CHARACTERS):
+                si = io.StringIO()
+                cw = csv.writer(si)
+                cw.writerow(self)
+                return si.getvalue().strip('\r\n')
+        return ','.join(self)
+
+
+class DatimImapValidationIssue(collections.namedtuple('DatimImapValidationIssue', [
+        'severity', 'row_number', 'field_name', 'value', 'message'])):
+    """
+    A single error or warning found while validating an IMAP. row_number is 1-based.
+    """
+    __slots__ = ()
+
+    SEVERITY_ERROR = 'ERROR'
+    SEVERITY_WARNING = 'WARNING'
+
+    def __str__(self):
+        return self.message
+
+
+class DatimImapValidationReport(object):
+    """
+    Errors and warnings found by DatimImap.validate. is_truncated is True if validation
+    stopped early because the maximum number of errors was reached.
+    """
+
+    def __init__(self, errors=None, warnings=None, is_truncated=False):
+        """ Constructor for DatimImapValidationReport class """
+        self.errors = errors or []
+        self.warnings = warnings or []
+        self.is_truncated = is_truncated
+
+    def __bool__(self):
+        """ A report is truthy if the IMAP passed validation """
+        return not self.errors
+
+    def __str__(self):
+        return self.get_message()
+
+    def get_message(self):
+        """
+        Returns the errors followed by the warnings, one per line
+        :return: <str>
+        """
+        return ''.join(str(issue) + '\n' for issue in self.errors + self.warnings)
+
+
+class DatimImapIndex(object):
+    """
+    Hash indexes over the non-empty mappings of an IMAP used to answer the
+    DatimImap.has_country_* membership queries in constant time. Rows are indexed
+    after the null disag fix is applied, matching get_imap_data(exclude_empty_maps=True).
+    """
+
+    def __init__(self, rows=None):
+        """ Constructor for DatimImapIndex class """
+        self.num_rows = 0
+        self.country_indicator_ids = set()
+        self.country_indicator_names = set()
+        self.country_indicators = set()
+        self.country_disag_ids = set()
+        self.country_disag_names = set()
+        self.country_disags = set()
+        self.country_collection_ids = set()
+        self.country_operation_mappings = set()
+        self.country_operations = set()
+        self.country_datim_mappings = set()
+        self.row_numbers = {}
+        if rows:
+            for row_number, row in rows:
+                self.add_row(row, row_number)
+
+    def add_row(self, row, row_number):
+        """
+        Adds a non-empty, null disag fixed row to the indexes
+        :param row: <dict>
+        :param row_number: 0-based row number of the row in the IMAP
+        :return: None
+        """
+        self.num_rows += 1
+        indicator_id = row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]
+        indicator_name = row[DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME]
+        disag_id = row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]
+        disag_name = row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]
+        datim_mapping = DatimImapIndex.get_datim_mapping_key(row)
+        self.country_indicator_ids.add(indicator_id)
+        self.country_indicator_names.add(indicator_name)
+        self.country_indicators.add((indicator_id, indicator_name))
+        self.country_disag_ids.add(disag_id)
+        self.country_disag_names.add(disag_name)
+        self.country_disags.add((disag_id, disag_name))
+        self.country_collection_ids.add(DatimImap.get_collection_id(*datim_mapping))
+        self.country_datim_mappings.add(datim_mapping)
+        operation_mapping = DatimImapIndex.get_operation_mapping_key(row)
+        self.country_operation_mappings.add(operation_mapping)
+        self.country_operations.add(DatimImapIndex.get_country_operation_key(row))
+        self.row_numbers.setdefault(operation_mapping, row_number)
+
+    def get_row_number(self, row_key):
+        """
+        Returns the number of the first row matching the row key, or None if no row matches.
+        Only the DATIM and MOH indicator+disag IDs of the key are considered.
+        :param row_key: DatimImapRowKey
+        :return: <int> or None
+        """
+        return self.row_numbers.get(row_key.get_mapping_key())
+
+    @staticmethod
+    def get_datim_mapping_key(row):
+        """ Returns the (DATIM_Indicator_ID, DATIM_Disag_ID) key of a row """
+        return (row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID],
+                row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID])
+
+    @staticmethod
+    def get_country_operation_key(row):
+        """
+        Returns the (Operation, MOH_Indicator_ID, MOH_Disag_ID) key of a row. Rows with the same
+        key share one country operation mapping in OCL, even if they map to different DATIM
+        indicator+disag pairs.
+        """
+        return (row[DatimImap.IMAP_FIELD_OPERATION],
+                row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID],
+                row[DatimImap.IMAP_FIELD_MOH_DISAG_ID])
+
+    @staticmethod
+    def get_operation_mapping_key(row):
+        """
+        Returns the (DATIM_Indicator_ID, DATIM_Disag_ID, MOH_Indicator_ID, MOH_Disag_ID) key
+        of a row. Names and the operation are not part of the key.
+        """
+        return (row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID],
+                row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID],
+                row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID],
+                row[DatimImap.IMAP_FIELD_MOH_DISAG_ID])
 
 
 class DatimImap(object):
@@ -58,6 +459,20 @@ class DatimImap(object):
     # "extra" fields requested)
     IMAP_EXPORT_FIELD_NAMES = list(IMAP_IMPORT_FIELD_NAMES) + [IMAP_FIELD_MOH_CLASSIFICATION]
 
+    # The IMAP fields that the extra columns generated by add_columns_to_row depend on
+    IMAP_EXTRA_COLUMNS_KEY_FIELDS = (
+        IMAP_FIELD_DATIM_INDICATOR_ID,
+        IMAP_FIELD_DATIM_DISAG_ID,
+        IMAP_FIELD_DATIM_DISAG_NAME,
+        IMAP_FIELD_OPERATION,
+        IMAP_FIELD_MOH_INDICATOR_ID,
+        IMAP_FIELD_MOH_DISAG_ID,
+    )
+
+    # Field names exposed by row views with and without the classification column
+    IMAP_EXPORT_FIELD_NAMES_ALL = tuple(IMAP_EXPORT_FIELD_NAMES)
+    IMAP_EXPORT_FIELD_NAMES_NO_CLASSIFICATION = tuple(IMAP_IMPORT_FIELD_NAMES)
+
     # Additional fields generated and used by OCL to support the import process
     IMAP_EXTRA_FIELD_MODIFIED_MOH_INDICATOR_ID = 'Modified MOH_Indicator_ID'
     IMAP_EXTRA_FIELD_MODIFIED_MOH_DISAG_ID = 'Modified MOH_Disag_ID'
@@ -135,36 +550,60 @@ class DatimImap(object):
     # Set to True to treat equal MOH_Indicator/MOH_Disag_IDs in the same row as a null MOH disag
     SET_EQUAL_MOH_ID_TO_NULL_DISAG = False
 
+    # Row hashes are summed modulo 2^256 to build the order-independent indicator group hashes
+    FINGERPRINT_MASK = (1 << 256) - 1
+
     def __init__(self, country_code='', country_org='', country_name='', period='', version=None,
-                 imap_data=None, do_add_columns_to_csv=True):
-        """ Constructor for DatimImap class """
+                 imap_data=None, do_add_columns_to_csv=True, collection_versions=None):
+        """
+        Constructor for DatimImap class
+        :param collection_versions: <dict> Version ID of each country collection the IMAP was
+            exported from, e.g. {"HTS_TST_N_MOH": "FY19.v1"}
+        """
+        self.__extra_columns_cache = {}
+        self.__extra_info_constants = None
         self.country_code = country_code
         self.country_org = country_org
         self.country_name = country_name
         self.period = period
         self.version = version
         self.do_add_columns_to_csv = do_add_columns_to_csv
+        self.collection_versions = collection_versions or {}
         self.__imap_data = None
+        self.__index = None
+        self.__empty_map_row_numbers = None
+        self.__sorted_row_numbers = {}
+        self.__indicator_fingerprints = {}
+        self.__duplicate_row_key_indicator_ids = {}
+        self.__fingerprints = {}
         self.set_imap_data(imap_data)
 
-    def __iter__(self):
-        """ Iterator for the DatimImap class """
-        self._current_iter = 0
-        return self
+    @property
+    def country_org(self):
+        """ Country org ID, e.g. DATIM-MOH-UG-FY19 """
+        return self.__country_org
+
+    @country_org.setter
+    def country_org(self, country_org):
+        self.__country_org = country_org
+        self.clear_extra_info_cache()
+
+    @property
+    def period(self):
+        """ IMAP period, e.g. FY19 """
+        return self.__period
 
-    def __next__(self):
+    @period.setter
+    def period(self, period):
+        self.__period = period
+        self.clear_extra_info_cache()
+
+    def __iter__(self):
         """
-        Iterator for the DatimImap class
-        :return:
+        Iterator for the DatimImap class. Each call returns an independent iterator, so nested
+        loops over the same IMAP do not interfere. Use iter_rows() to customize the rows returned.
         """
-        # TODO: Provide a way to customize how the rows are returned when doing this loop
-        if self._current_iter >= len(self.__imap_data):
-            raise StopIteration
-        else:
-            self._current_iter += 1
-            return self.get_row(
-                self._current_iter - 1, include_extra_info=self.do_add_columns_to_csv,
-                auto_fix_null_disag=True, convert_to_dict=False, exclude_empty_maps=False)
+        return self.iter_rows(include_extra_info=self.do_add_columns_to_csv, auto_fix_null_disag=True)
 
     @staticmethod
     def get_format_from_string(format_string, default_fmt=DATIM_IMAP_FORMAT_CSV):
@@ -181,7 +620,7 @@ class DatimImap(object):
 
     def get_row(self, row_number, include_extra_info=False, exclude_classification=False,
                 auto_fix_null_disag=True, convert_to_dict=False, exclude_empty_maps=False,
-                show_null_disag_as_blank=False):
+                show_null_disag_as_blank=False, as_view=False):
         """
         Returns the specified IMAP row in the requested format
         :param row_number: 0-based row number of the IMAP to return
@@ -191,35 +630,25 @@ class DatimImap(object):
         :param convert_to_dict: Returns the IMAP row as a dict with a unique row key if True
         :param exclude_empty_maps: Returns None if row represents an empty map
         :param show_null_disag_as_blank:
-        :return: Returns list, dict, or None
+        :param as_view: Returns a read-only DatimImapRowView instead of a new dict if True
+        :return: Returns dict, DatimImapRowView, or None
         """
-        row = self.__imap_data[row_number].copy()
-        if row and exclude_empty_maps and DatimImap.is_empty_map(row):
+        if exclude_empty_maps and row_number in self.get_empty_map_row_numbers():
             return None
-
-        # (Optionally) Replace alternative null disag representations with actual null disag concept
-        if row and auto_fix_null_disag:
-            row = DatimImap.fix_null_disag_in_row(row)
-
-        # (Optionally) Exclude classification - used by diff method
-        if row and exclude_classification and self.IMAP_FIELD_MOH_CLASSIFICATION in row:
-            row = row.copy()
-            del row[self.IMAP_FIELD_MOH_CLASSIFICATION]
-
-        # (Optionally) Add extra info
-        if row and include_extra_info:
-            row = self.add_columns_to_row(row)
-
-        # (Optionally) Replace null disags with blank disag ID/Name values
-        if (row and show_null_disag_as_blank and
-                row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] == datimbase.DatimBase.NULL_DISAG_ID):
+        if exclude_classification:
+            field_names = self.IMAP_EXPORT_FIELD_NAMES_NO_CLASSIFICATION
+        else:
+            field_names = self.IMAP_EXPORT_FIELD_NAMES_ALL
+        row = DatimImapRowView(
+            self, self.__imap_data, row_number, field_names,
+            include_extra_info=include_extra_info, auto_fix_null_disag=auto_fix_null_disag,
+            show_null_disag_as_blank=show_null_disag_as_blank)
+        if not as_view:
             row = row.copy()
-            row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] = ''
-            row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME] = ''
 
         # (Optionally) Convert results to dictionary with a unique key
-        if row and convert_to_dict:
-            return {DatimImap.get_imap_row_key(row, self.country_org): row}
+        if convert_to_dict:
+            return {DatimImapRowKey.from_row(row, self.country_org): row}
 
         return row
 
@@ -244,13 +673,22 @@ class DatimImap(object):
         :param row: Row to be checked
         :return: bool
         """
-        if not row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]:
+        return DatimImap.is_null_disag(
+            row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID], row[DatimImap.IMAP_FIELD_MOH_DISAG_ID])
+
+    @staticmethod
+    def is_null_disag(moh_indicator_id, moh_disag_id):
+        """
+        Returns True if the specified MOH indicator+disag ID pair represents a null disag
+        :param moh_indicator_id:
+        :param moh_disag_id:
+        :return: bool
+        """
+        if not moh_indicator_id:
             return False
-        if (row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] == datimbase.DatimBase.NULL_DISAG_ID or
-                not row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]):
+        if moh_disag_id == datimbase.DatimBase.NULL_DISAG_ID or not moh_disag_id:
             return True
-        elif (row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] == row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID] and
-              DatimImap.SET_EQUAL_MOH_ID_TO_NULL_DISAG):
+        elif moh_disag_id == moh_indicator_id and DatimImap.SET_EQUAL_MOH_ID_TO_NULL_DISAG:
             return True
         return False
 
@@ -269,7 +707,7 @@ class DatimImap(object):
 
     def get_imap_data(self, sort=False, exclude_empty_maps=False, exclude_classification=False,
                       convert_to_dict=False, include_extra_info=False, auto_fix_null_disag=True,
-                      show_null_disag_as_blank=False):
+                      show_null_disag_as_blank=False, as_view=False):
         """
         Returns data for the entire IMAP based on the parameters sent
         :param sort: Returns sorted list if True. Ignored if convert_to_dict is True
@@ -279,30 +717,178 @@ class DatimImap(object):
         :param include_extra_info: Add extra pre-processing columns used for import into OCL
         :param auto_fix_null_disag: Replaces empty disags with 'null-disag' if True
         :param show_null_disag_as_blank:
+        :param as_view: Return read-only DatimImapRowView objects instead of new dicts if True
         :return: <list> or <dict>
         """
+        rows = self.iter_rows(
+            sort=sort,
+            exclude_empty_maps=exclude_empty_maps,
+            exclude_classification=exclude_classification,
+            convert_to_dict=convert_to_dict,
+            include_extra_info=include_extra_info,
+            auto_fix_null_disag=auto_fix_null_disag,
+            show_null_disag_as_blank=show_null_disag_as_blank,
+            as_view=as_view)
         if convert_to_dict:
             data = {}
+            for row in rows:
+                data.update(row)
+            return data
+        return list(rows)
+
+    def iter_rows(self, sort=False, exclude_empty_maps=False, exclude_classification=False,
+                  convert_to_dict=False, include_extra_info=False, auto_fix_null_disag=True,
+                  show_null_disag_as_blank=False, as_view=False, datim_indicator_id=None,
+                  datim_indicator_category=None, operation=None, is_empty_map=None):
+        """
+        Generator that yields the IMAP rows one at a time. Accepts the same options as
+        get_imap_data plus optional filters. A filter value may be a single value or a
+        list/set of values. Filters are applied to the stored values before any row is built.
+        Each call returns an independent generator.
+        :param sort: Yields rows in sorted order if True. Ignored if convert_to_dict is True
+        :param exclude_empty_maps: Rows with empty maps are skipped if True
+        :param exclude_classification: Optionally exclude the classification column
+        :param convert_to_dict: Yield single-item dictionaries keyed by DatimImapRowKey if True
+        :param include_extra_info: Add extra pre-processing columns used for import into OCL
+        :param auto_fix_null_disag: Replaces empty disags with 'null-disag' if True
+        :param show_null_disag_as_blank:
+        :param as_view: Yield read-only DatimImapRowView objects instead of new dicts if True
+        :param datim_indicator_id: Only yield rows with this DATIM indicator ID
+        :param datim_indicator_category: Only yield rows with this DATIM indicator category
+        :param operation: Only yield rows with this operation, e.g. ADD
+        :param is_empty_map: Only yield empty maps if True, or only non-empty maps if False
+        :return: <generator>
+        """
+        filters = []
+        for field_name, value in ((self.IMAP_FIELD_DATIM_INDICATOR_ID, datim_indicator_id),
+                                  (self.IMAP_FIELD_DATIM_INDICATOR_CATEGORY, datim_indicator_category),
+                                  (self.IMAP_FIELD_OPERATION, operation)):
+            if value is None:
+                continue
+            if isinstance(value, str):
+                value = (value,)
+            filters.append((field_name, frozenset(value)))
+        if exclude_empty_maps:
+            if is_empty_map:
+                return
+            is_empty_map = False
+        empty_map_row_numbers = self.get_empty_map_row_numbers() if is_empty_map is not None else None
+
+        if sort and not convert_to_dict:
+            row_numbers = self.get_sorted_row_numbers(
+                auto_fix_null_disag=auto_fix_null_disag,
+                show_null_disag_as_blank=show_null_disag_as_blank)
         else:
-            data = []
-        for row_number in range(self.length()):
-            row = self.get_row(
+            row_numbers = range(self.length())
+        for row_number in row_numbers:
+            if is_empty_map is not None and (row_number in empty_map_row_numbers) != is_empty_map:
+                continue
+            if filters and not all(self.__imap_data.get_value(row_number, field_name) in values
+                                   for field_name, values in filters):
+                continue
+            yield self.get_row(
                 row_number,
                 include_extra_info=include_extra_info,
-                exclude_empty_maps=exclude_empty_maps,
                 exclude_classification=exclude_classification,
                 convert_to_dict=convert_to_dict,
                 auto_fix_null_disag=auto_fix_null_disag,
-                show_null_disag_as_blank=show_null_disag_as_blank)
-            if not row:
-                continue
-            if convert_to_dict:
-                data.update(row.copy())
-            else:
-                data.append(row.copy())
-        if sort and not convert_to_dict:
-            data = DatimImap.multikeysort(data, self.IMAP_IMPORT_FIELD_NAMES)
-        return data
+                show_null_disag_as_blank=show_null_disag_as_blank,
+                as_view=as_view)
+
+    def get_sorted_row_numbers(self, auto_fix_null_disag=True, show_null_disag_as_blank=False):
+        """
+        Returns the row numbers of the IMAP ordered by the IMAP import fields, as used by
+        get_imap_data(sort=True). The null disag options affect the sort order and must match
+        the options used to return the rows. The order is cached until the IMAP data is set.
+        :param auto_fix_null_disag:
+        :param show_null_disag_as_blank:
+        :return: <tuple>
+        """
+        cache_key = (bool(auto_fix_null_disag), bool(show_null_disag_as_blank))
+        sorted_row_numbers = self.__sorted_row_numbers.get(cache_key)
+        if sorted_row_numbers is None:
+            rows = [self.get_row(row_number, as_view=True, auto_fix_null_disag=auto_fix_null_disag,
+                                 show_null_disag_as_blank=show_null_disag_as_blank)
+                    for row_number in range(self.length())]
+            sorted_row_numbers = tuple(DatimImap.multikeysort_order(rows, self.IMAP_IMPORT_FIELD_NAMES))
+            self.__sorted_row_numbers[cache_key] = sorted_row_numbers
+        return sorted_row_numbers
+
+    def get_indicator_fingerprints(self, exclude_empty_maps=True):
+        """
+        Returns a content hash for each DATIM indicator group of the IMAP. A group hash is the
+        sum (modulo 2^256) of the SHA-256 hashes of its rows, so it does not depend on row order
+        and is computed in a single pass without sorting. Rows are hashed as they are imported
+        into OCL: the classification column is excluded and null disags are auto-fixed.
+        Hashes are cached until the IMAP data is set, together with the indicator groups that
+        repeat a row key (see get_duplicate_row_key_indicator_ids).
+        :param exclude_empty_maps: Rows with empty maps are not hashed if True
+        :return: <dict> Hex digests keyed by DATIM_Indicator_ID
+        """
+        cache_key = bool(exclude_empty_maps)
+        if cache_key not in self.__indicator_fingerprints:
+            group_sums = {}
+            row_keys = set()
+            duplicate_row_key_indicator_ids = set()
+            field_names = self.IMAP_IMPORT_FIELD_NAMES
+            for row in self.iter_rows(exclude_empty_maps=exclude_empty_maps, exclude_classification=True,
+                                      auto_fix_null_disag=True, as_view=True):
+                row_hash = hashlib.sha256(
+                    repr(tuple(row[field_name] for field_name in field_names)).encode('utf-8'))
+                indicator_id = row[self.IMAP_FIELD_DATIM_INDICATOR_ID]
+                group_sums[indicator_id] = (group_sums.get(indicator_id, 0) + int.from_bytes(
+                    row_hash.digest(), 'big')) & self.FINGERPRINT_MASK
+                row_key = DatimImapRowKey.from_row(row, self.country_org)
+                if row_key in row_keys:
+                    duplicate_row_key_indicator_ids.add(indicator_id)
+                else:
+                    row_keys.add(row_key)
+            self.__indicator_fingerprints[cache_key] = dict(
+                (indicator_id, '%064x' % group_sum) for indicator_id, group_sum in group_sums.items())
+            self.__duplicate_row_key_indicator_ids[cache_key] = frozenset(duplicate_row_key_indicator_ids)
+        return self.__indicator_fingerprints[cache_key]
+
+    def get_duplicate_row_key_indicator_ids(self, exclude_empty_maps=True):
+        """
+        Returns the DATIM indicator IDs of the indicator groups with more than one row for the
+        same row key (see DatimImapRowKey). The hash of such a group does not depend on which
+        of these rows comes last, unlike a diff keyed by row key.
+        :param exclude_empty_maps: Rows with empty maps are not considered if True
+        :return: <frozenset>
+        """
+        self.get_indicator_fingerprints(exclude_empty_maps=exclude_empty_maps)
+        return self.__duplicate_row_key_indicator_ids[bool(exclude_empty_maps)]
+
+    def get_fingerprint(self, exclude_empty_maps=True):
+        """
+        Returns a canonical content hash of the IMAP: the SHA-256 of its indicator group hashes
+        (see get_indicator_fingerprints) in indicator order. Two IMAPs with the same fingerprint
+        produce the same country metadata in OCL, regardless of row order, extra columns or
+        file format. The fingerprint is cached until the IMAP data is set.
+        :param exclude_empty_maps: Rows with empty maps are not hashed if True
+        :return: <str> SHA-256 hex digest
+        """
+        cache_key = bool(exclude_empty_maps)
+        if cache_key not in self.__fingerprints:
+            fingerprint = hashlib.sha256()
+            indicator_fingerprints = self.get_indicator_fingerprints(exclude_empty_maps=exclude_empty_maps)
+            for indicator_id in sorted(indicator_fingerprints, key=str):
+                fingerprint.update(json.dumps(
+                    [indicator_id, indicator_fingerprints[indicator_id]], default=str).encode('utf-8'))
+                fingerprint.update(b'\n')
+            self.__fingerprints[cache_key] = fingerprint.hexdigest()
+        return self.__fingerprints[cache_key]
+
+    def is_equal(self, imap, exclude_empty_maps=True):
+        """
+        Returns True if both IMAPs have the same content, by comparing their fingerprints.
+        Once the fingerprints are computed, this is a constant time check.
+        :param imap: The DatimImap object to compare
+        :param exclude_empty_maps: Set to True to ignore empty maps
+        :return: <bool>
+        """
+        return self.get_fingerprint(exclude_empty_maps=exclude_empty_maps) == imap.get_fingerprint(
+            exclude_empty_maps=exclude_empty_maps)
 
     @staticmethod
     def get_imap_row_key(row, country_org):
@@ -312,64 +898,33 @@ class DatimImap(object):
         :param country_org:
         :return:
         """
-        if row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID] and not row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]:
-            disag_id = datimbase.DatimBase.NULL_DISAG_ID
-        else:
-            disag_id = row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]
-        data = [
-            'DATIM-MOH',
-            row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID],
-            row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID],
-            row[DatimImap.IMAP_FIELD_OPERATION],
-            country_org,
-            row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID],
-            disag_id
-        ]
-        si = io.StringIO()
-        cw = csv.writer(si)
-        cw.writerow(data)
-        return si.getvalue().strip('\r\n')
+        return str(DatimImapRowKey.from_row(row, country_org))
 
     def get_imap_row_by_key(
             self, row_key, include_extra_info=False, auto_fix_null_disag=True, convert_to_dict=False):
         """
-        Return a specific row of the IMAP that matches the specified string row_key.
+        Return a specific row of the IMAP that matches the specified row_key.
         Note that rows representing an empty map do not have keys and cannot be matched by this method.
-        :param row_key:
+        :param row_key: DatimImapRowKey or its string form
         :param include_extra_info:
         :param auto_fix_null_disag:
         :param convert_to_dict:
         :return:
         """
-        row_key_dict = DatimImap.parse_imap_row_key(row_key)
-        if row_key_dict:
-            for row_number in range(self.length()):
-                row = self.get_row(row_number, exclude_empty_maps=True, auto_fix_null_disag=True)
-                if not row:
-                    continue
-                if (row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID] == row_key_dict[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID] and
-                        row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID] == row_key_dict[DatimImap.IMAP_FIELD_DATIM_DISAG_ID] and
-                        row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID] == row_key_dict[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID] and
-                        row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] == row_key_dict[DatimImap.IMAP_FIELD_MOH_DISAG_ID]):
-                    # Request the row again applying the format attributes
-                    return self.get_row(row_number, auto_fix_null_disag=auto_fix_null_disag,
-                                        include_extra_info=include_extra_info, convert_to_dict=convert_to_dict)
+        if not isinstance(row_key, DatimImapRowKey):
+            row_key = DatimImapRowKey.from_string(row_key)
+        if row_key:
+            row_number = self.get_index().get_row_number(row_key)
+            if row_number is not None:
+                return self.get_row(row_number, auto_fix_null_disag=auto_fix_null_disag,
+                                    include_extra_info=include_extra_info, convert_to_dict=convert_to_dict)
         return None
 
     @staticmethod
     def parse_imap_row_key(row_key):
-        si = io.StringIO(row_key)
-        reader = csv.reader(si, delimiter=',')
-        for row in reader:
-            return {
-                'DATIM_Source': row[0],
-                DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID: row[1],
-                DatimImap.IMAP_FIELD_DATIM_DISAG_ID: row[2],
-                DatimImap.IMAP_FIELD_OPERATION: row[3],
-                'MOH_Org': row[4],
-                DatimImap.IMAP_FIELD_MOH_INDICATOR_ID: row[5],
-                DatimImap.IMAP_FIELD_MOH_DISAG_ID: row[6],
-            }
+        row_key = DatimImapRowKey.from_string(row_key)
+        if row_key:
+            return row_key.to_dict()
         return {}
 
     def length(self):
@@ -381,25 +936,123 @@ class DatimImap(object):
             return len(self.__imap_data)
         return 0
 
+    def get_index(self):
+        """
+        Returns the DatimImapIndex for this IMAP, building it on first use. The index is
+        discarded whenever the IMAP data is set.
+        :return: DatimImapIndex
+        """
+        if self.__index is None:
+            rows = []
+            for row_number in range(self.length()):
+                row = self.get_row(
+                    row_number, exclude_empty_maps=True, auto_fix_null_disag=True, as_view=True)
+                if row:
+                    rows.append((row_number, row))
+            self.__index = DatimImapIndex(rows=rows)
+        return self.__index
+
+    def get_empty_map_row_numbers(self):
+        """
+        Returns the set of row numbers that are empty maps (see is_empty_map), scanning the
+        required columns on first use. Discarded whenever the IMAP data is set.
+        :return: <frozenset>
+        """
+        if self.__empty_map_row_numbers is None:
+            columns = [self.__imap_data.iter_values(field_name) for field_name in (
+                self.IMAP_FIELD_DATIM_INDICATOR_ID, self.IMAP_FIELD_DATIM_DISAG_ID,
+                self.IMAP_FIELD_OPERATION, self.IMAP_FIELD_MOH_INDICATOR_ID)]
+            self.__empty_map_row_numbers = frozenset(
+                row_number for row_number, values in enumerate(zip(*columns)) if not all(values))
+        return self.__empty_map_row_numbers
+
     def set_imap_data(self, imap_data):
         """
         Sets the IMAP data, discarding unrecognized columns, and ensures unicode encoding
-        :param imap_data: csv.DictReader or python dictionary
+        :param imap_data: csv.DictReader, list or generator of python dictionaries
         :return:
         """
         # TODO: Fix the explicit UTF-8 character encoding and ignoring unicode decoding errors
-        self.__imap_data = []
-        if isinstance(imap_data, csv.DictReader) or type(imap_data) == type([]):
-            for row in imap_data:
-                # Get rid of unrecognized columns and ensure unicode encoding
-                row_to_save = {}
-                for field_name in list(self.IMAP_EXPORT_FIELD_NAMES):
-                    row_to_save[field_name] = DatimImap.uors2u(
-                        row.get(field_name, ''), 'utf8', 'ignore')
-                # Store the cleaned up row in this IMAP object
-                self.__imap_data.append(row_to_save)
-        else:
+        if not isinstance(imap_data, (csv.DictReader, list, types.GeneratorType)):
             raise Exception("Cannot set IMAP data with '%s'" % imap_data)
+        self.__reset_imap_data()
+        for row in imap_data:
+            # Get rid of unrecognized columns and ensure unicode encoding
+            self.__imap_data.append_values([
+                DatimImap.uors2u(row.get(field_name, ''), 'utf8', 'ignore')
+                for field_name in self.IMAP_EXPORT_FIELD_NAMES])
+
+    def set_imap_data_from_csv(self, csv_input, validate=False, max_errors=None):
+        """
+        Sets the IMAP data from CSV, streaming rows straight into the row store. A column
+        index map is built once from the header row, unrecognized columns are discarded and
+        blank lines are skipped. If validate is True, missing required columns and empty
+        required fields are reported with their CSV line numbers.
+        :param csv_input: Text or binary file-like object, or any iterable of CSV lines
+        :param validate: Check required columns and fields while reading if True
+        :param max_errors: Stop reading after this many errors if set
+        :return: DatimImapValidationReport
+        """
+        if isinstance(csv_input, (io.RawIOBase, io.BufferedIOBase)):
+            csv_input = io.TextIOWrapper(csv_input, encoding='utf8', errors='ignore', newline='')
+        report = DatimImapValidationReport()
+        self.__reset_imap_data()
+        reader = csv.reader(csv_input)
+        header = next(reader, None)
+        if header is None:
+            return report
+
+        # Map each IMAP field to its column in the CSV (the last one wins if repeated)
+        column_indexes = {}
+        for column_index, column_name in enumerate(header):
+            column_indexes[column_name] = column_index
+        if validate:
+            for field_name in self.IMAP_IMPORT_FIELD_NAMES:
+                if field_name not in column_indexes:
+                    report.errors.append(DatimImapValidationIssue(
+                        DatimImapValidationIssue.SEVERITY_ERROR, reader.line_num, field_name, '',
+                        "ERROR: Missing required column '%s' in IMAP CSV header" % field_name))
+            if report.errors:
+                return report
+        field_indexes = [column_indexes.get(field_name) for field_name in self.IMAP_EXPORT_FIELD_NAMES]
+        required_field_indexes = [
+            (field_name, column_indexes.get(field_name)) for field_name in self.IMAP_REQUIRED_FIELD_NAMES]
+
+        append_values = self.__imap_data.append_values
+        for row in reader:
+            if not row:
+                continue
+            num_columns = len(row)
+            append_values([row[i] if i is not None and i < num_columns else ''
+                           for i in field_indexes])
+            if not validate:
+                continue
+            for field_name, i in required_field_indexes:
+                if i is None or i >= num_columns or not row[i]:
+                    report.errors.append(DatimImapValidationIssue(
+                        DatimImapValidationIssue.SEVERITY_ERROR, reader.line_num, field_name, '',
+                        "ERROR: Missing or empty required field '%s' on line %s of IMAP CSV" % (
+                            field_name, reader.line_num)))
+            if num_columns != len(header):
+                report.warnings.append(DatimImapValidationIssue(
+                    DatimImapValidationIssue.SEVERITY_WARNING, reader.line_num, '', '',
+                    'WARNING: Expected %s columns but found %s on line %s of IMAP CSV' % (
+                        len(header), num_columns, reader.line_num)))
+            if max_errors is not None and len(report.errors) >= max_errors:
+                report.is_truncated = True
+                break
+        return report
+
+    def __reset_imap_data(self):
+        """ Replaces the IMAP data with an empty row store and discards everything derived from it """
+        self.__imap_data = DatimImapRowStore(self.IMAP_EXPORT_FIELD_NAMES)
+        self.__index = None
+        self.__empty_map_row_numbers = None
+        self.__sorted_row_numbers = {}
+        self.__indicator_fingerprints = {}
+        self.__duplicate_row_key_indicator_ids = {}
+        self.__fingerprints = {}
+        self.clear_extra_info_cache()
 
     @staticmethod
     def uors2u(object, encoding='utf8', errors='strict'):
@@ -418,89 +1071,104 @@ class DatimImap(object):
         except:
             return object
 
-    def is_valid(self, datim_moh_source_export=None, throw_exception_on_error=True):
+    def is_valid(self, datim_moh_source_export=None, throw_exception_on_error=True,
+                 datim_concept_ids=None):
         """
         Return whether the DatimImap mappings are valid. Checks that required fields are defined
-        and that names match when an ID is reused.
+        and that names match when an ID is reused. See validate() for the full report.
+        :param datim_moh_source_export: Optional OclExport used to check DATIM indicator/disag IDs
         :param throw_exception_on_error:
+        :param datim_concept_ids: Optional set of DATIM concept IDs to use instead of the export
         :return:
         """
-
-        warnings = []
-        errors = []
-        if not self.__imap_data:
-            return True
-
-        # Check for missing fields
-        line_number = 0
-        for row in self.__imap_data:
-            line_number += 1
-            for field_name in self.IMAP_REQUIRED_FIELD_NAMES:
-                if field_name not in row or not row[field_name]:
-                    err_msg = "ERROR: Missing or empty required field '%s' on row %s of IMAP" % (
-                        field_name, line_number)
-                    errors.append(err_msg)
-
-        # Verify DATIM Data Element/Disag IDs are valid (if datim_moh_source_export provided)
-        if datim_moh_source_export:
-            datim_moh_resource_list = datim_moh_source_export.to_resource_list()
-            line_number = 0
-            for row in self.__imap_data:
-                line_number += 1
-                if DatimImap.is_empty_map(row):
-                    continue
-                datim_moh_data_element = datim_moh_resource_list.get_resource(
-                    core_attrs={'type': 'Concept', 'id': row[self.IMAP_FIELD_DATIM_INDICATOR_ID]})
-                if not datim_moh_data_element:
-                    err_msg = 'ERROR: No matching %s found in DATIM MOH Codelist for "%s" on row %s' % (
-                        self.IMAP_FIELD_DATIM_INDICATOR_ID,
-                        row[self.IMAP_FIELD_DATIM_INDICATOR_ID],
-                        line_number
-                    )
-                    errors.append(err_msg)
-                datim_moh_disag = datim_moh_resource_list.get_resource(
-                    core_attrs={'type': 'Concept', 'id': row[self.IMAP_FIELD_DATIM_DISAG_ID]})
-                if not datim_moh_disag:
-                    err_msg = 'ERROR: No matching %s found in DATIM MOH Codelist for "%s" on row %s' % (
-                        self.IMAP_FIELD_DATIM_DISAG_ID,
-                        row[self.IMAP_FIELD_DATIM_DISAG_ID],
-                        line_number
-                    )
-                    errors.append(err_msg)
-
-        # Check for reused IDs with different names in MOH indicator or disag columns
-        disag_id = {}
-        id_warnings = {}
-        indicator_id = {}
-        for row in self.__imap_data:
-            if self.IMAP_FIELD_MOH_DISAG_ID in row and self.IMAP_FIELD_MOH_DISAG_NAME in row and row[self.IMAP_FIELD_MOH_DISAG_ID]:
-                if row[self.IMAP_FIELD_MOH_DISAG_ID] in disag_id:
-                    if disag_id[row[self.IMAP_FIELD_MOH_DISAG_ID]] != row[self.IMAP_FIELD_MOH_DISAG_NAME]:
-                        id_warnings[row[self.IMAP_FIELD_MOH_DISAG_ID]] = 'WARNING: Mismatch in names for country disaggregate with ID "%s". Only the last name matching this ID will be used.' % row[self.IMAP_FIELD_MOH_DISAG_ID]
-                else:
-                    disag_id[row[self.IMAP_FIELD_MOH_DISAG_ID]] = row[self.IMAP_FIELD_MOH_DISAG_NAME]
-            if self.IMAP_FIELD_MOH_INDICATOR_ID in row and self.IMAP_FIELD_MOH_INDICATOR_NAME in row and row[self.IMAP_FIELD_MOH_INDICATOR_ID]:
-                if row[self.IMAP_FIELD_MOH_INDICATOR_ID] in indicator_id:
-                    if indicator_id[row[self.IMAP_FIELD_MOH_INDICATOR_ID]] != row[self.IMAP_FIELD_MOH_INDICATOR_NAME]:
-                        id_warnings[row[self.IMAP_FIELD_MOH_INDICATOR_ID]] = 'WARNING: Mismatch in names for country indicator with ID "%s". Only the last name matching this ID will be used.' % row[self.IMAP_FIELD_MOH_INDICATOR_ID]
-                else:
-                    indicator_id[row[self.IMAP_FIELD_MOH_INDICATOR_ID]] = row[self.IMAP_FIELD_MOH_INDICATOR_NAME]
-        for id_warning_key in id_warnings:
-            warnings.append(id_warnings[id_warning_key])
-
-        # Handle errors
-        msg = ''
-        for error_msg in errors:
-            msg += error_msg + '\n'
-        for warning_msg in warnings:
-            msg += warning_msg + '\n'
-        if errors:
+        report = self.validate(
+            datim_moh_source_export=datim_moh_source_export, datim_concept_ids=datim_concept_ids)
+        if report.errors:
             if throw_exception_on_error:
-                raise Exception(msg)
+                raise Exception(report.get_message())
             else:
                 return False
         return True
 
+    @staticmethod
+    def get_datim_concept_ids(datim_moh_source_export):
+        """
+        Returns the set of concept IDs in a DATIM-MOH source export for use by validate()
+        :param datim_moh_source_export: OclExport
+        :return: <frozenset>
+        """
+        return frozenset(concept['id'] for concept in datim_moh_source_export.get_concepts()
+                         if concept.get('type') == 'Concept')
+
+    def validate(self, datim_moh_source_export=None, datim_concept_ids=None, max_errors=None):
+        """
+        Validates the IMAP in a single pass over the rows. Checks that required fields are
+        defined, that DATIM indicator and disag IDs exist in the DATIM-MOH codelist (if an
+        export or a set of concept IDs is provided), and that names match when an MOH ID is
+        reused.
+        :param datim_moh_source_export: Optional OclExport of the DATIM-MOH source
+        :param datim_concept_ids: Optional set of DATIM concept IDs, e.g. from
+            get_datim_concept_ids(). Takes precedence over datim_moh_source_export.
+        :param max_errors: Stop validating after this many errors if set
+        :return: DatimImapValidationReport
+        """
+        report = DatimImapValidationReport()
+        if not self.__imap_data:
+            return report
+        if datim_concept_ids is None and datim_moh_source_export:
+            datim_concept_ids = DatimImap.get_datim_concept_ids(datim_moh_source_export)
+
+        # Missing field errors are reported before codelist errors
+        missing_field_errors = []
+        codelist_errors = []
+        num_errors = 0
+        id_names = {}
+        id_warnings = {}
+        for line_number, row in enumerate(self.__imap_data, start=1):
+            # Check for missing fields
+            for field_name in self.IMAP_REQUIRED_FIELD_NAMES:
+                if not row.get(field_name):
+                    missing_field_errors.append(DatimImapValidationIssue(
+                        DatimImapValidationIssue.SEVERITY_ERROR, line_number, field_name, '',
+                        "ERROR: Missing or empty required field '%s' on row %s of IMAP" % (
+                            field_name, line_number)))
+                    num_errors += 1
+
+            # Verify DATIM Data Element/Disag IDs are valid
+            if datim_concept_ids is not None and not DatimImap.is_empty_map(row):
+                for field_name in (self.IMAP_FIELD_DATIM_INDICATOR_ID, self.IMAP_FIELD_DATIM_DISAG_ID):
+                    if row[field_name] not in datim_concept_ids:
+                        codelist_errors.append(DatimImapValidationIssue(
+                            DatimImapValidationIssue.SEVERITY_ERROR, line_number, field_name,
+                            row[field_name],
+                            'ERROR: No matching %s found in DATIM MOH Codelist for "%s" on row %s' % (
+                                field_name, row[field_name], line_number)))
+                        num_errors += 1
+
+            if max_errors is not None and num_errors >= max_errors:
+                report.is_truncated = line_number < len(self.__imap_data)
+                break
+
+            # Check for reused IDs with different names in MOH indicator or disag columns
+            for id_field_name, name_field_name, resource_name in (
+                    (self.IMAP_FIELD_MOH_DISAG_ID, self.IMAP_FIELD_MOH_DISAG_NAME, 'disaggregate'),
+                    (self.IMAP_FIELD_MOH_INDICATOR_ID, self.IMAP_FIELD_MOH_INDICATOR_NAME, 'indicator')):
+                moh_id = row[id_field_name]
+                if not moh_id:
+                    continue
+                names = id_names.setdefault(id_field_name, {})
+                if moh_id not in names:
+                    names[moh_id] = row[name_field_name]
+                elif names[moh_id] != row[name_field_name]:
+                    id_warnings[moh_id] = DatimImapValidationIssue(
+                        DatimImapValidationIssue.SEVERITY_WARNING, line_number, id_field_name, moh_id,
+                        'WARNING: Mismatch in names for country %s with ID "%s". Only the last name '
+                        'matching this ID will be used.' % (resource_name, moh_id))
+
+        report.errors = missing_field_errors + codelist_errors
+        report.warnings = list(id_warnings.values())
+        return report
+
     def display(self, fmt=DATIM_IMAP_FORMAT_CSV, sort=False, exclude_empty_maps=False,
                 include_extra_info=False, auto_fix_null_disag=False, show_null_disag_as_blank=True):
         """
@@ -555,154 +1223,229 @@ class DatimImap(object):
                 print('</tr>')
             print('</table>')
 
-    def diff(self, imap, exclude_empty_maps=True):
+    def diff(self, imap, exclude_empty_maps=True, evaluate=True):
         """
         Get an object representing the diff between two IMAPs
         :param imap: The IMAP object to compare
         :param exclude_empty_maps: Set to True to exclude empty maps from the diff
+        :param evaluate: Set to False to only stream the diff with DatimImapDiff.write_jsonl
         :return: DatimImapDiff
         """
-        return DatimImapDiff(self, imap, exclude_empty_maps=exclude_empty_maps)
+        return DatimImapDiff(self, imap, exclude_empty_maps=exclude_empty_maps, evaluate=evaluate)
 
     @staticmethod
     def multikeysort(items, columns):
-        from operator import itemgetter
-        comparers = [((itemgetter(col[1:].strip()), -1) if col.startswith('-') else
-                      (itemgetter(col.strip()), 1)) for col in columns]
-
-        def cmp(a, b):
-            return (a > b) - (a < b)
-
-        def comparer(left, right):
-            for fn, mult in comparers:
-                result = cmp(fn(left), fn(right))
-                if result:
-                    return mult * result
+        """
+        Returns a new list of the items sorted by the specified columns. Prefix a column
+        with '-' to sort it in descending order. The sort is stable.
+        :param items: List of dictionaries or other mappings
+        :param columns: List of column names, e.g. ['DATIM_Indicator_ID', '-Operation']
+        :return: <list>
+        """
+        return [items[i] for i in DatimImap.multikeysort_order(items, columns)]
+
+    @staticmethod
+    def multikeysort_order(items, columns):
+        """
+        Returns the list of item indexes in the order that multikeysort would return the items.
+        Consecutive columns sorted in the same direction are combined into a single key tuple,
+        and each group is applied as a stable sort from the last group to the first.
+        :param items: List of dictionaries or other mappings
+        :param columns: List of column names, optionally prefixed with '-' for descending order
+        :return: <list>
+        """
+        groups = []
+        for column in columns:
+            descending = column.startswith('-')
+            column = column[1:].strip() if descending else column.strip()
+            if groups and groups[-1][0] == descending:
+                groups[-1][1].append(column)
             else:
-                return 0
-        return sorted(items, key=cmp_to_key(comparer))
+                groups.append((descending, [column]))
+        order = list(range(len(items)))
+        for descending, group_columns in reversed(groups):
+            get_key = itemgetter(*group_columns)
+            keys = [get_key(item) for item in items]
+            order.sort(key=keys.__getitem__, reverse=descending)
+        return order
+
+    def clear_extra_info_cache(self):
+        """
+        Discards the cached extra columns and per-IMAP constants used by add_columns_to_row,
+        and the CSV converter used by get_country_resource_json. Called automatically when the
+        period, country org or IMAP data changes.
+        """
+        self.__extra_columns_cache = {}
+        self.__extra_info_constants = None
+        self.__csv_converter = None
+        self.__csv_resource_definitions = None
+
+    def get_extra_info_constants(self):
+        """
+        Returns the values used by add_columns_to_row that are the same for every row of
+        the IMAP, e.g. the DATIM-MOH source ID and the concept/mapping URL prefixes
+        :return: <dict>
+        """
+        if self.__extra_info_constants is None:
+            datim_moh_source_id = datimbase.DatimBase.get_datim_moh_source_id(self.period)
+            datim_owner_type_url_part = datimbase.DatimBase.owner_type_to_stem(
+                datimbase.DatimBase.DATIM_MOH_OWNER_TYPE)
+            country_data_element_owner_type_url_part = datimbase.DatimBase.owner_type_to_stem(
+                datimbase.DatimBase.DATIM_MOH_COUNTRY_OWNER_TYPE)
+            self.__extra_info_constants = {
+                'datim_moh_source_id': datim_moh_source_id,
+                'datim_concept_url_prefix': '/%s/%s/sources/%s/concepts/' % (
+                    datim_owner_type_url_part,
+                    datimbase.DatimBase.DATIM_MOH_OWNER_ID,
+                    datim_moh_source_id),
+                'country_concept_url_prefix': '/%s/%s/sources/%s/concepts/' % (
+                    country_data_element_owner_type_url_part,
+                    self.country_org,
+                    datimbase.DatimBase.DATIM_MOH_COUNTRY_SOURCE_ID),
+                'country_mapping_url_prefix': '/%s/%s/sources/%s/mappings/' % (
+                    country_data_element_owner_type_url_part,
+                    self.country_org,
+                    datimbase.DatimBase.DATIM_MOH_COUNTRY_SOURCE_ID),
+                'null_disag_concept_url': datimbase.DatimBase.get_datim_moh_null_disag_endpoint(
+                    self.period),
+            }
+        return self.__extra_info_constants
 
     def add_columns_to_row(self, row):
         """
-        Create the additional columns used in processing
+        Create the additional columns used in processing. The additional columns are computed
+        once for each distinct combination of the columns they depend on and then cached.
         :param row: Row to add columns to
         :return: dict
         """
+        extra_columns = self.get_extra_columns_for_key(tuple(
+            row[field_name] for field_name in DatimImap.IMAP_EXTRA_COLUMNS_KEY_FIELDS))
+        row = row.copy()
+        row.update(extra_columns)
+        return row
+
+    def get_extra_columns_for_key(self, extra_columns_key):
+        """
+        Returns the cached extra columns for a tuple of the IMAP_EXTRA_COLUMNS_KEY_FIELDS values
+        of a row. The returned dictionary is shared and must not be modified.
+        :param extra_columns_key: <tuple>
+        :return: <dict>
+        """
+        extra_columns = self.__extra_columns_cache.get(extra_columns_key)
+        if extra_columns is None:
+            extra_columns = self.__get_extra_columns(
+                dict(zip(DatimImap.IMAP_EXTRA_COLUMNS_KEY_FIELDS, extra_columns_key)))
+            self.__extra_columns_cache[extra_columns_key] = extra_columns
+        return extra_columns
+
+    def __get_extra_columns(self, row):
+        """
+        Returns a dictionary of the additional columns for the row
+        :param row:
+        :return: dict
+        """
 
         # Start by adding empty string values for each extra field
-        row = row.copy()
-        for key in DatimImap.IMAP_EXTRA_FIELD_NAMES:
-            row[key] = ''
+        extra = dict.fromkeys(DatimImap.IMAP_EXTRA_FIELD_NAMES, '')
 
         # Get out of here if no ID set for MOH Indicator
         if not row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]:
-            return row
+            return extra
+        constants = self.get_extra_info_constants()
+        datim_moh_source_id = constants['datim_moh_source_id']
 
         # Create the modified MOH indicator+disag IDs
         # NOTE: These are modified so that an MOH indicator and disag may reuse the same ID
-        if row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]:
-            row[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_INDICATOR_ID] = '%s%s' % (
-                DatimImap.IMAP_MOH_DATA_ELEMENT_ID_PREFIX,
-                row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID])
+        extra[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_INDICATOR_ID] = '%s%s' % (
+            DatimImap.IMAP_MOH_DATA_ELEMENT_ID_PREFIX,
+            row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID])
         if row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]:
-            row[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_DISAG_ID] = '%s%s' % (
+            extra[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_DISAG_ID] = '%s%s' % (
                 DatimImap.IMAP_MOH_DISAG_ID_PREFIX, row[DatimImap.IMAP_FIELD_MOH_DISAG_ID])
 
         # Set DATIM attributes
-        datim_moh_source_id = datimbase.DatimBase.get_datim_moh_source_id(self.period)
-        row[DatimImap.IMAP_EXTRA_FIELD_DATIM_OWNER_TYPE] = datimbase.DatimBase.DATIM_MOH_OWNER_TYPE
-        row[DatimImap.IMAP_EXTRA_FIELD_DATIM_OWNER_ID] = datimbase.DatimBase.DATIM_MOH_OWNER_ID
-        row[DatimImap.IMAP_EXTRA_FIELD_DATIM_SOURCE_ID] = datim_moh_source_id
-        datim_owner_type_url_part = datimbase.DatimBase.owner_type_to_stem(
-            row[DatimImap.IMAP_EXTRA_FIELD_DATIM_OWNER_TYPE])
+        extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_OWNER_TYPE] = datimbase.DatimBase.DATIM_MOH_OWNER_TYPE
+        extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_OWNER_ID] = datimbase.DatimBase.DATIM_MOH_OWNER_ID
+        extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_SOURCE_ID] = datim_moh_source_id
 
         # Set country data element attributes
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_DATA_ELEMENT_OWNER_TYPE] = (
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_DATA_ELEMENT_OWNER_TYPE] = (
             datimbase.DatimBase.DATIM_MOH_COUNTRY_OWNER_TYPE)
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_DATA_ELEMENT_OWNER_ID] = self.country_org
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_DATA_ELEMENT_SOURCE_ID] = (
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_DATA_ELEMENT_OWNER_ID] = self.country_org
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_DATA_ELEMENT_SOURCE_ID] = (
             datimbase.DatimBase.DATIM_MOH_COUNTRY_SOURCE_ID)
-        country_data_element_owner_type_url_part = datimbase.DatimBase.owner_type_to_stem(
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DATA_ELEMENT_OWNER_TYPE])
 
-        # Set country disag attributes, handling the null disag case
+        # Set country disag attributes, handling the null disag case. Null disags are owned by
+        # DATIM-MOH, so they share the DATIM concept URL prefix.
         if DatimImap.is_null_disag_row(row):
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_TYPE] = (
+            extra[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_TYPE] = (
                 datimbase.DatimBase.DATIM_MOH_OWNER_TYPE)
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_ID] = (
+            extra[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_ID] = (
                 datimbase.DatimBase.DATIM_MOH_OWNER_ID)
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_SOURCE_ID] = datim_moh_source_id
+            extra[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_SOURCE_ID] = datim_moh_source_id
             moh_disag_id = datimbase.DatimBase.NULL_DISAG_ID
-            moh_disag_name = datimbase.DatimBase.NULL_DISAG_NAME
+            moh_disag_concept_url_prefix = constants['datim_concept_url_prefix']
         else:
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_TYPE] = (
+            extra[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_TYPE] = (
                 datimbase.DatimBase.DATIM_MOH_COUNTRY_OWNER_TYPE)
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_ID] = self.country_org
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_SOURCE_ID] = (
+            extra[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_ID] = self.country_org
+            extra[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_SOURCE_ID] = (
                 datimbase.DatimBase.DATIM_MOH_COUNTRY_SOURCE_ID)
-            moh_disag_id = row[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_DISAG_ID]
-            moh_disag_name = row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]
-        country_disaggregate_owner_type_url_part = datimbase.DatimBase.owner_type_to_stem(
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_TYPE])
+            moh_disag_id = extra[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_DISAG_ID]
+            moh_disag_concept_url_prefix = constants['country_concept_url_prefix']
 
         # Build the collection name and ID
-        row[DatimImap.IMAP_EXTRA_FIELD_DATIM_DISAG_NAME_CLEAN] = DatimImap.clean_country_disag_name(
+        extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_DISAG_NAME_CLEAN] = DatimImap.clean_country_disag_name(
             disag_name_raw=row[DatimImap.IMAP_FIELD_DATIM_DISAG_NAME])
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_COLLECTION_NAME] = '%s: %s' % (
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_COLLECTION_NAME] = '%s: %s' % (
             row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID],
             row[DatimImap.IMAP_FIELD_DATIM_DISAG_NAME])
-        moh_collection_id = '%s_%s' % (
-            row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID],
-            row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID])
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_COLLECTION_ID] = moh_collection_id.replace('_', '-')
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_COLLECTION_ID] = DatimImap.get_collection_id(
+            row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID], row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID])
 
         # DATIM HAS OPTION mapping
-        row[DatimImap.IMAP_EXTRA_FIELD_DATIM_FROM_CONCEPT_URI] = '/%s/%s/sources/%s/concepts/%s/' % (
-            datim_owner_type_url_part,
-            datimbase.DatimBase.DATIM_MOH_OWNER_ID,
-            datim_moh_source_id,
-            row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID])
-        row[DatimImap.IMAP_EXTRA_FIELD_DATIM_TO_CONCEPT_URI] = '/%s/%s/sources/%s/concepts/%s/' % (
-            datim_owner_type_url_part,
-            datimbase.DatimBase.DATIM_MOH_OWNER_ID,
-            datim_moh_source_id,
-            row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID])
-        row[DatimImap.IMAP_EXTRA_FIELD_DATIM_MAP_TYPE] = (
+        extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_FROM_CONCEPT_URI] = '%s%s/' % (
+            constants['datim_concept_url_prefix'], row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID])
+        extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_TO_CONCEPT_URI] = '%s%s/' % (
+            constants['datim_concept_url_prefix'], row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID])
+        extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_MAP_TYPE] = (
             datimbase.DatimBase.DATIM_MOH_MAP_TYPE_COUNTRY_OPTION)
-        row[DatimImap.IMAP_EXTRA_FIELD_DATIM_HAS_OPTION_MAPPING_ID] = 'MAP-DATIM-HAS-OPTION-%s-%s' % (
+        extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_HAS_OPTION_MAPPING_ID] = 'MAP-DATIM-HAS-OPTION-%s-%s' % (
             row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID],
             row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID])
-        row[DatimImap.IMAP_EXTRA_FIELD_DATIM_HAS_OPTION_MAPPING_URI] = '/%s/%s/sources/%s/mappings/%s/' % (
-            country_data_element_owner_type_url_part,
-            self.country_org,
-            datimbase.DatimBase.DATIM_MOH_COUNTRY_SOURCE_ID,
-            row[DatimImap.IMAP_EXTRA_FIELD_DATIM_HAS_OPTION_MAPPING_ID])
+        extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_HAS_OPTION_MAPPING_URI] = '%s%s/' % (
+            constants['country_mapping_url_prefix'],
+            extra[DatimImap.IMAP_EXTRA_FIELD_DATIM_HAS_OPTION_MAPPING_ID])
 
         # Country mapping
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_MAP_TYPE] = '%s%s' % (
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_MAP_TYPE] = '%s%s' % (
             row[DatimImap.IMAP_FIELD_OPERATION],
             DatimImap.IMAP_MOH_MAP_TYPE_OPERATION_POSTFIX)
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_FROM_CONCEPT_URI] = '/%s/%s/sources/%s/concepts/%s/' % (
-            country_data_element_owner_type_url_part,
-            self.country_org,
-            datimbase.DatimBase.DATIM_MOH_COUNTRY_SOURCE_ID,
-            row[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_INDICATOR_ID])
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_TO_CONCEPT_URI] = '/%s/%s/sources/%s/concepts/%s/' % (
-            country_disaggregate_owner_type_url_part,
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_OWNER_ID],
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_DISAG_SOURCE_ID],
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_FROM_CONCEPT_URI] = '%s%s/' % (
+            constants['country_concept_url_prefix'],
+            extra[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_INDICATOR_ID])
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_TO_CONCEPT_URI] = '%s%s/' % (
+            moh_disag_concept_url_prefix, moh_disag_id)
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_MAPPING_ID] = 'MAP-MOH-%s-%s-%s' % (
+            extra[DatimImap.IMAP_EXTRA_FIELD_MOH_MAP_TYPE].replace(' ', '-'),
+            extra[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_INDICATOR_ID],
             moh_disag_id)
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_MAPPING_ID] = 'MAP-MOH-%s-%s-%s' % (
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_MAP_TYPE].replace(' ', '-'),
-            row[DatimImap.IMAP_EXTRA_FIELD_MODIFIED_MOH_INDICATOR_ID],
-            moh_disag_id)
-        row[DatimImap.IMAP_EXTRA_FIELD_MOH_MAPPING_URI] = '/%s/%s/sources/%s/mappings/%s/' % (
-            country_data_element_owner_type_url_part,
-            self.country_org,
-            datimbase.DatimBase.DATIM_MOH_COUNTRY_SOURCE_ID,
-            row[DatimImap.IMAP_EXTRA_FIELD_MOH_MAPPING_ID])
+        extra[DatimImap.IMAP_EXTRA_FIELD_MOH_MAPPING_URI] = '%s%s/' % (
+            constants['country_mapping_url_prefix'],
+            extra[DatimImap.IMAP_EXTRA_FIELD_MOH_MAPPING_ID])
 
-        return row
+        return extra
+
+    @staticmethod
+    def get_collection_id(datim_indicator_id, datim_disag_id):
+        """
+        Returns the ID of the country collection for a DATIM indicator+disag pair
+        :param datim_indicator_id:
+        :param datim_disag_id:
+        :return: <str>
+        """
+        moh_collection_id = '%s_%s' % (datim_indicator_id, datim_disag_id)
+        return moh_collection_id.replace('_', '-')
 
     @staticmethod
     def clean_country_disag_name(disag_name_raw):
@@ -725,11 +1468,14 @@ class DatimImap(object):
         :param indicator_name:
         :return: bool
         """
-        for row in self.get_imap_data(exclude_empty_maps=True):
-            if ((not indicator_id or (indicator_id and indicator_id == row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID])) and
-                    (not indicator_name or (indicator_name and indicator_name == row[DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME]))):
-                return True
-        return False
+        index = self.get_index()
+        if indicator_id and indicator_name:
+            return (indicator_id, indicator_name) in index.country_indicators
+        elif indicator_id:
+            return indicator_id in index.country_indicator_ids
+        elif indicator_name:
+            return indicator_name in index.country_indicator_names
+        return bool(index.num_rows)
 
     def has_country_disag(self, disag_id='', disag_name=''):
         """
@@ -741,11 +1487,14 @@ class DatimImap(object):
         :param disag_name:
         :return: bool
         """
-        for row in self.get_imap_data(exclude_empty_maps=True):
-            if ((not disag_id or (disag_id and disag_id == row[DatimImap.IMAP_FIELD_MOH_DISAG_ID])) and
-                    (not disag_name or (disag_name and disag_name == row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]))):
-                return True
-        return False
+        index = self.get_index()
+        if disag_id and disag_name:
+            return (disag_id, disag_name) in index.country_disags
+        elif disag_id:
+            return disag_id in index.country_disag_ids
+        elif disag_name:
+            return disag_name in index.country_disag_names
+        return bool(index.num_rows)
 
     def has_country_collection(self, csv_row_needle):
         """
@@ -755,14 +1504,11 @@ class DatimImap(object):
         :return: bool
         """
         # TODO: This method perpetuates the problem! Need to check the actual mappings, not the collection name
-        full_csv_row_needle = self.add_columns_to_row(csv_row_needle.copy())
-        needle_collection_id = full_csv_row_needle[DatimImap.IMAP_EXTRA_FIELD_MOH_COLLECTION_ID]
-        if not needle_collection_id:
+        if not csv_row_needle[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]:
             return False
-        for row in self.get_imap_data(exclude_empty_maps=True, include_extra_info=True):
-            if row[DatimImap.IMAP_EXTRA_FIELD_MOH_COLLECTION_ID] == needle_collection_id:
-                return True
-        return False
+        needle_collection_id = DatimImap.get_collection_id(
+            *DatimImapIndex.get_datim_mapping_key(csv_row_needle))
+        return needle_collection_id in self.get_index().country_collection_ids
 
     def has_country_operation_mapping(self, csv_row):
         """
@@ -773,13 +1519,18 @@ class DatimImap(object):
         :param csv_row:
         :return: bool
         """
-        for row in self.get_imap_data(exclude_empty_maps=True):
-            if (row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID] == csv_row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID] and
-                    row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID] == csv_row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID] and
-                    row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID] == csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID] and
-                    row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] == csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]):
-                return True
-        return False
+        return (DatimImapIndex.get_operation_mapping_key(csv_row) in
+                self.get_index().country_operation_mappings)
+
+    def has_country_operation(self, csv_row):
+        """
+        Returns whether any row of this IMAP uses the same country operation mapping as the
+        provided CSV row, i.e. the same operation and MOH indicator+disag IDs, regardless of the
+        DATIM indicator+disag pair. Note that empty mapping rows are ignored.
+        :param csv_row:
+        :return: bool
+        """
+        return DatimImapIndex.get_country_operation_key(csv_row) in self.get_index().country_operations
 
     def has_country_datim_mapping(self, csv_row):
         """
@@ -787,67 +1538,106 @@ class DatimImap(object):
         :param csv_row:
         :return: bool
         """
-        for row in self.get_imap_data(exclude_empty_maps=True):
-            if (row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID] == csv_row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID] and
-                    row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID] == csv_row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID]):
-                return True
-        return False
+        return (DatimImapIndex.get_datim_mapping_key(csv_row) in
+                self.get_index().country_datim_mappings)
 
     def get_country_indicator_update_json(self, row):
-        if DatimImap.IMAP_EXTRA_FIELD_NAMES[0] not in row:
-            row = self.add_columns_to_row(DatimImap.fix_null_disag_in_row(row))
-        defs = [DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_INDICATOR]
-        return DatimImapFactory.generate_import_script_from_csv_row(
-            imap_input=self, csv_row=row, defs=defs)
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_INDICATOR)
 
     def get_country_indicator_create_json(self, row):
-        if DatimImap.IMAP_EXTRA_FIELD_NAMES[0] not in row:
-            row = self.add_columns_to_row(DatimImap.fix_null_disag_in_row(row))
-        defs = [DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_INDICATOR]
-        return DatimImapFactory.generate_import_script_from_csv_row(
-            imap_input=self, csv_row=row, defs=defs)
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_INDICATOR)
 
     def get_country_disag_update_json(self, row):
-        if DatimImap.IMAP_EXTRA_FIELD_NAMES[0] not in row:
-            row = self.add_columns_to_row(DatimImap.fix_null_disag_in_row(row))
-        defs = [DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DISAG]
-        return DatimImapFactory.generate_import_script_from_csv_row(
-            imap_input=self, csv_row=row, defs=defs)
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DISAG)
 
     def get_country_disag_create_json(self, row):
-        if DatimImap.IMAP_EXTRA_FIELD_NAMES[0] not in row:
-            row = self.add_columns_to_row(DatimImap.fix_null_disag_in_row(row))
-        defs = [DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DISAG]
-        return DatimImapFactory.generate_import_script_from_csv_row(
-            imap_input=self, csv_row=row, defs=defs)
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DISAG)
 
     def get_country_collection_create_json(self, row):
-        if DatimImap.IMAP_EXTRA_FIELD_NAMES[0] not in row:
-            row = self.add_columns_to_row(DatimImap.fix_null_disag_in_row(row))
-        defs = [DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_COLLECTION]
-        return DatimImapFactory.generate_import_script_from_csv_row(
-            imap_input=self, csv_row=row, defs=defs)
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_COLLECTION)
 
     def get_country_operation_mapping_create_json(self, row):
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_OPERATION_MAPPING)
+
+    def get_country_datim_mapping_create_json(self, row):
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DATIM_MAPPING)
+
+    def get_country_operation_mapping_retire_json(self, row):
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_OPERATION_MAPPING_RETIRED)
+
+    def get_country_datim_mapping_retire_json(self, row):
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DATIM_MAPPING_RETIRED)
+
+    def get_country_indicator_retire_json(self, row):
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_INDICATOR_RETIRED)
+
+    def get_country_disag_retire_json(self, row):
+        return self.get_country_resource_json(
+            row, DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DISAG_RETIRED)
+
+    def get_datim_mapping_reference_expressions(self, row):
+        """
+        Returns the expressions referencing the DATIM HAS OPTION mapping and the DATIM
+        indicator+disag concepts, which are added once to each country collection
+        :param row: IMAP row, with or without the extra columns
+        :return: <list>
+        """
         if DatimImap.IMAP_EXTRA_FIELD_NAMES[0] not in row:
             row = self.add_columns_to_row(DatimImap.fix_null_disag_in_row(row))
-        defs = [DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_OPERATION_MAPPING]
-        return DatimImapFactory.generate_import_script_from_csv_row(
-            imap_input=self, csv_row=row, defs=defs)
+        return [row[DatimImap.IMAP_EXTRA_FIELD_DATIM_HAS_OPTION_MAPPING_URI],
+                row[DatimImap.IMAP_EXTRA_FIELD_DATIM_FROM_CONCEPT_URI],
+                row[DatimImap.IMAP_EXTRA_FIELD_DATIM_TO_CONCEPT_URI]]
 
-    def get_country_datim_mapping_create_json(self, row):
+    def get_country_mapping_reference_expressions(self, row):
+        """
+        Returns the expressions referencing the country operation mapping of a row and its
+        from and to concepts, in that order. The null disag is referenced from DATIM-MOH.
+        :param row: IMAP row, with or without the extra columns
+        :return: <list>
+        """
         if DatimImap.IMAP_EXTRA_FIELD_NAMES[0] not in row:
             row = self.add_columns_to_row(DatimImap.fix_null_disag_in_row(row))
-        defs = [DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DATIM_MAPPING]
-        return DatimImapFactory.generate_import_script_from_csv_row(
-            imap_input=self, csv_row=row, defs=defs)
+        if row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] == datimbase.DatimBase.NULL_DISAG_ID:
+            moh_operation_to_concept_url = self.get_extra_info_constants()['null_disag_concept_url']
+        else:
+            moh_operation_to_concept_url = row[DatimImap.IMAP_EXTRA_FIELD_MOH_TO_CONCEPT_URI]
+        return [row[DatimImap.IMAP_EXTRA_FIELD_MOH_MAPPING_URI],
+                row[DatimImap.IMAP_EXTRA_FIELD_MOH_FROM_CONCEPT_URI],
+                moh_operation_to_concept_url]
 
-    def get_country_operation_mapping_retire_json(self, row):
+    def get_country_resource_json(self, row, definition_name):
+        """
+        Returns the list of OCL resources generated from a single IMAP row by one of the
+        DatimMohCsvToJsonConverter country resource definitions. The converter and its resource
+        definitions are created once per IMAP and reused.
+        :param row: IMAP row, with or without the extra columns
+        :param definition_name: e.g. DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_INDICATOR
+        :return: <list>
+        """
         if DatimImap.IMAP_EXTRA_FIELD_NAMES[0] not in row:
             row = self.add_columns_to_row(DatimImap.fix_null_disag_in_row(row))
-        defs = [DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_OPERATION_MAPPING_RETIRED]
-        return DatimImapFactory.generate_import_script_from_csv_row(
-            imap_input=self, csv_row=row, defs=defs)
+        if self.__csv_converter is None:
+            self.__csv_converter = DatimMohCsvToJsonConverter(input_list=[])
+            self.__csv_resource_definitions = dict(
+                (csv_definition['definition_name'], [dict(csv_definition, is_active=True)])
+                for csv_definition in DatimMohCsvToJsonConverter.get_country_csv_resource_definitions(
+                    country_owner=self.country_org,
+                    country_owner_type=datimbase.DatimBase.DATIM_MOH_COUNTRY_OWNER_TYPE,
+                    country_source=datimbase.DatimBase.DATIM_MOH_COUNTRY_SOURCE_ID,
+                    datim_map_type=datimbase.DatimBase.DATIM_MOH_MAP_TYPE_COUNTRY_OPTION))
+        self.__csv_converter.input_list = [row]
+        self.__csv_converter.set_resource_definitions(self.__csv_resource_definitions[definition_name])
+        return self.__csv_converter.process_by_definition()
 
 
 class DatimImapFactory(object):
@@ -928,7 +1718,7 @@ class DatimImapFactory(object):
         org_url = "%s/orgs/%s/" % (ocl_env_url, org_id)
         if verbose:
             print(('INFO: Checking if org "%s" exists...' % org_url))
-        r = requests.get(org_url, headers=ocl_api_headers)
+        r = datimhttp.OclHttpEngine.get_default().get(org_url, headers=ocl_api_headers)
         if r.status_code == 404:
             if verbose:
                 print(('Org "%s" not found or not authorized.' % org_id))
@@ -966,7 +1756,7 @@ class DatimImapFactory(object):
         org_url = "%s/orgs/%s/" % (oclenv, org_id)
         if verbose:
             print(('INFO: Checking if org "%s" exists...' % org_url))
-        r = requests.get(org_url, headers=oclapiheaders)
+        r = datimhttp.OclHttpEngine.get_default().get(org_url, headers=oclapiheaders)
         if r.status_code == 404:
             if verbose:
                 print(('Org "%s" not found. Could not delete.' % org_id))
@@ -978,7 +1768,7 @@ class DatimImapFactory(object):
             return False
 
         # Delete the org
-        r = requests.delete(org_url, headers=oclapiheaders)
+        r = datimhttp.OclHttpEngine.get_default().delete(org_url, headers=oclapiheaders)
         r.raise_for_status()
         if r.status_code == 204:
             if verbose:
@@ -1002,7 +1792,7 @@ class DatimImapFactory(object):
         repo_versions_url = '%sversions/?limit=100' % repo_url
         if released:
             repo_versions_url += '&released=true'
-        r = requests.get(repo_versions_url, headers=oclapiheaders)
+        r = datimhttp.OclHttpEngine.get_default().get(repo_versions_url, headers=oclapiheaders)
         r.raise_for_status()
         repo_versions = r.json()
         if repo_versions:
@@ -1034,44 +1824,128 @@ class DatimImapFactory(object):
 
     @staticmethod
     def load_imap_from_json(json_filename='', country_code='', country_org='',
-                            country_name='', period=''):
+                            country_name='', period='', json_stream=None):
         """
-        Load IMAP from JSON file
+        Load IMAP from JSON file or stream. Rows are parsed one at a time and handed straight
+        to the IMAP, so the parsed document is never held in memory alongside the IMAP.
         :param json_filename:
         :param country_code:
         :param country_org:
         :param country_name:
         :param period:
+        :param json_stream: File-like object; used instead of json_filename if provided
         :return:
         """
+        if json_stream is not None:
+            return DatimImap(imap_data=DatimImapFactory.iter_json_imap_rows(json_stream),
+                             country_code=country_code, country_name=country_name,
+                             country_org=country_org, period=period)
         with open(json_filename, 'r') as input_file:
-            imap_data = json.load(input_file)
+            return DatimImap(
+                imap_data=DatimImapFactory.iter_json_imap_rows(input_file, source_name=json_filename),
+                country_code=country_code, country_name=country_name, country_org=country_org,
+                period=period)
+
+    @staticmethod
+    def iter_json_imap_rows(json_stream, source_name=''):
+        """
+        Generator that yields the rows of a JSON IMAP one at a time. Raises TypeError as soon
+        as the top level is found not to be a list or a row is not an object.
+        :param json_stream: File-like object
+        :param source_name: Name of the input used in error messages, e.g. the filename
+        :return: <generator>
+        """
+        for row_number, row in enumerate(
+                DatimImapFactory.iter_json_list(json_stream, source_name=source_name), start=1):
+            if not isinstance(row, dict):
+                err_msg = "ERROR: Expected JSON object for row %s in '%s'. '%s' found. Could not load IMAP." % (
+                    row_number, source_name, type(row))
+                raise TypeError(err_msg)
+            yield row
 
-        # Validate
-        if not isinstance(imap_data, list):
+    @staticmethod
+    def iter_imap_backups(json_stream, period_filter=None, country_code_filter=None):
+        """
+        Generator that reads an IMAP backup file one entry at a time and yields an
+        (imap_backup, imap) tuple for each entry that passes the filters. For successful
+        backups, the rows are moved out of imap_backup['imap'] into a DatimImap as they are
+        read; otherwise imap is None and imap_backup is returned unchanged.
+        :param json_stream: File-like object of a backup created by imapbackup.py
+        :param period_filter: Optional list of periods to include, e.g. ['FY19', 'FY20']
+        :param country_code_filter: Optional list of country codes to include, e.g. ['BI']
+        :return: <generator>
+        """
+        source_name = getattr(json_stream, 'name', '')
+        for imap_backup in DatimImapFactory.iter_json_list(json_stream, source_name=source_name):
+            if not isinstance(imap_backup, dict):
+                err_msg = "ERROR: Expected JSON object for IMAP backup in '%s'. '%s' found." % (
+                    source_name, type(imap_backup))
+                raise TypeError(err_msg)
+            if period_filter and imap_backup.get('period') not in period_filter:
+                continue
+            elif country_code_filter and imap_backup.get('country_code') not in country_code_filter:
+                continue
+            imap = None
+            if imap_backup.get('status') == 'Success':
+                imap = DatimImap(
+                    imap_data=imap_backup.pop('imap'),
+                    period=imap_backup['period'],
+                    country_org=imap_backup['country_org'],
+                    country_name=imap_backup['country_name'],
+                    country_code=imap_backup['country_code'])
+            yield imap_backup, imap
+
+    @staticmethod
+    def iter_json_list(json_stream, source_name='', chunk_size=65536):
+        """
+        Generator that incrementally parses a top-level JSON list, yielding each item as soon
+        as it has been read. Raises TypeError if the top level is not a list and ValueError
+        for malformed JSON, as soon as the malformed item has been read.
+        :param json_stream: Text or binary file-like object
+        :param source_name: Name of the input used in error messages, e.g. the filename
+        :param chunk_size: Number of characters to read at a time
+        :return: <generator>
+        """
+        reader = datimjsonstream.DatimJsonStreamReader(
+            json_stream, source_name=source_name, chunk_size=chunk_size)
+        found_type = reader.get_next_type()
+        if found_type is not None and found_type is not list:
             err_msg = "ERROR: Expected JSON list in '%s'. '%s' found. Could not load IMAP." % (
-                json_filename, type(imap_data))
+                source_name, found_type)
             raise TypeError(err_msg)
-
-        return DatimImap(imap_data=imap_data, country_code=country_code,
-                         country_name=country_name, country_org=country_org, period=period)
+        for item in reader.iter_list():
+            yield item
+        reader.read_end()
 
     @staticmethod
     def load_imap_from_csv(csv_filename='', country_code='', country_org='',
-                           country_name='', period=''):
+                           country_name='', period='', csv_stream=None, validate=False,
+                           max_errors=None):
         """
-        Load IMAP from CSV file
+        Load IMAP from CSV file or stream. Rows are streamed into the IMAP without building a
+        dictionary per row, so an uploaded file can be piped in without writing it to disk.
         :param csv_filename:
         :param country_code:
         :param country_org:
         :param country_name:
         :param period:
+        :param csv_stream: File-like object or iterable of CSV lines; used instead of csv_filename
+        :param validate: Raise an exception listing line numbers if required columns or fields
+            are missing
+        :param max_errors: Stop reading after this many validation errors if set
         :return:
         """
-        with open(csv_filename, 'r') as input_file:
-            imap_data = csv.DictReader(input_file)
-            return DatimImap(imap_data=imap_data, country_code=country_code,
-                             country_name=country_name, country_org=country_org, period=period)
+        imap = DatimImap(imap_data=[], country_code=country_code, country_name=country_name,
+                         country_org=country_org, period=period)
+        if csv_stream is not None:
+            report = imap.set_imap_data_from_csv(csv_stream, validate=validate, max_errors=max_errors)
+        else:
+            with open(csv_filename, 'r') as input_file:
+                report = imap.set_imap_data_from_csv(
+                    input_file, validate=validate, max_errors=max_errors)
+        if report.errors:
+            raise Exception(report.get_message())
+        return imap
 
     @staticmethod
     def load_imap_from_ocl(oclenv='', oclapitoken='', run_ocl_offline=False,
@@ -1095,7 +1969,7 @@ class DatimImapFactory(object):
     @staticmethod
     def get_new_repo_version_json(owner_type='', owner_id='', repo_type='', repo_id='',
                                   released=True, repo_version_id='',
-                                  repo_version_desc='Automatically created version'):
+                                  repo_version_desc='Automatically created version', extras=None):
         """ Returns OCL-formatted JSON to create a new repository version """
         if repo_type == ocldev.oclconstants.OclConstants.RESOURCE_TYPE_SOURCE:
             obj_type = ocldev.oclconstants.OclConstants.RESOURCE_TYPE_SOURCE_VERSION
@@ -1115,187 +1989,313 @@ class DatimImapFactory(object):
             'owner': owner_id,
             'owner_type': owner_type,
         }
+        if extras:
+            new_version_data['extras'] = extras
         return new_version_data
 
     @staticmethod
-    def generate_import_script_from_diff(imap_diff, verbose=True):
+    def generate_import_script_from_diff(imap_diff, verbose=True, include_repo_versions=False):
         """
-        Return a list of JSON imports representing the diff
-        TODO: Must be updated before used
+        Return a list of JSON imports that update the IMAP A of the diff in OCL to match IMAP B,
+        i.e. only the resources affected by the diff (see plan_import_from_diff)
         :param imap_diff: IMAP diff used to generate the import script
         :param verbose:
+        :param include_repo_versions: Append a new country source version and collection versions
         :return list: Ordered list of dictionaries ready for import
         """
-        import_list = []
-        import_list_narrative = []
-        diff_data = imap_diff.get_diff()
-
-        # Handle 'dictionary_item_added' - new country mapping
-        if 'dictionary_item_added' in diff_data:
-            for diff_key in list(diff_data['dictionary_item_added'].keys()):
-                row_key = diff_key.strip("root['").strip("']")
-                csv_row = diff_data['dictionary_item_added'][diff_key]
-
-                # country indicator
-                country_indicator_id = csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]
-                country_indicator_name = csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME]
-                if imap_diff.imap_a.has_country_indicator(
-                        indicator_id=country_indicator_id, indicator_name=country_indicator_name):
-                    # do nothing
-                    pass
-                elif imap_diff.imap_a.has_country_indicator(indicator_id=country_indicator_id):
-                    # update
-                    import_list_narrative.append('Update country indicator: %s, %s' % (
-                        country_indicator_id, country_indicator_name))
-                    import_list += imap_diff.imap_b.get_country_indicator_update_json(csv_row)
-                else:
-                    # new
-                    import_list_narrative.append('Create new country indicator: %s, %s' % (
-                        country_indicator_id, country_indicator_name))
-                    import_list += imap_diff.imap_b.get_country_indicator_create_json(csv_row)
-
-                # country disag
-                country_disag_id = csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]
-                country_disag_name = csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]
-                if imap_diff.imap_a.has_country_disag(
-                        disag_id=country_disag_id, disag_name=country_disag_name):
-                    # do nothing - disag already exists
-                    pass
-                elif country_disag_id == datimbase.DatimBase.NULL_DISAG_ID:
-                    # do nothing - we do not need to re-create the null_disag concept
-                    pass
-                elif imap_diff.imap_a.has_country_disag(disag_id=country_disag_id):
-                    # update - country disag exists, but name is different
-                    import_list_narrative.append('Update country disag: %s, %s' % (
-                        country_disag_id, country_disag_name))
-                    import_list += imap_diff.imap_b.get_country_disag_update_json(csv_row)
-                else:
-                    # new - country disag does not exist, so create it
-                    import_list_narrative.append('Create new country disag: %s, %s' % (
-                        country_disag_id, country_disag_name))
-                    import_list += imap_diff.imap_b.get_country_disag_create_json(csv_row)
-
-                # country collection
-                # TODO: Compare this against OCL not the original IMAP - low priority
-                if not imap_diff.imap_a.has_country_collection(csv_row):
-                    full_csv_row = imap_diff.imap_b.add_columns_to_row(csv_row.copy())
-                    import_list_narrative.append('Create country collection: %s' % (
-                        full_csv_row[DatimImap.IMAP_EXTRA_FIELD_MOH_COLLECTION_ID]))
-                    import_list += imap_diff.imap_b.get_country_collection_create_json(csv_row)
-
-                # country DATIM mapping
-                # TODO: Compare this against OCL not the original IMAP - low priority
-                if not imap_diff.imap_a.has_country_datim_mapping(csv_row):
-                    import_list_narrative.append('Create DATIM mapping: %s, %s --> %s --> %s, %s' % (
+        import_plan = DatimImapFactory.plan_import_from_diff(
+            imap_diff, include_repo_versions=include_repo_versions)
+
+        # Dedup the import list without changing order, keeping the last occurrence of each
+        # resource together with the step that generated it
+        planned_resources_dedup = datimbase.DatimBase.dedup_list(
+            [(narrative, resource) for narrative, resources in import_plan for resource in resources],
+            keep_last=True,
+            key=lambda planned_resource: datimbase.DatimBase.get_resource_fingerprint(planned_resource[1]))
+
+        # Display additional debug info
+        if verbose:
+            for narrative, resources in import_plan:
+                if not resources:
+                    print(narrative)
+            for i, (narrative, resource) in enumerate(planned_resources_dedup):
+                print('[%s of %s] %s -- %s' % (i + 1, len(planned_resources_dedup), narrative, resource))
+
+        return [resource for narrative, resource in planned_resources_dedup]
+
+    @staticmethod
+    def get_next_version_id(imap_version_id, period):
+        """
+        Returns the version ID following an IMAP version, e.g. "FY19.v2" for "FY19.v1", or the
+        first version of the period, e.g. "FY19.v0", if the version is not known
+        :param imap_version_id:
+        :param period:
+        :return: <str>
+        """
+        minor_version_number = None
+        if imap_version_id and DatimImapFactory.get_period_from_version_id(imap_version_id) == period:
+            try:
+                minor_version_number = DatimImapFactory.get_minor_version_number_from_version_id(
+                    imap_version_id)
+            except ValueError:
+                pass
+        if minor_version_number is None:
+            return '%s.v0' % period
+        return '%s.v%s' % (period, minor_version_number + 1)
+
+    @staticmethod
+    def plan_import_from_diff(imap_diff, include_repo_versions=False):
+        """
+        Returns the steps needed to update IMAP A of the diff to match IMAP B, in one pass
+        over the diff records. Each step is a (narrative, resources) tuple, where resources is
+        the list of OCL resources to import for that step and may be empty for steps that are
+        only reported. Lookups against IMAP A and B use their DatimImapIndex, so each diff
+        record is resolved in constant time. Resources are not deduplicated.
+
+        Added rows create the country concepts, mappings and collections missing from IMAP A
+        and add the references to them. Removed rows delete the reference to the country
+        mapping from its collection and retire the country concepts and mappings that IMAP B
+        no longer uses. Concept references are left in place.
+        :param imap_diff: DatimImapDiff
+        :param include_repo_versions: Append a new released country source version following
+            the version of IMAP A and a version with the same ID for each country collection
+            that has references added or deleted. The source version records the version of
+            every country collection of IMAP A and B in its
+            DatimBase.DATIM_MOH_COLLECTION_VERSIONS_ATTRIBUTE, so that exports of the new
+            version do not need to look up the versions of the unchanged collections.
+        :return: <list>
+        """
+        imap_a = imap_diff.imap_a
+        imap_b = imap_diff.imap_b
+        import_plan = []
+        refs_to_add = {}
+        refs_to_delete = {}
+
+        # Added rows - new country mapping
+        for record in imap_diff.get_added():
+            csv_row = DatimImap.fix_null_disag_in_row(record.new_value)
+            if DatimImap.is_empty_map(csv_row):
+                continue
+
+            # country indicator
+            country_indicator_id = csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]
+            country_indicator_name = csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME]
+            if imap_a.has_country_indicator(
+                    indicator_id=country_indicator_id, indicator_name=country_indicator_name):
+                # do nothing
+                pass
+            elif imap_a.has_country_indicator(indicator_id=country_indicator_id):
+                # update
+                import_plan.append((
+                    'Update country indicator: %s, %s' % (country_indicator_id, country_indicator_name),
+                    imap_b.get_country_indicator_update_json(csv_row)))
+            else:
+                # new
+                import_plan.append((
+                    'Create new country indicator: %s, %s' % (country_indicator_id, country_indicator_name),
+                    imap_b.get_country_indicator_create_json(csv_row)))
+
+            # country disag
+            country_disag_id = csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]
+            country_disag_name = csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]
+            if imap_a.has_country_disag(disag_id=country_disag_id, disag_name=country_disag_name):
+                # do nothing - disag already exists
+                pass
+            elif country_disag_id == datimbase.DatimBase.NULL_DISAG_ID:
+                # do nothing - we do not need to re-create the null_disag concept
+                pass
+            elif imap_a.has_country_disag(disag_id=country_disag_id):
+                # update - country disag exists, but name is different
+                import_plan.append((
+                    'Update country disag: %s, %s' % (country_disag_id, country_disag_name),
+                    imap_b.get_country_disag_update_json(csv_row)))
+            else:
+                # new - country disag does not exist, so create it
+                import_plan.append((
+                    'Create new country disag: %s, %s' % (country_disag_id, country_disag_name),
+                    imap_b.get_country_disag_create_json(csv_row)))
+
+            # country collection
+            # TODO: Compare this against OCL not the original IMAP - low priority
+            full_csv_row = imap_b.add_columns_to_row(csv_row)
+            collection_id = full_csv_row[DatimImap.IMAP_EXTRA_FIELD_MOH_COLLECTION_ID]
+            if not imap_a.has_country_collection(csv_row):
+                import_plan.append((
+                    'Create country collection: %s' % collection_id,
+                    imap_b.get_country_collection_create_json(full_csv_row)))
+
+            # country DATIM mapping
+            # TODO: Compare this against OCL not the original IMAP - low priority
+            if not imap_a.has_country_datim_mapping(csv_row):
+                import_plan.append((
+                    'Create DATIM mapping: %s, %s --> %s --> %s, %s' % (
                         csv_row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_CATEGORY],
                         csv_row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID],
                         datimbase.DatimBase.DATIM_MOH_MAP_TYPE_COUNTRY_OPTION,
                         csv_row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID],
-                        csv_row[DatimImap.IMAP_FIELD_DATIM_DISAG_NAME]))
-                    import_list += imap_diff.imap_b.get_country_datim_mapping_create_json(csv_row)
-
-                # country operation mapping
-                # TODO: Compare this against OCL not the original IMAP - low priority
-                if not imap_diff.imap_a.has_country_operation_mapping(csv_row):
-                    import_list_narrative.append('Create country mapping: %s, %s --> %s --> %s, %s' % (
+                        csv_row[DatimImap.IMAP_FIELD_DATIM_DISAG_NAME]),
+                    imap_b.get_country_datim_mapping_create_json(full_csv_row)))
+
+            # country operation mapping, which may already exist for another DATIM pair
+            # TODO: Compare this against OCL not the original IMAP - low priority
+            if not imap_a.has_country_operation(csv_row):
+                import_plan.append((
+                    'Create country mapping: %s, %s --> %s --> %s, %s' % (
                         csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID],
                         csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME],
                         csv_row[DatimImap.IMAP_FIELD_OPERATION],
                         csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_ID],
-                        csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]))
-                    import_list += imap_diff.imap_b.get_country_operation_mapping_create_json(csv_row)
-
-        # Handle 'dictionary_item_removed' - removed country mapping
-        if 'dictionary_item_removed' in diff_data:
-            for diff_key in list(diff_data['dictionary_item_removed'].keys()):
-                row_key = diff_key.strip("root['").strip("']")
-                csv_row = imap_diff.imap_a.get_imap_row_by_key(row_key)
-
-                # TODO: Retire country operation mapping
-                if imap_diff.imap_a.has_country_operation_mapping(csv_row):
-                    import_list_narrative.append('Retire country mapping: %s, %s --> %s --> %s, %s' % (
+                        csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]),
+                    imap_b.get_country_operation_mapping_create_json(full_csv_row)))
+
+            # collection references
+            collection_refs = refs_to_add.setdefault(collection_id, [])
+            if not imap_a.has_country_collection(csv_row):
+                for expression in imap_b.get_datim_mapping_reference_expressions(full_csv_row):
+                    if expression not in collection_refs:
+                        collection_refs.append(expression)
+            for expression in imap_b.get_country_mapping_reference_expressions(full_csv_row):
+                if expression not in collection_refs:
+                    collection_refs.append(expression)
+
+        # Removed rows - removed country mapping
+        for record in imap_diff.get_removed():
+            csv_row = DatimImap.fix_null_disag_in_row(record.old_value)
+            if DatimImap.is_empty_map(csv_row):
+                continue
+            full_csv_row = imap_a.add_columns_to_row(csv_row)
+            collection_id = full_csv_row[DatimImap.IMAP_EXTRA_FIELD_MOH_COLLECTION_ID]
+
+            # Remove the country mapping from the collection
+            moh_operation_mapping_uri = imap_a.get_country_mapping_reference_expressions(
+                full_csv_row)[0]
+            collection_refs = refs_to_delete.setdefault(collection_id, [])
+            if moh_operation_mapping_uri not in collection_refs:
+                collection_refs.append(moh_operation_mapping_uri)
+
+            # Retire the country operation mapping if no longer used by any DATIM pair
+            if not imap_b.has_country_operation(csv_row):
+                import_plan.append((
+                    'Retire country mapping: %s, %s --> %s --> %s, %s' % (
                         csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID],
                         csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME],
                         csv_row[DatimImap.IMAP_FIELD_OPERATION],
                         csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_ID],
-                        csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]))
-                    import_list += imap_diff.imap_a.get_country_operation_mapping_retire_json(csv_row)
-
-                # TODO: Retire country disag
-                """
-                -- Ignoring for now, because the compare needs to be against OCL itself, not the IMAP object
-                Is country disag used by any mappings that are not in the removed list? 
-                If no, retire the country disag
-                """
-                country_disag_id = csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]
-                country_disag_name = csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]
-                if imap_diff.imap_a.has_country_disag(disag_id=country_disag_id, disag_name=country_disag_name):
-                    import_list_narrative.append('SKIP: Retire country disag: %s, %s' % (
-                        country_disag_id, country_disag_name))
-                    # import_list += imap_diff.imap_a.get_country_disag_retire_json(csv_row)
-
-                # TODO: country indicator
-                """
-                -- Ignoring for now, because the compare needs to be against OCL itself, not the IMAP object
-                Is country indicator used by any mappings that are not in the removed list?
-                If no, retire the country indicator
-                """
-                country_indicator_id = csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]
-                country_indicator_name = csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]
-                if imap_diff.imap_a.has_country_indicator(indicator_id=country_indicator_id,
-                                                          indicator_name=country_indicator_name):
-                    import_list_narrative.append('SKIP: Retire country indicator: %s, %s' % (
-                        country_indicator_id, country_indicator_name))
-                    # import_list += imap_diff.imap_a.get_country_indicator_retire_json(csv_row)
-
-                # TODO: country DATIM mapping
-                """
-                -- Ignoring for now, because the compare needs to be against OCL itself, not the IMAP object
-                Is country collection still active? i.e. are there any mappings in this collection that 
-                are not in the removed list? If no, retire the DATIM mapping
-                """
-
-        # Handle 'values_changed' - updated name for country indicator or disag
-        # NOTE: Names changes to DATIM indicator/disags are ignored
-        if 'values_changed' in diff_data:
-            regex_pattern = r"^root\[\'([a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+)\'\]\[\'(MOH_Disag_Name|MOH_Indicator_Name)\'\]$"
-            for diff_key in list(diff_data['values_changed'].keys()):
-                # Parse the diff resource key
-                regex_result = re.match(regex_pattern, diff_key)
-                if not regex_result:
-                    continue
-                row_key = regex_result.group(1)
-                matched_field_name = regex_result.group(2)
+                        csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]),
+                    imap_a.get_country_operation_mapping_retire_json(full_csv_row)))
 
-                # JP 2019-08-22 not currently used: csv_row_old = imap_diff.imap_a.get_imap_row_by_key(row_key)
-                csv_row_new = imap_diff.imap_b.get_imap_row_by_key(row_key)
+            # Retire the DATIM mapping if the DATIM pair is no longer mapped
+            if not imap_b.has_country_datim_mapping(csv_row):
+                import_plan.append((
+                    'Retire DATIM mapping: %s, %s --> %s --> %s, %s' % (
+                        csv_row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_CATEGORY],
+                        csv_row[DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID],
+                        datimbase.DatimBase.DATIM_MOH_MAP_TYPE_COUNTRY_OPTION,
+                        csv_row[DatimImap.IMAP_FIELD_DATIM_DISAG_ID],
+                        csv_row[DatimImap.IMAP_FIELD_DATIM_DISAG_NAME]),
+                    imap_a.get_country_datim_mapping_retire_json(full_csv_row)))
+
+            # Retire the country indicator if no longer used
+            country_indicator_id = csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID]
+            country_indicator_name = csv_row[DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME]
+            if not imap_b.has_country_indicator(indicator_id=country_indicator_id):
+                import_plan.append((
+                    'Retire country indicator: %s, %s' % (country_indicator_id, country_indicator_name),
+                    imap_a.get_country_indicator_retire_json(full_csv_row)))
+
+            # Retire the country disag if no longer used, except the shared null disag
+            country_disag_id = csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_ID]
+            country_disag_name = csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]
+            if (country_disag_id != datimbase.DatimBase.NULL_DISAG_ID and
+                    not imap_b.has_country_disag(disag_id=country_disag_id)):
+                import_plan.append((
+                    'Retire country disag: %s, %s' % (country_disag_id, country_disag_name),
+                    imap_a.get_country_disag_retire_json(full_csv_row)))
+
+        # Changed rows - updated name for country indicator or disag
+        # NOTE: Names changes to DATIM indicator/disags are ignored
+        for record in imap_diff.get_changed(name_changes_only=True):
+            if record.is_type_change:
+                continue
+            csv_row_new = imap_b.get_imap_row_by_key(record.row_key)
 
-                # MOH_Indicator_Name
-                if matched_field_name == DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME:
-                    import_list_narrative.append('Update country indicator name: %s, %s' % (
+            # MOH_Indicator_Name
+            if record.field_name == DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME:
+                import_plan.append((
+                    'Update country indicator name: %s, %s' % (
                         csv_row_new[DatimImap.IMAP_FIELD_MOH_INDICATOR_ID],
-                        csv_row_new[DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME]))
-                    import_list += imap_diff.imap_b.get_country_indicator_update_json(csv_row_new)
+                        csv_row_new[DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME]),
+                    imap_b.get_country_indicator_update_json(csv_row_new)))
 
-                # MOH_Disag_Name
-                if matched_field_name == DatimImap.IMAP_FIELD_MOH_DISAG_NAME:
-                    import_list_narrative.append('Update country disag name: %s, %s' % (
+            # MOH_Disag_Name
+            if record.field_name == DatimImap.IMAP_FIELD_MOH_DISAG_NAME:
+                import_plan.append((
+                    'Update country disag name: %s, %s' % (
                         csv_row_new[DatimImap.IMAP_FIELD_MOH_DISAG_ID],
-                        csv_row_new[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]))
-                    import_list += imap_diff.imap_b.get_country_disag_update_json(csv_row_new)
-
-        # Dedup the import list without changing order
-        import_list_dedup = [i for n, i in enumerate(import_list) if i not in import_list[n + 1:]]
-        import_list_narrative_dedup = []
-        [import_list_narrative_dedup.append(i) for i in import_list_narrative if not import_list_narrative_dedup.count(i)]
-
-        # Display additional debug info
-        if verbose:
-            for i in range(0, len(import_list_dedup)):
-                print('[%s of %s] %s -- %s' % (
-                    i + 1, len(import_list_dedup), import_list_narrative_dedup[i], import_list_dedup[i]))
-
-        return import_list_dedup
+                        csv_row_new[DatimImap.IMAP_FIELD_MOH_DISAG_NAME]),
+                    imap_b.get_country_disag_update_json(csv_row_new)))
+
+        # Collection references - deletes first, so that a mapping removed from one DATIM pair
+        # and added to another ends up referenced only by the new collection
+        for action, refs_by_collection in (('DELETE', refs_to_delete), (None, refs_to_add)):
+            for collection_id, expressions in refs_by_collection.items():
+                reference = {
+                    'type': ocldev.oclconstants.OclConstants.RESOURCE_TYPE_REFERENCE,
+                    'owner': imap_b.country_org,
+                    'owner_type': ocldev.oclconstants.OclConstants.RESOURCE_TYPE_ORGANIZATION,
+                    'collection': collection_id,
+                    'data': {'expressions': expressions}
+                }
+                if action:
+                    reference['__action'] = action
+                import_plan.append((
+                    '%s %s reference(s) %s collection: %s' % (
+                        'Delete' if action else 'Add', len(expressions),
+                        'from' if action else 'to', collection_id),
+                    [reference]))
+
+        # New country source version and collection versions
+        if include_repo_versions and import_plan:
+            next_version_id = DatimImapFactory.get_next_version_id(imap_a.version, imap_b.period)
+
+            # Only version the collections whose references are added or deleted. A retired
+            # resource is only referenced by collections of removed rows, which all have a
+            # reference deleted, so their collections are versioned too.
+            collection_ids = set(refs_to_add).union(refs_to_delete)
+            collection_version_ids = {}
+            if imap_a.version:
+                collection_version_ids.update(
+                    (collection_id, imap_a.version)
+                    for collection_id in imap_a.get_index().country_collection_ids)
+            collection_version_ids.update(imap_a.collection_versions)
+            collection_version_ids.update(
+                (collection_id, next_version_id) for collection_id in collection_ids)
+            import_plan.append((
+                'Create country source version: %s' % next_version_id,
+                [DatimImapFactory.get_new_repo_version_json(
+                    owner_type=datimbase.DatimBase.DATIM_MOH_COUNTRY_OWNER_TYPE,
+                    owner_id=imap_b.country_org,
+                    repo_type=ocldev.oclconstants.OclConstants.RESOURCE_TYPE_SOURCE,
+                    repo_id=datimbase.DatimBase.DATIM_MOH_COUNTRY_SOURCE_ID,
+                    released=True,
+                    repo_version_id=next_version_id,
+                    repo_version_desc='Automatically created version',
+                    extras={datimbase.DatimBase.DATIM_MOH_COLLECTION_VERSIONS_ATTRIBUTE: dict(
+                        sorted(collection_version_ids.items()))})]))
+            if collection_ids:
+                import_plan.append((
+                    'Create collection versions: %s' % next_version_id,
+                    [DatimImapFactory.get_new_repo_version_json(
+                        owner_type=ocldev.oclconstants.OclConstants.RESOURCE_TYPE_ORGANIZATION,
+                        owner_id=imap_b.country_org,
+                        repo_type=ocldev.oclconstants.OclConstants.RESOURCE_TYPE_COLLECTION,
+                        repo_id=collection_id,
+                        released=True,
+                        repo_version_id=next_version_id,
+                        repo_version_desc='Automatically generated repository version')
+                     for collection_id in sorted(collection_ids)]))
+
+        return import_plan
 
     @staticmethod
     def generate_import_script_from_csv_row(imap_input=None, csv_row=None, defs=None,
@@ -1320,8 +2320,9 @@ class DatimImapFactory(object):
         datim_csv_converter.set_resource_definitions(datim_csv_resource_definitions)
         import_list = datim_csv_converter.process_by_definition()
 
-        # Dedup the import list without changing order using list enumeration
-        import_list_dedup = [i for n, i in enumerate(import_list) if i not in import_list[n + 1:]]
+        # Dedup the import list without changing order
+        import_list_dedup = datimbase.DatimBase.dedup_list(
+            import_list, keep_last=True, key=datimbase.DatimBase.get_resource_fingerprint)
 
         # Display additional debug info
         if verbose:
@@ -1348,8 +2349,9 @@ class DatimImapFactory(object):
         datim_csv_converter.set_resource_definitions(datim_csv_resource_definitions)
         import_list = datim_csv_converter.process_by_definition()
 
-        # Dedup the import list using list enumeration
-        import_list_dedup = [i for n, i in enumerate(import_list) if i not in import_list[n + 1:]]
+        # Dedup the import list without changing order
+        import_list_dedup = datimbase.DatimBase.dedup_list(
+            import_list, keep_last=True, key=datimbase.DatimBase.get_resource_fingerprint)
 
         # Display additional debug info
         if verbose:
@@ -1445,24 +2447,12 @@ class DatimImapFactory(object):
 
             # Add references to DATIM-MOH-FY?? concepts/mappings, if first use of this collection
             if collection_id not in refs_by_collection:
-                datim_has_option_mapping_uri = csv_row[
-                    DatimImap.IMAP_EXTRA_FIELD_DATIM_HAS_OPTION_MAPPING_URI]
-                datim_from_concept_uri = csv_row[
-                    DatimImap.IMAP_EXTRA_FIELD_DATIM_FROM_CONCEPT_URI]
-                datim_to_concept_url = csv_row[DatimImap.IMAP_EXTRA_FIELD_DATIM_TO_CONCEPT_URI]
-                refs_by_collection[collection_id] = [
-                    datim_has_option_mapping_uri, datim_from_concept_uri, datim_to_concept_url]
+                refs_by_collection[collection_id] = imap_input.get_datim_mapping_reference_expressions(
+                    csv_row)
 
             # Add reference to the country ADD or SUBTRACT mapping
-            moh_operation_mapping_uri = csv_row[DatimImap.IMAP_EXTRA_FIELD_MOH_MAPPING_URI]
-            moh_operation_from_concept_uri = csv_row[
-                DatimImap.IMAP_EXTRA_FIELD_MOH_FROM_CONCEPT_URI]
-            if csv_row[DatimImap.IMAP_FIELD_MOH_DISAG_ID] == datimbase.DatimBase.NULL_DISAG_ID:
-                moh_operation_to_concept_url = (
-                    datimbase.DatimBase.get_datim_moh_null_disag_endpoint(imap_input.period))
-            else:
-                moh_operation_to_concept_url = csv_row[
-                    DatimImap.IMAP_EXTRA_FIELD_MOH_TO_CONCEPT_URI]
+            (moh_operation_mapping_uri, moh_operation_from_concept_uri,
+             moh_operation_to_concept_url) = imap_input.get_country_mapping_reference_expressions(csv_row)
             refs_by_collection[collection_id].append(moh_operation_mapping_uri)
             if moh_operation_from_concept_uri not in refs_by_collection[collection_id]:
                 refs_by_collection[collection_id].append(moh_operation_from_concept_uri)
@@ -1534,18 +2524,132 @@ class DatimImapFactory(object):
         return source
 
 
+class DatimImapDiffRecord(collections.namedtuple('DatimImapDiffRecord', [
+        'diff_type', 'row_key', 'field_name', 'old_value', 'new_value'])):
+    """
+    A single difference between two IMAPs. For added and removed rows, field_name is None and
+    new_value or old_value is the row. For changed rows, there is one record per changed field.
+    """
+    __slots__ = ()
+
+    DIFF_TYPE_ADDED = 'added'
+    DIFF_TYPE_REMOVED = 'removed'
+    DIFF_TYPE_CHANGED = 'changed'
+
+    # Fields whose changes only rename a country indicator or disag
+    NAME_FIELD_NAMES = (DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME, DatimImap.IMAP_FIELD_MOH_DISAG_NAME)
+
+    @property
+    def is_name_change(self):
+        """ True if this record is a change to the name of a country indicator or disag """
+        return self.diff_type == self.DIFF_TYPE_CHANGED and self.field_name in self.NAME_FIELD_NAMES
+
+    @property
+    def is_type_change(self):
+        """ True if this record is a change between values of different types """
+        return (self.diff_type == self.DIFF_TYPE_CHANGED and
+                type(self.old_value) is not type(self.new_value))
+
+    def to_dict(self):
+        """ Returns the record as a JSON-serializable dictionary """
+        return {
+            'category': self.diff_type,
+            'row_key': str(self.row_key),
+            'field': self.field_name,
+            'old_value': self.old_value,
+            'new_value': self.new_value,
+        }
+
+
 class DatimImapDiff(object):
     """ Object representing the diff between two IMAP objects """
 
-    def __init__(self, imap_a, imap_b, exclude_empty_maps=False):
+    # Regular expression to split a diff path, e.g. "root['<row_key>']['MOH_Disag_Name']",
+    # into its row key and (optional) field name
+    DIFF_PATH_REGEX = re.compile(
+        r"^root\[(?P<q>['\"])(?P<row_key>.*?)(?P=q)\](?:\[(?P<fq>['\"])(?P<field_name>[^'\"]+)(?P=fq)\])?$")
+
+    # Diff categories in the order they appear in get_diff()
+    DIFF_CATEGORY_TYPE_CHANGES = 'type_changes'
+    DIFF_CATEGORY_ADDED = 'dictionary_item_added'
+    DIFF_CATEGORY_REMOVED = 'dictionary_item_removed'
+    DIFF_CATEGORY_VALUES_CHANGED = 'values_changed'
+
+    # Fields compared for rows with the same key. The remaining fields are part of the row
+    # key, and changes to DATIM_Disag_Name are ignored.
+    DIFF_FIELD_NAMES = (
+        DatimImap.IMAP_FIELD_DATIM_INDICATOR_CATEGORY,
+        DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME,
+        DatimImap.IMAP_FIELD_MOH_DISAG_NAME,
+    )
+
+    # Category of the summary line written by write_jsonl
+    JSONL_CATEGORY_SUMMARY = 'summary'
+
+    def __init__(self, imap_a, imap_b, exclude_empty_maps=False, evaluate=True):
+        """
+        :param imap_a: DatimImap
+        :param imap_b: DatimImap
+        :param exclude_empty_maps:
+        :param evaluate: Evaluate the diff now if True. Set to False to defer the evaluation until
+            the diff results are first accessed, e.g. to only stream the diff records with
+            write_jsonl without holding them in memory.
+        """
         self.imap_a = imap_a
         self.imap_b = imap_b
+        self.exclude_empty_maps = exclude_empty_maps
+        self.__added = []
+        self.__removed = []
+        self.__changed = []
+        self.__has_ignored_changes = False
+        self.__is_evaluated = False
         self.__diff_data = None
-        self.diff(imap_a, imap_b, exclude_empty_maps=exclude_empty_maps)
+        self.__row_keys = {}
+        if evaluate:
+            self.diff(imap_a, imap_b, exclude_empty_maps=exclude_empty_maps)
+
+    @staticmethod
+    def get_keyed_rows(imap, exclude_empty_maps=False, datim_indicator_id=None):
+        """
+        Returns a dictionary of the rows of an IMAP (as views) keyed by DatimImapRowKey.
+        If a key is repeated, the last row wins.
+        :param imap: DatimImap
+        :param exclude_empty_maps:
+        :param datim_indicator_id: Optional DATIM indicator ID or collection of IDs to include
+        :return: <dict>
+        """
+        country_org = imap.country_org
+        return dict((DatimImapRowKey.from_row(row, country_org), row) for row in imap.iter_rows(
+            exclude_empty_maps=exclude_empty_maps, exclude_classification=True, as_view=True,
+            datim_indicator_id=datim_indicator_id))
+
+    @staticmethod
+    def get_changed_indicator_ids(imap_a, imap_b, exclude_empty_maps=False):
+        """
+        Returns the DATIM indicator IDs whose indicator group hashes differ between two IMAPs,
+        i.e. the only indicator groups that can contain differences, and the indicator groups
+        that repeat a row key in either IMAP, whose diff depends on the order of their rows.
+        Returns None if the IMAPs belong to different country orgs, since then every row key
+        differs.
+        :param imap_a: DatimImap
+        :param imap_b: DatimImap
+        :param exclude_empty_maps:
+        :return: <frozenset> or None
+        """
+        if imap_a.country_org != imap_b.country_org:
+            return None
+        fingerprints_a = imap_a.get_indicator_fingerprints(exclude_empty_maps=exclude_empty_maps)
+        fingerprints_b = imap_b.get_indicator_fingerprints(exclude_empty_maps=exclude_empty_maps)
+        return frozenset(
+            indicator_id for indicator_id in set(fingerprints_a).union(fingerprints_b)
+            if fingerprints_a.get(indicator_id) != fingerprints_b.get(indicator_id)).union(
+            imap_a.get_duplicate_row_key_indicator_ids(exclude_empty_maps=exclude_empty_maps),
+            imap_b.get_duplicate_row_key_indicator_ids(exclude_empty_maps=exclude_empty_maps))
 
     def diff(self, imap_a, imap_b, exclude_empty_maps=False):
         """
-        Evaluates the diff between two DatimImap objects
+        Evaluates the diff between two DatimImap objects and keeps the diff records
+        (see iter_diff_records)
         :param imap_a:
         :param imap_b:
         :param exclude_empty_maps:
@@ -1553,51 +2657,233 @@ class DatimImapDiff(object):
         """
         self.imap_a = imap_a
         self.imap_b = imap_b
-        self.__diff_data = deepdiff.DeepDiff(
-            imap_a.get_imap_data(sort=True, exclude_empty_maps=exclude_empty_maps,
-                                 exclude_classification=True, convert_to_dict=True),
-            imap_b.get_imap_data(sort=True, exclude_empty_maps=exclude_empty_maps,
-                                 exclude_classification=True, convert_to_dict=True),
-            verbose_level=2)
-
-        # Post-processing Step 1: Remove the Total vs. default differences
-        if 'values_changed' in self.__diff_data:
-            for diff_key in list(self.__diff_data['values_changed'].keys()):
-                if (self.__diff_data['values_changed'][diff_key]['new_value'] == 'Total' and
-                        self.__diff_data['values_changed'][diff_key]['old_value'] == 'default'):
-                    del(self.__diff_data['values_changed'][diff_key])
-
-        # Post-processing Step 2: Remove name discrepancies in the DATIM indicator and disag names
-        if 'values_changed' in self.__diff_data:
-            regex_pattern = r"^root\[\'([a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+,[a-zA-Z0-9.\-_]+)\'\]\[\'(DATIM_Disag_Name)\'\]$"
-            for diff_key in list(self.__diff_data['values_changed'].keys()):
-                # Parse the diff resource key
-                regex_result = re.match(regex_pattern, diff_key)
-                if regex_result is not None:
-                    del(self.__diff_data['values_changed'][diff_key])
+        self.exclude_empty_maps = exclude_empty_maps
+        self.__diff_data = None
+        self.__added = []
+        self.__removed = []
+        self.__changed = []
+        records_by_type = {
+            DatimImapDiffRecord.DIFF_TYPE_ADDED: self.__added,
+            DatimImapDiffRecord.DIFF_TYPE_REMOVED: self.__removed,
+            DatimImapDiffRecord.DIFF_TYPE_CHANGED: self.__changed,
+        }
+        for record in self.iter_diff_records(imap_a, imap_b, exclude_empty_maps=exclude_empty_maps):
+            records_by_type[record.diff_type].append(record)
+        self.__is_evaluated = True
+
+    def evaluate(self):
+        """ Evaluates the diff unless it has been evaluated, e.g. if created with evaluate=False """
+        if not self.__is_evaluated:
+            self.diff(self.imap_a, self.imap_b, exclude_empty_maps=self.exclude_empty_maps)
+
+    def iter_diff_records(self, imap_a, imap_b, exclude_empty_maps=False):
+        """
+        Generator that evaluates the diff between two DatimImap objects by joining their rows
+        on the row key and comparing the DIFF_FIELD_NAMES of rows present in both. Records are
+        yielded as they are found and are not kept: added and changed rows in the order of
+        IMAP B, then removed rows in the order of IMAP A. Only the indicator groups whose
+        hashes differ or that repeat a row key are compared (see get_changed_indicator_ids).
+        If a row key is repeated, the last row wins.
+        :param imap_a:
+        :param imap_b:
+        :param exclude_empty_maps:
+        :return: <generator> of DatimImapDiffRecord
+        """
+        indicator_ids = DatimImapDiff.get_changed_indicator_ids(
+            imap_a, imap_b, exclude_empty_maps=exclude_empty_maps)
+        if indicator_ids is not None and not indicator_ids:
+            rows_a = rows_b = {}
+        else:
+            rows_a = DatimImapDiff.get_keyed_rows(
+                imap_a, exclude_empty_maps=exclude_empty_maps, datim_indicator_id=indicator_ids)
+            rows_b = DatimImapDiff.get_keyed_rows(
+                imap_b, exclude_empty_maps=exclude_empty_maps, datim_indicator_id=indicator_ids)
+        self.__row_keys = {}
+        for row_key in list(rows_a.keys()) + list(rows_b.keys()):
+            self.__row_keys[str(row_key)] = row_key
+
+        self.__has_ignored_changes = False
+        for row_key, row_b in rows_b.items():
+            row_a = rows_a.get(row_key)
+            if row_a is None:
+                yield DatimImapDiffRecord(
+                    DatimImapDiffRecord.DIFF_TYPE_ADDED, row_key, None, None, row_b.copy())
+                continue
+            for field_name in self.DIFF_FIELD_NAMES:
+                old_value = row_a[field_name]
+                new_value = row_b[field_name]
+                if old_value == new_value and type(old_value) is type(new_value):
+                    continue
+                elif old_value == 'default' and new_value == 'Total':
+                    # Total vs. default differences are not real changes
+                    self.__has_ignored_changes = True
+                    continue
+                yield DatimImapDiffRecord(
+                    DatimImapDiffRecord.DIFF_TYPE_CHANGED, row_key, field_name, old_value, new_value)
+            if (not self.__has_ignored_changes and
+                    row_a[DatimImap.IMAP_FIELD_DATIM_DISAG_NAME] != row_b[DatimImap.IMAP_FIELD_DATIM_DISAG_NAME]):
+                # Name discrepancies in the DATIM disag names are ignored
+                self.__has_ignored_changes = True
+        for row_key, row_a in rows_a.items():
+            if row_key not in rows_b:
+                yield DatimImapDiffRecord(
+                    DatimImapDiffRecord.DIFF_TYPE_REMOVED, row_key, None, row_a.copy(), None)
+
+    def get_added(self):
+        """ Returns a list of DatimImapDiffRecord for rows in IMAP B that are not in IMAP A """
+        self.evaluate()
+        return list(self.__added)
+
+    def get_removed(self):
+        """ Returns a list of DatimImapDiffRecord for rows in IMAP A that are not in IMAP B """
+        self.evaluate()
+        return list(self.__removed)
+
+    def get_changed(self, name_changes_only=False):
+        """
+        Returns a list of DatimImapDiffRecord, one for each changed field of rows in both IMAPs
+        :param name_changes_only: Only return changes to country indicator and disag names
+        :return: <list>
+        """
+        self.evaluate()
+        if name_changes_only:
+            return [record for record in self.__changed if record.is_name_change]
+        return list(self.__changed)
+
+    @staticmethod
+    def get_diff_path(row_key, field_name=None):
+        """
+        Returns the diff path for a row key and optional field name in the same format as
+        DeepDiff, e.g. "root['<row_key>']['MOH_Disag_Name']"
+        :param row_key: DatimImapRowKey or <str>
+        :param field_name:
+        :return: <str>
+        """
+        diff_path = 'root%s' % DatimImapDiff.__quote_path_element(str(row_key))
+        if field_name:
+            diff_path += DatimImapDiff.__quote_path_element(field_name)
+        return diff_path
+
+    @staticmethod
+    def __quote_path_element(value):
+        if "'" in value:
+            return '["%s"]' % value
+        return "['%s']" % value
+
+    def parse_diff_key(self, diff_key):
+        """
+        Returns the DatimImapRowKey and field name (or None) referenced by a diff key,
+        e.g. "root['<row_key>']['MOH_Disag_Name']". Returns (None, None) if not recognized.
+        :param diff_key: <str>
+        :return: <tuple>
+        """
+        regex_result = self.DIFF_PATH_REGEX.match(diff_key)
+        if not regex_result:
+            return None, None
+        str_row_key = regex_result.group('row_key')
+        row_key = self.__row_keys.get(str_row_key)
+        if row_key is None:
+            try:
+                row_key = DatimImapRowKey.from_string(str_row_key)
+            except ValueError:
+                return None, None
+        return row_key, regex_result.group('field_name')
 
     def get_diff(self):
         """
-        Returns the diff results
+        Returns the diff results as a dictionary in the format used by DeepDiff with
+        verbose_level=2, keyed by diff category and diff path. Evaluates the diff first if it
+        was created with evaluate=False.
         :return:
         """
+        self.evaluate()
+        if self.__diff_data is None:
+            diff_data = {}
+            for record in self.__changed:
+                if record.is_type_change:
+                    diff_data.setdefault(self.DIFF_CATEGORY_TYPE_CHANGES, {})[
+                        self.get_diff_path(record.row_key, record.field_name)] = {
+                            'old_type': type(record.old_value), 'new_type': type(record.new_value),
+                            'old_value': record.old_value, 'new_value': record.new_value}
+            for category, records, value_attr in (
+                    (self.DIFF_CATEGORY_ADDED, self.__added, 'new_value'),
+                    (self.DIFF_CATEGORY_REMOVED, self.__removed, 'old_value')):
+                if records:
+                    diff_data[category] = dict(
+                        (self.get_diff_path(record.row_key), getattr(record, value_attr))
+                        for record in records)
+            values_changed = dict(
+                (self.get_diff_path(record.row_key, record.field_name),
+                 DatimImapDiff.__get_value_change(record.old_value, record.new_value))
+                for record in self.__changed if not record.is_type_change)
+            if values_changed or self.__has_ignored_changes:
+                diff_data[self.DIFF_CATEGORY_VALUES_CHANGED] = values_changed
+            self.__diff_data = diff_data
         return self.__diff_data
 
+    @staticmethod
+    def __get_value_change(old_value, new_value):
+        """ Returns a values_changed entry, including a unified diff for multi-line strings """
+        value_change = {'new_value': new_value, 'old_value': old_value}
+        if isinstance(old_value, str) and ('\n' in old_value or '\n' in new_value):
+            diff = list(difflib.unified_diff(
+                old_value.splitlines(), new_value.splitlines(), lineterm=''))
+            if diff:
+                value_change['diff'] = '\n'.join(diff)
+        return value_change
+
     def get_num_diffs(self):
-        num = 0
-        for diff_category in list(self.__diff_data.keys()):
-            for resource_diff_key, resource_diff in list(self.__diff_data[diff_category].items()):
-                num += 1
-        return num
+        self.evaluate()
+        return len(self.__added) + len(self.__removed) + len(self.__changed)
+
+    def write_jsonl(self, output_file, summary_only=False):
+        """
+        Writes the diff as JSON lines: one object per diff record with the category, row key,
+        field, old value and new value, followed by a summary object with the number of records
+        per category. If the diff was created with evaluate=False, records are written as they
+        are computed and are not kept in memory.
+        :param output_file: Text file object, e.g. sys.stdout
+        :param summary_only: Only write the summary object if True
+        :return: <dict> The summary object
+        """
+        counts = {
+            DatimImapDiffRecord.DIFF_TYPE_ADDED: 0,
+            DatimImapDiffRecord.DIFF_TYPE_REMOVED: 0,
+            DatimImapDiffRecord.DIFF_TYPE_CHANGED: 0,
+        }
+        if self.__is_evaluated:
+            records = itertools.chain(self.__added, self.__removed, self.__changed)
+        else:
+            records = self.iter_diff_records(
+                self.imap_a, self.imap_b, exclude_empty_maps=self.exclude_empty_maps)
+        for record in records:
+            counts[record.diff_type] += 1
+            if not summary_only:
+                output_file.write(json.dumps(record.to_dict(), default=str))
+                output_file.write('\n')
+        summary = {
+            'category': self.JSONL_CATEGORY_SUMMARY,
+            'country_org_a': self.imap_a.country_org,
+            'country_org_b': self.imap_b.country_org,
+            'num_added': counts[DatimImapDiffRecord.DIFF_TYPE_ADDED],
+            'num_removed': counts[DatimImapDiffRecord.DIFF_TYPE_REMOVED],
+            'num_changed': counts[DatimImapDiffRecord.DIFF_TYPE_CHANGED],
+            'num_diffs': sum(counts.values()),
+            'has_ignored_changes': self.__has_ignored_changes,
+        }
+        output_file.write(json.dumps(summary))
+        output_file.write('\n')
+        return summary
 
     def display(self):
-        for diff_category in list(self.__diff_data.keys()):
+        diff_data = self.get_diff()
+        for diff_category in list(diff_data.keys()):
             print('** DIFF CATEGORY: %s' % diff_category)
             i = 0
-            for resource_diff_key, resource_diff in list(self.__diff_data[diff_category].items()):
+            for resource_diff_key, resource_diff in list(diff_data[diff_category].items()):
                 i += 1
                 print('    [%s of %s] %s -- %s' % (
-                    i, len(self.__diff_data[diff_category]), resource_diff_key, resource_diff))
+                    i, len(diff_data[diff_category]), resource_diff_key, resource_diff))
 
 
 class DatimMohCsvToJsonConverter(ocldev.oclcsvtojsonconverter.OclCsvToJsonConverter):
@@ -1731,26 +3017,6 @@ class DatimMohCsvToJsonConverter(ocldev.oclcsvtojsonconverter.OclCsvToJsonConver
                     {'resource_field': 'retired', 'value': False},
                 ]
             },
-            {
-                'definition_name': DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_OPERATION_MAPPING_RETIRED,
-                'is_active': False,
-                'resource_type': 'Mapping',
-                'id_column': None,
-                'internal_external': {
-                    'value': ocldev.oclconstants.OclConstants.MAPPING_TARGET_INTERNAL},
-                ocldev.oclcsvtojsonconverter.OclCsvToJsonConverter.DEF_CORE_FIELDS: [
-                    {'resource_field': 'from_concept_url',
-                     'column': DatimImap.IMAP_EXTRA_FIELD_MOH_FROM_CONCEPT_URI},
-                    {'resource_field': 'map_type',
-                     'column': DatimImap.IMAP_EXTRA_FIELD_MOH_MAP_TYPE},
-                    {'resource_field': 'to_concept_url',
-                     'column': DatimImap.IMAP_EXTRA_FIELD_MOH_TO_CONCEPT_URI},
-                    {'resource_field': 'owner', 'value': country_owner},
-                    {'resource_field': 'owner_type', 'value': country_owner_type},
-                    {'resource_field': 'source', 'value': country_source},
-                    {'resource_field': 'retired', 'value': True},
-                ]
-            },
             {
                 'definition_name': DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_COLLECTION,
                 'is_active': True,
@@ -1774,6 +3040,33 @@ class DatimMohCsvToJsonConverter(ocldev.oclcsvtojsonconverter.OclCsvToJsonConver
                 ]
             },
         ]
+
+        # Retired variants of the country concepts and mappings, used when applying a diff. These
+        # are inactive by default so that they are never included in a full IMAP import.
+        retired_definition_names = {
+            DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_INDICATOR:
+                DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_INDICATOR_RETIRED,
+            DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DISAG:
+                DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DISAG_RETIRED,
+            DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DATIM_MAPPING:
+                DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_DATIM_MAPPING_RETIRED,
+            DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_OPERATION_MAPPING:
+                DatimMohCsvToJsonConverter.CSV_RESOURCE_DEF_MOH_OPERATION_MAPPING_RETIRED,
+        }
+        for csv_definition in list(csv_resource_definitions):
+            if csv_definition['definition_name'] not in retired_definition_names:
+                continue
+            retired_definition = dict(csv_definition)
+            retired_definition['definition_name'] = retired_definition_names[
+                csv_definition['definition_name']]
+            retired_definition['is_active'] = False
+            retired_definition[ocldev.oclcsvtojsonconverter.OclCsvToJsonConverter.DEF_CORE_FIELDS] = [
+                {'resource_field': 'retired', 'value': True} if core_field['resource_field'] == 'retired'
+                else core_field
+                for core_field in csv_definition[
+                    ocldev.oclcsvtojsonconverter.OclCsvToJsonConverter.DEF_CORE_FIELDS]]
+            csv_resource_definitions.append(retired_definition)
+
         if defs:
             for csv_definition in csv_resource_definitions:
                 if csv_definition['definition_name'] not in defs:
@@ -16,11 +16,16 @@ period (e.g. FY17). Export follows the format of the country mapping CSV templat
     indicator_category_code - HTS_TST
 """
 import json
+import threading
+import zlib
 
 import ocldev.oclfleximporter
+import settings
 
 from . import datimbase
+from . import datimexportcache
 from . import datimimap
+from . import datimimapfingerprint
 from . import datimimapimport
 from . import datimsyncmohhelper
 from utils import timer
@@ -45,7 +50,23 @@ class DatimImapExport(datimbase.DatimBase):
     Class to export PEPFAR country mapping metadata stored in OCL in various formats.
     """
 
-    def __init__(self, oclenv='', oclapitoken='', verbosity=0, run_ocl_offline=False):
+    # Version of the format of the pre-processed DATIM-MOH structures saved in the export cache
+    # (see get_datim_moh_structure). Structures saved with a different format version are rebuilt.
+    DATIM_MOH_STRUCTURE_FORMAT_VERSION = 1
+
+    # Pre-processed DATIM-MOH structures shared by all DatimImapExport objects of the process,
+    # keyed by (oclenv, period, datim_version_id)
+    __datim_moh_structures = {}
+    __datim_moh_structure_locks = {}
+    __datim_moh_structures_lock = threading.Lock()
+
+    # Reasons a country collection is not attached to a DATIM indicator+disag pair (see
+    # missing_datim_pairs)
+    MISSING_DATIM_PAIR_NO_COUNTRY_OPTION = 'no_country_option_mapping'
+    MISSING_DATIM_PAIR_NOT_IN_DATIM_MOH = 'pair_not_in_datim_moh_source'
+
+    def __init__(self, oclenv='', oclapitoken='', verbosity=0, run_ocl_offline=False,
+                 fingerprint_store=None):
         """
         Initialize an DatimImapExport object
         :param oclenv: Base URL for the OCL environment with hanging slash omitted,
@@ -53,12 +74,28 @@ class DatimImapExport(datimbase.DatimBase):
         :param oclapitoken: API token of the OCL user account making the export request
         :param verbosity: Verbosity level (0=none, 1=some, 2=tons)
         :param run_ocl_offline:
+        :param fingerprint_store: DatimImapFingerprintStore object used to save the fingerprint of
+            each export of the latest country version. Defaults to the fingerprint store in the
+            data folder if settings.compare2previousexport is on, since the fingerprints are only
+            used to skip imports. Otherwise no fingerprint is saved.
         """
         datimbase.DatimBase.__init__(self)
         self.verbosity = verbosity
         self.oclenv = oclenv
         self.oclapitoken = oclapitoken
         self.run_ocl_offline = run_ocl_offline
+        if fingerprint_store is None and getattr(settings, 'compare2previousexport', False):
+            fingerprint_store = datimimapfingerprint.DatimImapFingerprintStore(
+                filename=self.attach_absolute_data_path(
+                    datimimapfingerprint.DatimImapFingerprintStore.DEFAULT_FILENAME))
+        self.fingerprint_store = fingerprint_store
+        self.__datim_moh_structure_keys = {}
+        self.__datim_moh_structure_key_locks = {}
+        self.__lock = threading.Lock()
+
+        # Country collections skipped by the last call to get_imap, because they are not mapped to
+        # a DATIM indicator+disag pair of the DATIM-MOH source
+        self.missing_datim_pairs = []
 
         # Prepare the headers
         self.oclapiheaders = {
@@ -136,7 +173,8 @@ class DatimImapExport(datimbase.DatimBase):
         country_source_endpoint = '%ssources/%s/' % (
             country_owner_endpoint, self.DATIM_MOH_COUNTRY_SOURCE_ID)
         country_source_url = '%s%s' % (self.oclenv, country_source_endpoint)
-        if period and version:
+        is_latest_version = not version or version == 'latest'
+        if period and not is_latest_version:
             country_version_id = '%s.%s' % (period, version)
             country_minor_version = version
         else:
@@ -156,97 +194,76 @@ class DatimImapExport(datimbase.DatimBase):
             self.vlog(1, msg)
             raise DatimUnknownCountryPeriodError(msg)
         self.vlog(1, 'Using version "%s" for country "%s"' % (country_version_id, country_org))
+
+        # Versions of the country collections recorded by an IMAP patch, if any
+        if not is_latest_version or 'extras' not in country_version:
+            country_version = self.get_repo_version(country_source_endpoint, country_version_id) or {}
+        recorded_collection_version_ids = (country_version.get('extras') or {}).get(
+            self.DATIM_MOH_COLLECTION_VERSIONS_ATTRIBUTE) or {}
         imap_timer.lap(label='STEP 2: Parse IMAP export parameters')
 
+        # Steps 3, 5 and 6 only depend on the country version, so their downloads are submitted
+        # to the HTTP engine now and overlap. The laps of these steps measure the time spent
+        # waiting for each download.
+        country_source_zip_filename = self.endpoint2filename_ocl_export_zip(country_source_endpoint)
+        country_source_json_filename = self.endpoint2filename_ocl_export_json(
+            country_source_endpoint)
+        country_collections_endpoint = '%scollections/' % country_owner_endpoint
+        ocl_export_stats = {}
+        collection_version_ids = {}
+        datim_moh_structure_future = self.http_engine.submit(self.get_datim_moh_structure, period)
+        country_source_future = self.http_engine.submit(
+            self.get_country_source_concepts, endpoint=country_source_endpoint,
+            version=country_version_id, zipfilename=country_source_zip_filename,
+            jsonfilename=country_source_json_filename)
+        country_collections_future = self.http_engine.submit(
+            self.get_ocl_exports_async, endpoint=country_collections_endpoint, period=period,
+            version=country_minor_version, stats=ocl_export_stats,
+            recorded_version_ids=recorded_collection_version_ids,
+            exported_version_ids=collection_version_ids)
+
         # STEP 3 of 8: Download DATIM-MOH-xx source for specified period (e.g. DATIM-MOH-FY18)
         self.vlog(1, '**** STEP 3 of 8: Download DATIM-MOH source for specified period (e.g. DATIM-MOH-FY18)')
         datim_moh_source_id = datimbase.DatimBase.get_datim_moh_source_id(period)
-        datim_source_endpoint = datimbase.DatimBase.get_datim_moh_source_endpoint(period)
-        datim_source_url = '%s%s' % (self.oclenv, datim_source_endpoint)
-        datim_version = datimimap.DatimImapFactory.get_repo_latest_period_version(
-            repo_url=datim_source_url, period=period, oclapitoken=self.oclapitoken)
-        if not datim_version:
-            msg = 'ERROR: %s does not exist or no valid repository version defined for period (e.g. FY19.v1)' % (
-                datim_source_endpoint)
-            self.vlog(1, msg)
-            raise DatimUnknownDatimPeriodError(msg)
-        datim_version_id = datim_version['id']
-        datim_source_zip_filename = self.endpoint2filename_ocl_export_zip(datim_source_endpoint)
-        datim_source_json_filename = self.endpoint2filename_ocl_export_json(datim_source_endpoint)
-        if not self.run_ocl_offline:
-            self.get_ocl_export(
-                endpoint=datim_source_endpoint, version=datim_version_id,
-                zipfilename=datim_source_zip_filename, jsonfilename=datim_source_json_filename)
-        else:
-            self.does_offline_data_file_exist(datim_source_json_filename, exit_if_missing=True)
+        datim_version_id, datim_moh_structure = datim_moh_structure_future.result()
         imap_timer.lap(label='STEP 3: Download DATIM-MOH-xx source')
 
         # STEP 4 of 8: Pre-process DATIM-MOH indicator+disag structure
+        # NOTE: The pre-processed structure is shared by all exports of this period and must not be
+        # modified, so the operations of the country are collected separately in step 7
         self.vlog(1, '**** STEP 4 of 8: Pre-process DATIM-MOH indicator+disag structure')
-        indicators = {}
-        disaggregates = {}
-        with open(self.attach_absolute_data_path(datim_source_json_filename), 'rb') as handle_datim_source:
-            datim_source = json.load(handle_datim_source)
-
-            # Split up the indicator and disaggregate concepts
-            for concept in datim_source['concepts']:
-                if concept['concept_class'] == self.DATIM_MOH_CONCEPT_CLASS_DISAGGREGATE:
-                    disaggregates[concept['url']] = concept.copy()
-                elif concept['concept_class'] == self.DATIM_MOH_CONCEPT_CLASS_DE:
-                    indicators[concept['url']] = concept.copy()
-                    indicators[concept['url']]['mappings'] = []
-
-            # Now iterate through the mappings
-            for mapping in datim_source['mappings']:
-                if mapping['map_type'] == self.DATIM_MOH_MAP_TYPE_HAS_OPTION:
-                    if mapping['from_concept_url'] not in indicators:
-                        msg = 'ERROR: Missing indicator from_concept: %s' % (
-                            mapping['from_concept_url'])
-                        self.vlog(1, msg)
-                        raise Exception(msg)
-                    indicators[mapping['from_concept_url']]['mappings'].append(mapping.copy())
-                else:
-                    self.vlog(1, 'SKIPPING: Unrecognized map type "%s" for mapping: %s' % (
-                        mapping['map_type'], str(mapping)))
+        indicators = datim_moh_structure['indicators']
+        disaggregates = datim_moh_structure['disaggregates']
+        mappings_by_datim_pair = datim_moh_structure['mappings_by_datim_pair']
         imap_timer.lap(label='STEP 4: Pre-process DATIM-MOH indicator+disag structure')
 
         # STEP 5 of 8: Download and process country source
         # NOTE: This returns the individual country concepts and mappings
         self.vlog(1, '**** STEP 5 of 8: Download and process country source')
-        country_source_zip_filename = self.endpoint2filename_ocl_export_zip(country_source_endpoint)
-        country_source_json_filename = self.endpoint2filename_ocl_export_json(
-            country_source_endpoint)
-        if not self.run_ocl_offline:
-            self.get_ocl_export(
-                endpoint=country_source_endpoint, version=country_version_id,
-                zipfilename=country_source_zip_filename, jsonfilename=country_source_json_filename)
-        else:
-            self.does_offline_data_file_exist(country_source_json_filename, exit_if_missing=True)
-        country_indicators = {}
-        country_disaggregates = {}
-        with open(self.attach_absolute_data_path(country_source_json_filename), 'rb') as handle_country_source:
-            country_source = json.load(handle_country_source)
-            for concept in country_source['concepts']:
-                if concept['concept_class'] == self.DATIM_MOH_CONCEPT_CLASS_DISAGGREGATE:
-                    country_disaggregates[concept['url']] = concept.copy()
-                elif concept['concept_class'] == self.DATIM_MOH_CONCEPT_CLASS_DE:
-                    country_indicators[concept['url']] = concept.copy()
+        country_indicators, country_disaggregates = country_source_future.result()
         imap_timer.lap(label='STEP 5: Download and process country source')
 
         # STEP 6 of 8: Async download of country indicator+disag collections
         # NOTE: This returns the collections that define how individual concepts/mappings from the
         # country source combine to map country indicator+disag pairs to DATIM indicator+disag pairs
         self.vlog(1, '**** STEP 6 of 8: Async download of country indicator+disag mappings')
-        country_collections_endpoint = '%scollections/' % country_owner_endpoint
         if self.run_ocl_offline:
             self.vlog(1, 'WARNING: Offline not supported here yet. Taking this ship online!')
-        country_collections = self.get_ocl_exports_async(
-            endpoint=country_collections_endpoint, period=period, version=country_minor_version)
-        imap_timer.lap(label='STEP 6: Async download of country indicator+disag mappings')
+        country_collections = country_collections_future.result()
+        imap_timer.lap(label='STEP 6: Async download of country indicator+disag mappings '
+                             '(%s cached, %s exports, %.2f/s, concurrency %s-%s, %s throttled)' % (
+                                 ocl_export_stats['num_cached'],
+                                 ocl_export_stats['num_exports'],
+                                 ocl_export_stats['exports_per_second'],
+                                 ocl_export_stats['min_concurrency'],
+                                 ocl_export_stats['max_concurrency'],
+                                 ocl_export_stats['num_throttled']))
 
         # STEP 7 of 8: Process one country collection at a time
         self.vlog(1, '**** STEP 7 of 8: Process one country collection at a time')
         datim_moh_null_disag_endpoint = datimbase.DatimBase.get_datim_moh_null_disag_endpoint(period)
+        operations_by_datim_pair = {}
+        missing_datim_pairs = []
         for collection_version_export_url, collection_version in list(country_collections.items()):
             collection_id = collection_version['collection']['id']
             operations = []
@@ -296,13 +313,27 @@ class DatimImapExport(datimbase.DatimBase):
                     self.vlog(1, msg)
                     raise Exception(msg)
 
-            # Save set of operations in relevant datim indicator mapping, or skip if indicator has no mappings
-            if datim_indicator_url in indicators:
-                for datim_indicator_mapping in indicators[datim_indicator_url]['mappings']:
-                    if (datim_indicator_mapping['from_concept_url'] == datim_indicator_url and
-                            datim_indicator_mapping['to_concept_url'] == datim_disaggregate_url):
-                        datim_indicator_mapping['operations'] = operations
-        imap_timer.lap(label='STEP 7: Process one country collection at a time')
+            # Save set of operations for the datim indicator+disag pair, or report the missing pair
+            if (datim_indicator_url, datim_disaggregate_url) in mappings_by_datim_pair:
+                operations_by_datim_pair[(datim_indicator_url, datim_disaggregate_url)] = operations
+            else:
+                missing_datim_pairs.append({
+                    'collection_id': collection_id,
+                    'collection_version_export_url': collection_version_export_url,
+                    'datim_indicator_url': datim_indicator_url,
+                    'datim_disag_url': datim_disaggregate_url,
+                    'num_operations': len(operations),
+                    'reason': (self.MISSING_DATIM_PAIR_NOT_IN_DATIM_MOH if datim_indicator_url
+                               else self.MISSING_DATIM_PAIR_NO_COUNTRY_OPTION),
+                })
+        self.missing_datim_pairs = missing_datim_pairs
+        if missing_datim_pairs:
+            self.vlog(1, 'WARNING: %s country collection(s) not mapped to a DATIM indicator+disag pair of "%s" version "%s" were skipped' % (
+                len(missing_datim_pairs), datim_moh_source_id, datim_version_id))
+            for missing_datim_pair in missing_datim_pairs:
+                self.vlog(2, json.dumps(missing_datim_pair))
+        imap_timer.lap(label='STEP 7: Process one country collection at a time (%s skipped)' % (
+            len(missing_datim_pairs)))
 
         # STEP 8 of 8: Convert to tabular format
         self.vlog(1, '**** STEP 8 of 8: Convert to tabular format')
@@ -344,12 +375,12 @@ class DatimImapExport(datimbase.DatimBase):
                         coc_name=mapping[to_concept_name_field])
                 row_base[datimimap.DatimImap.IMAP_FIELD_MOH_CLASSIFICATION] = classification
 
-                moh_disag = mapping['from_concept_url']
-                if 'operations' in mapping and mapping['operations']:
+                operations = operations_by_datim_pair.get((indicator_id, mapping['to_concept_url']))
+                if operations:
                     # Country has mapped content to this datim indicator+disag pair
-                    for operation in mapping['operations']:
+                    for operation in operations:
                         row = row_base.copy()
-                        if 'operations' in mapping and mapping['operations']:
+                        if operations:
                             row[datimimap.DatimImap.IMAP_FIELD_OPERATION] = DatimImapExport.map_type_to_operator(
                                 operation['map_type'])
                             row[datimimap.DatimImap.IMAP_FIELD_MOH_INDICATOR_ID] = DatimImapExport.get_clean_indicator_id(
@@ -370,9 +401,214 @@ class DatimImapExport(datimbase.DatimBase):
         self.vlog(2, '**** IMAP EXPORT SUMMARY')
         self.vlog(2, '** IMAP export time breakdown:\n', imap_timer)
 
-        # Generate and return the IMAP object
-        return datimimap.DatimImap(imap_data=rows, country_code=country_code, country_org=country_org,
-                                   period=period, version=country_version_id)
+        # Generate the IMAP object and save its fingerprint if it is the current country version and
+        # a fingerprint store is used
+        imap = datimimap.DatimImap(imap_data=rows, country_code=country_code, country_org=country_org,
+                                   period=period, version=country_version_id,
+                                   collection_versions=collection_version_ids)
+        if is_latest_version and self.fingerprint_store:
+            self.fingerprint_store.set(
+                country_org, imap.get_fingerprint(), version=country_version_id,
+                version_created_on=country_version.get('created_on'),
+                source=datimimapfingerprint.DatimImapFingerprintStore.SOURCE_EXPORT)
+        return imap
+
+    def get_datim_moh_structure(self, period):
+        """
+        Returns the latest released version ID and the pre-processed indicator+disag structure
+        (see build_datim_moh_structure) of the DATIM-MOH source for the specified period. The
+        structure is built once per OCL environment, period and version, shared by all
+        DatimImapExport objects of the process, including exports running concurrently in other
+        threads, and saved to the export cache so that other processes load it instead of
+        downloading and parsing the DATIM-MOH source export. The structure returned also has a
+        "mappings_by_datim_pair" index (see get_mappings_by_datim_pair).
+        :param period: FY18, FY19
+        :return: <tuple> (datim_version_id, datim_moh_structure)
+        """
+        with self.__lock:
+            if period in self.__datim_moh_structure_keys:
+                structure_key = self.__datim_moh_structure_keys[period]
+                return structure_key[2], DatimImapExport.__datim_moh_structures[structure_key]
+            period_lock = self.__datim_moh_structure_key_locks.setdefault(period, threading.Lock())
+        with period_lock:
+            if period not in self.__datim_moh_structure_keys:
+                datim_source_endpoint = datimbase.DatimBase.get_datim_moh_source_endpoint(period)
+                datim_source_url = '%s%s' % (self.oclenv, datim_source_endpoint)
+                datim_version = datimimap.DatimImapFactory.get_repo_latest_period_version(
+                    repo_url=datim_source_url, period=period, oclapitoken=self.oclapitoken)
+                if not datim_version:
+                    msg = 'ERROR: %s does not exist or no valid repository version defined for period (e.g. FY19.v1)' % (
+                        datim_source_endpoint)
+                    self.vlog(1, msg)
+                    raise DatimUnknownDatimPeriodError(msg)
+                structure_key = (self.oclenv, period, datim_version['id'])
+                self.load_datim_moh_structure(structure_key)
+                self.__datim_moh_structure_keys[period] = structure_key
+        structure_key = self.__datim_moh_structure_keys[period]
+        return structure_key[2], DatimImapExport.__datim_moh_structures[structure_key]
+
+    def load_datim_moh_structure(self, structure_key):
+        """
+        Loads the pre-processed DATIM-MOH structure for the key into the structures shared by
+        the process, from the export cache if it is found there, or otherwise from the DATIM-MOH
+        source export, in which case the structure is saved to the export cache. The structure
+        is stored compressed and is subject to the size limit and checksums of the cache.
+        :param structure_key: <tuple> (oclenv, period, datim_version_id)
+        """
+        with DatimImapExport.__datim_moh_structures_lock:
+            if structure_key in DatimImapExport.__datim_moh_structures:
+                return
+            structure_lock = DatimImapExport.__datim_moh_structure_locks.setdefault(
+                structure_key, threading.Lock())
+        with structure_lock:
+            if structure_key in DatimImapExport.__datim_moh_structures:
+                return
+            oclenv, period, datim_version_id = structure_key
+            cache_key = DatimImapExport.get_datim_moh_structure_cache_key(
+                oclenv, period, datim_version_id)
+            datim_moh_structure = None
+            if self.export_cache:
+                content = self.export_cache.get(cache_key)
+                if content is not None:
+                    datim_moh_structure = json.loads(zlib.decompress(content).decode('utf-8'))
+                    if (datim_moh_structure.get('format_version') !=
+                            DatimImapExport.DATIM_MOH_STRUCTURE_FORMAT_VERSION):
+                        datim_moh_structure = None
+                    else:
+                        self.vlog(1, 'DATIM-MOH structure loaded from the export cache: %s' % cache_key)
+            if datim_moh_structure is None:
+                datim_source_endpoint = datimbase.DatimBase.get_datim_moh_source_endpoint(period)
+                datim_source_zip_filename = self.endpoint2filename_ocl_export_zip(datim_source_endpoint)
+                datim_source_json_filename = self.endpoint2filename_ocl_export_json(datim_source_endpoint)
+                datim_moh_structure = self.build_datim_moh_structure(self.get_ocl_export_resources(
+                    endpoint=datim_source_endpoint, version=datim_version_id,
+                    zipfilename=datim_source_zip_filename, jsonfilename=datim_source_json_filename))
+                if self.export_cache:
+                    self.export_cache.put(cache_key, zlib.compress(json.dumps(
+                        datim_moh_structure, separators=(',', ':')).encode('utf-8')))
+                    self.vlog(1, 'DATIM-MOH structure saved to the export cache: %s' % cache_key)
+            datim_moh_structure['mappings_by_datim_pair'] = DatimImapExport.get_mappings_by_datim_pair(
+                datim_moh_structure['indicators'])
+            with DatimImapExport.__datim_moh_structures_lock:
+                DatimImapExport.__datim_moh_structures[structure_key] = datim_moh_structure
+
+    @staticmethod
+    def get_datim_moh_structure_cache_key(oclenv, period, datim_version_id):
+        """
+        Returns the export cache key of the pre-processed DATIM-MOH structure for the specified
+        OCL environment, period and version. The key is that of the DATIM-MOH source version
+        export with a suffix, e.g.
+        https://api.openconceptlab.org|/orgs/PEPFAR/sources/DATIM-MOH-FY21/|FY21.v1#structure
+        """
+        cache_key = datimexportcache.DatimExportCache.get_key(
+            oclenv, datimbase.DatimBase.get_datim_moh_source_endpoint(period), datim_version_id)
+        return cache_key and '%s#structure' % cache_key
+
+    def build_datim_moh_structure(self, datim_source_resources):
+        """
+        Returns the indicator+disag structure of a DATIM-MOH source export, which keeps only the
+        attributes used to build an IMAP:
+            {
+                "format_version": 1,
+                "indicators": {indicator_url: {"id", "external_id", "extras", "mappings": [
+                    {"from_concept_url", "to_concept_url", "to_concept_code",
+                     "to_concept_name", "to_concept_name_resolved"}]}},
+                "disaggregates": {disag_url: {"extras": {"classification"}}}
+            }
+        The structure is built while the export is parsed, so only the kept attributes of the
+        concepts and mappings read so far are held in memory.
+        :param datim_source_resources: Iterable of (resource_type, resource) of the DATIM-MOH
+            source export (see DatimBase.get_ocl_export_resources)
+        :return: <dict>
+        """
+        indicators = {}
+        disaggregates = {}
+        datim_mappings = []
+        for resource_type, resource in datim_source_resources:
+            if resource_type == 'concepts':
+                # Split up the indicator and disaggregate concepts
+                concept = resource
+                if concept['concept_class'] == self.DATIM_MOH_CONCEPT_CLASS_DISAGGREGATE:
+                    disaggregate = {}
+                    if 'extras' in concept:
+                        disaggregate['extras'] = {}
+                        if isinstance(concept['extras'], dict) and 'classification' in concept['extras']:
+                            disaggregate['extras']['classification'] = concept['extras']['classification']
+                    disaggregates[concept['url']] = disaggregate
+                elif concept['concept_class'] == self.DATIM_MOH_CONCEPT_CLASS_DE:
+                    indicator = {'id': concept['id'], 'external_id': concept.get('external_id'), 'mappings': []}
+                    if (isinstance(concept.get('extras'), dict) and
+                            datimimap.DatimImap.IMAP_INDICATOR_CATEGORY_CUSTOM_ATTRIBUTE in concept['extras']):
+                        indicator['extras'] = {
+                            datimimap.DatimImap.IMAP_INDICATOR_CATEGORY_CUSTOM_ATTRIBUTE: concept['extras'][
+                                datimimap.DatimImap.IMAP_INDICATOR_CATEGORY_CUSTOM_ATTRIBUTE]}
+                    indicators[concept['url']] = indicator
+            elif resource_type == 'mappings':
+                # Mappings are attached once all indicators are read, since the export may list
+                # mappings before concepts
+                mapping = resource
+                if mapping['map_type'] == self.DATIM_MOH_MAP_TYPE_HAS_OPTION:
+                    datim_mappings.append(dict(
+                        (key, mapping[key]) for key in (
+                            'from_concept_url', 'to_concept_url', 'to_concept_code', 'to_concept_name',
+                            'to_concept_name_resolved') if key in mapping))
+                else:
+                    self.vlog(1, 'SKIPPING: Unrecognized map type "%s" for mapping: %s' % (
+                        mapping['map_type'], str(mapping)))
+
+        # Now attach the mappings to their indicators
+        for mapping in datim_mappings:
+            if mapping['from_concept_url'] not in indicators:
+                msg = 'ERROR: Missing indicator from_concept: %s' % (
+                    mapping['from_concept_url'])
+                self.vlog(1, msg)
+                raise Exception(msg)
+            indicators[mapping['from_concept_url']]['mappings'].append(mapping)
+        return {
+            'format_version': DatimImapExport.DATIM_MOH_STRUCTURE_FORMAT_VERSION,
+            'indicators': indicators,
+            'disaggregates': disaggregates,
+        }
+
+    @staticmethod
+    def get_mappings_by_datim_pair(indicators):
+        """
+        Returns the "Has Option" mappings of a DATIM-MOH structure (see build_datim_moh_structure)
+        keyed by (indicator URL, disag URL). It is not saved with the structure, since JSON
+        does not support tuple keys.
+        :param indicators: "indicators" of a DATIM-MOH structure
+        :return: <dict>
+        """
+        mappings_by_datim_pair = {}
+        for indicator_url, indicator in list(indicators.items()):
+            for mapping in indicator['mappings']:
+                mappings_by_datim_pair[(indicator_url, mapping['to_concept_url'])] = mapping
+        return mappings_by_datim_pair
+
+    def get_country_source_concepts(self, endpoint='', version='', zipfilename='', jsonfilename=''):
+        """
+        Returns the indicator and disaggregate concepts of a country source version, keyed by
+        concept URL. Concepts are parsed one at a time from the export and only the attributes
+        used to build an IMAP are kept: id, url, concept_class, external_id and extras.
+        :param endpoint: e.g. /orgs/DATIM-MOH-UA-FY19/sources/DATIM-Alignment-Indicators/
+        :param version: e.g. FY19.v1
+        :param zipfilename: Filename to save the compressed OCL export to
+        :param jsonfilename: Filename to save the decompressed OCL-JSON export to
+        :return: <tuple> (country_indicators, country_disaggregates)
+        """
+        country_indicators = {}
+        country_disaggregates = {}
+        for resource_type, concept in self.get_ocl_export_resources(
+                endpoint=endpoint, version=version, zipfilename=zipfilename,
+                jsonfilename=jsonfilename, resource_types=('concepts',)):
+            country_concept = dict(
+                (key, concept[key]) for key in (
+                    'id', 'url', 'concept_class', 'external_id', 'extras') if key in concept)
+            if concept['concept_class'] == self.DATIM_MOH_CONCEPT_CLASS_DISAGGREGATE:
+                country_disaggregates[concept['url']] = country_concept
+            elif concept['concept_class'] == self.DATIM_MOH_CONCEPT_CLASS_DE:
+                country_indicators[concept['url']] = country_concept
+        return country_indicators, country_disaggregates
 
     @staticmethod
     def get_clean_disag_id(disag_id):
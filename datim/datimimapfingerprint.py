@@ -0,0 +1,165 @@
+"""
+Class to persist IMAP fingerprints (see DatimImap.get_fingerprint) per country org and version.
+
+A fingerprint is saved after each IMAP import or export, so that an import of an IMAP that matches
+what is already in OCL can be skipped. The store is a single JSON file, e.g.:
+    {
+        "DATIM-MOH-BI-FY19": {
+            "fingerprint": "9f2c...",
+            "version": "FY19.v1",
+            "version_created_on": "2020-06-01T11:58:02.123Z",
+            "status": "confirmed",
+            "source": "export",
+            "ocl_bulk_import_task_id": null,
+            "updated_on": "2020-06-01T12:00:00"
+        }
+    }
+Fingerprints of imports are saved as pending when the OCL bulk import is submitted, and must be
+confirmed once the bulk import has succeeded (see confirm). Only confirmed fingerprints of the
+current country repo version, identified by its ID and creation date, are matched.
+"""
+import datetime
+import json
+import os
+import threading
+
+
+class DatimImapFingerprintStore(object):
+    """
+    Persisted IMAP fingerprints keyed by country org ID (e.g. DATIM-MOH-BI-FY19)
+    """
+
+    # Default filename of the fingerprint store in the data folder
+    DEFAULT_FILENAME = 'imap-fingerprints.json'
+
+    # Operations that save a fingerprint
+    SOURCE_IMPORT = 'import'
+    SOURCE_EXPORT = 'export'
+
+    # Status of a fingerprint
+    STATUS_PENDING = 'pending'
+    STATUS_CONFIRMED = 'confirmed'
+
+    def __init__(self, filename=''):
+        """
+        :param filename: Full path of the JSON file used to persist the fingerprints
+        """
+        self.filename = filename
+        self.__fingerprints = None
+        self.__lock = threading.RLock()
+
+    def load(self, reload=False):
+        """
+        Loads the fingerprints from the store file. A missing file is treated as an empty store.
+        :param reload: Re-read the store file, e.g. to see entries saved by other processes
+        :return: <dict> Fingerprint entries keyed by country org ID
+        """
+        with self.__lock:
+            if self.__fingerprints is None or reload:
+                fingerprints = {}
+                if self.filename and os.path.isfile(self.filename):
+                    with open(self.filename, 'r') as handle:
+                        fingerprints = json.load(handle)
+                self.__fingerprints = fingerprints
+            return self.__fingerprints
+
+    def save(self):
+        """
+        Writes the fingerprints to the store file. The file is replaced atomically so that a
+        concurrent reader never sees a partially written store.
+        """
+        if not self.filename:
+            return
+        with self.__lock:
+            dirname = os.path.dirname(self.filename)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname, exist_ok=True)
+            temp_filename = '%s.%s.%s.tmp' % (self.filename, os.getpid(), threading.get_ident())
+            with open(temp_filename, 'w') as handle:
+                json.dump(self.load(), handle, indent=2, sort_keys=True)
+            os.replace(temp_filename, self.filename)
+
+    def get(self, country_org, reload=False):
+        """
+        Returns the fingerprint entry for the specified country org, or None if not found
+        :param country_org: Country org ID, e.g. DATIM-MOH-BI-FY19
+        :param reload: Re-read the store file, e.g. to see entries saved by other processes
+        :return: <dict>
+        """
+        return self.load(reload=reload).get(country_org)
+
+    def set(self, country_org, fingerprint, version=None, version_created_on=None, source='',
+            ocl_bulk_import_task_id=None, status=STATUS_CONFIRMED):
+        """
+        Sets and saves the fingerprint entry for the specified country org
+        :param country_org: Country org ID, e.g. DATIM-MOH-BI-FY19
+        :param fingerprint: IMAP fingerprint returned by DatimImap.get_fingerprint()
+        :param version: Country repo version ID, e.g. FY19.v1
+        :param version_created_on: Creation date of the country repo version in OCL, if known
+        :param source: SOURCE_IMPORT or SOURCE_EXPORT
+        :param ocl_bulk_import_task_id: OCL bulk import task ID if saved after an import
+        :param status: STATUS_PENDING if the fingerprint must be confirmed before it is matched
+        :return: <dict> The new fingerprint entry
+        """
+        entry = {
+            'fingerprint': fingerprint,
+            'version': version,
+            'version_created_on': version_created_on,
+            'status': status,
+            'source': source,
+            'ocl_bulk_import_task_id': ocl_bulk_import_task_id,
+            'updated_on': datetime.datetime.now().isoformat(),
+        }
+        with self.__lock:
+            self.__fingerprints = None  # Re-read so entries saved by other processes are kept
+            self.load()[country_org] = entry
+            self.save()
+        return entry
+
+    def remove(self, country_org):
+        """
+        Removes and saves the fingerprint entry for the specified country org, if it exists
+        :param country_org: Country org ID, e.g. DATIM-MOH-BI-FY19
+        """
+        with self.__lock:
+            self.__fingerprints = None
+            if self.load().pop(country_org, None) is not None:
+                self.save()
+
+    def confirm(self, country_org, repo_version):
+        """
+        Confirms the pending fingerprint entry for the specified country org, once its bulk import
+        has succeeded. The entry is removed instead if the import did not create the expected
+        country repo version.
+        :param country_org: Country org ID, e.g. DATIM-MOH-BI-FY19
+        :param repo_version: Current OCL repo version dictionary of the country source
+        :return: <dict> The confirmed fingerprint entry, or None if removed
+        """
+        with self.__lock:
+            entry = self.get(country_org, reload=True)
+            if not entry or entry.get('status') != self.STATUS_PENDING:
+                return entry
+            if not repo_version or repo_version.get('id') != entry.get('version'):
+                self.remove(country_org)
+                return None
+            entry['status'] = self.STATUS_CONFIRMED
+            entry['version_created_on'] = repo_version.get('created_on')
+            entry['updated_on'] = datetime.datetime.now().isoformat()
+            self.save()
+            return entry
+
+    def is_match(self, imap, repo_version):
+        """
+        Returns True if the fingerprint of the IMAP matches the confirmed fingerprint saved for
+        its country org and the current country repo version. The store file is re-read, so that
+        entries saved by other processes are seen.
+        :param imap: DatimImap object
+        :param repo_version: Current OCL repo version dictionary of the country source
+        :return: <bool>
+        """
+        entry = self.get(imap.country_org, reload=True)
+        return bool(entry and repo_version) and (
+            entry.get('status') == self.STATUS_CONFIRMED and
+            entry.get('version') == repo_version.get('id') and
+            entry.get('version_created_on') == repo_version.get('created_on') and
+            entry.get('fingerprint') == imap.get_fingerprint())
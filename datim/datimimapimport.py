@@ -14,13 +14,18 @@ The import script creates OCL-formatted JSON consisting of:
 """
 import json
 
+import requests
+
 import ocldev.oclconstants
 import ocldev.oclexport
 import ocldev.oclfleximporter
 import ocldev.oclresourcelist
 
+import settings
 from . import datimbase
 from . import datimimap
+from . import datimimapexport
+from . import datimimapfingerprint
 from utils import timer
 
 
@@ -39,7 +44,19 @@ class DatimImapImport(datimbase.DatimBase):
     DATIM_IMAP_RESULT_ERROR = -1
 
     def __init__(self, oclenv='', oclapitoken='', verbosity=0, run_ocl_offline=False,
-                 test_mode=False, country_public_access='View'):
+                 test_mode=False, country_public_access='View', compare2previousexport=None,
+                 fingerprint_store=None, patch_mode=False):
+        """
+        Initialize a DatimImapImport object
+        :param compare2previousexport: Skip imports whose fingerprint matches the fingerprint saved
+            for the country org by the previous import or export. Defaults to
+            settings.compare2previousexport, or False if not set.
+        :param fingerprint_store: DatimImapFingerprintStore object. Defaults to the fingerprint
+            store in the data folder.
+        :param patch_mode: If the country org already exists, export the current IMAP from OCL,
+            diff it against the input IMAP and import only the changes, instead of deleting and
+            re-creating the org.
+        """
         datimbase.DatimBase.__init__(self)
         self.verbosity = verbosity
         self.oclenv = oclenv
@@ -47,6 +64,16 @@ class DatimImapImport(datimbase.DatimBase):
         self.run_ocl_offline = run_ocl_offline
         self.test_mode = test_mode
         self.country_public_access = country_public_access
+        if compare2previousexport is None:
+            compare2previousexport = getattr(settings, 'compare2previousexport', False)
+        self.compare2previousexport = compare2previousexport
+        if fingerprint_store is None:
+            fingerprint_store = datimimapfingerprint.DatimImapFingerprintStore(
+                filename=self.attach_absolute_data_path(
+                    datimimapfingerprint.DatimImapFingerprintStore.DEFAULT_FILENAME))
+        self.fingerprint_store = fingerprint_store
+        self.patch_mode = patch_mode
+        self.is_imap_unchanged = False
 
         # Prepare the headers
         self.oclapiheaders = {
@@ -58,7 +85,8 @@ class DatimImapImport(datimbase.DatimBase):
         """
         Import the specified IMAP into OCL
         :param imap_input: IMAP to import
-        :return: OCL bulk import status ID if successfully submitted. None if nothing to import.
+        :return: OCL bulk import status ID if successfully submitted. None if nothing to import or
+            if the import was skipped because the IMAP is unchanged (see is_imap_unchanged).
         """
 
         # Validate input variables
@@ -67,6 +95,15 @@ class DatimImapImport(datimbase.DatimBase):
             self.vlog(1, msg)
             raise Exception(msg)
 
+        # Skip the import if the IMAP matches the previous import or export of the country org
+        self.is_imap_unchanged = False
+        if self.compare2previousexport and self.is_imap_fingerprint_match(imap_input):
+            self.is_imap_unchanged = True
+            self.vlog(1, 'SKIPPING: IMAP fingerprint "%s" matches the previous %s of org "%s"' % (
+                imap_input.get_fingerprint(), self.fingerprint_store.get(imap_input.country_org)['source'],
+                imap_input.country_org))
+            return None
+
         # STEP 1 of 5: Make sure an import for same country+period is not underway
         imap_timer = timer.Timer()
         imap_timer.start()
@@ -81,6 +118,11 @@ class DatimImapImport(datimbase.DatimBase):
             raise ImapCountryLockedForPeriodError(err_msg)
         imap_timer.lap(label='STEP 1: Make sure an import for same country+period is not underway')
 
+        # Check whether the country org exists (needed in step 4) while steps 2 and 3 run
+        does_imap_org_exist_future = self.http_engine.submit(
+            datimimap.DatimImapFactory.check_if_imap_org, org_id=imap_input.country_org,
+            ocl_env_url=self.oclenv, ocl_api_token=self.oclapitoken, verbose=bool(self.verbosity))
+
         # STEP 2 of 5: Download PEPFAR/DATIM-MOH-FY## export for specified period from OCL
         self.vlog(1, '**** STEP 2 of 5: Download PEPFAR/DATIM-MOH-FY## export for specified period')
         self.datim_moh_source_id = datimbase.DatimBase.get_datim_moh_source_id(imap_input.period)
@@ -110,10 +152,12 @@ class DatimImapImport(datimbase.DatimBase):
         self.vlog(1, '**** STEP 3 of 5: Validate country IMAP input file')
         if self.verbosity:
             imap_input.display(exclude_empty_maps=True, auto_fix_null_disag=True)
-        is_valid = imap_input.is_valid(datim_moh_source_export=datim_moh_source_export)
-        if type(is_valid) == str:
+        validation_report = imap_input.validate(datim_moh_source_export=datim_moh_source_export)
+        if validation_report.errors:
+            raise Exception(validation_report.get_message())
+        elif validation_report.warnings:
             self.vlog(1, 'WARNING: The following warnings were found in the provided IMAP:\n',
-                      is_valid)
+                      validation_report.get_message())
         else:
             self.vlog(1, 'The provided IMAP passed validation')
         imap_timer.lap(label='STEP 3: Validate country IMAP input file')
@@ -121,20 +165,42 @@ class DatimImapImport(datimbase.DatimBase):
         # STEP 4 of 5: Generate IMAP import script
         self.vlog(1, '**** STEP 4 of 5: Generate IMAP import script')
         import_list = ocldev.oclresourcelist.OclJsonResourceList()
-        does_imap_org_exist = datimimap.DatimImapFactory.check_if_imap_org(
-            org_id=imap_input.country_org, ocl_env_url=self.oclenv,
-            ocl_api_token=self.oclapitoken, verbose=bool(self.verbosity))
-        if does_imap_org_exist:
-            self.vlog(1, 'Org "%s" already exists.' % imap_input.country_org)
-            import_list.append({
-                '__action': 'DELETE',
-                'type': 'Organization',
-                'id': imap_input.country_org
-            })
+        import_version_id = '%s.v0' % imap_input.period
+        does_imap_org_exist = does_imap_org_exist_future.result()
+        if does_imap_org_exist and self.patch_mode:
+            self.vlog(1, 'Org "%s" already exists. Generating import script from diff...' % (
+                imap_input.country_org))
+            imap_current = datimimapexport.DatimImapExport(
+                oclenv=self.oclenv, oclapitoken=self.oclapitoken, verbosity=self.verbosity,
+                run_ocl_offline=self.run_ocl_offline, fingerprint_store=self.fingerprint_store).get_imap(
+                period=imap_input.period, country_org=imap_input.country_org,
+                country_code=imap_input.country_code)
+            imap_diff = imap_current.diff(imap_input, exclude_empty_maps=True)
+            if not imap_diff.get_num_diffs():
+                self.is_imap_unchanged = True
+                self.vlog(1, 'SKIPPING: IMAP matches version "%s" of org "%s"' % (
+                    imap_current.version, imap_input.country_org))
+                imap_timer.stop(label='STOP')
+                self.vlog(1, '** IMAP import time breakdown:\n', imap_timer)
+                return None
+            self.vlog(1, '%s difference(s) found with version "%s"' % (
+                imap_diff.get_num_diffs(), imap_current.version))
+            import_version_id = datimimap.DatimImapFactory.get_next_version_id(
+                imap_current.version, imap_input.period)
+            import_list.append(datimimap.DatimImapFactory.generate_import_script_from_diff(
+                imap_diff, verbose=self.verbosity >= 2, include_repo_versions=True))
         else:
-            self.vlog(1, 'Org "%s" not found.' % imap_input.country_org)
-        import_list.append(datimimap.DatimImapFactory.generate_resource_list_from_imap(
-            imap_input=imap_input, verbose=bool(self.verbosity)))
+            if does_imap_org_exist:
+                self.vlog(1, 'Org "%s" already exists.' % imap_input.country_org)
+                import_list.append({
+                    '__action': 'DELETE',
+                    'type': 'Organization',
+                    'id': imap_input.country_org
+                })
+            else:
+                self.vlog(1, 'Org "%s" not found.' % imap_input.country_org)
+            import_list.append(datimimap.DatimImapFactory.generate_resource_list_from_imap(
+                imap_input=imap_input, verbose=bool(self.verbosity)))
         if self.verbosity >= 2:
             for resource in import_list:
                 print(json.dumps(resource))
@@ -151,6 +217,15 @@ class DatimImapImport(datimbase.DatimBase):
             bulk_import_response.raise_for_status()
             task_id = bulk_import_response.json()['task']
             self.vlog(1, 'BULK IMPORT TASK ID: %s' % task_id)
+            if self.export_cache and does_imap_org_exist and not self.patch_mode:
+                # The org is re-created with the same repository version IDs
+                self.export_cache.remove_prefix(self.oclenv, '/orgs/%s/' % imap_input.country_org)
+            # The fingerprint is only matched once the bulk import is known to have succeeded
+            self.fingerprint_store.set(
+                imap_input.country_org, imap_input.get_fingerprint(), version=import_version_id,
+                source=datimimapfingerprint.DatimImapFingerprintStore.SOURCE_IMPORT,
+                ocl_bulk_import_task_id=task_id,
+                status=datimimapfingerprint.DatimImapFingerprintStore.STATUS_PENDING)
             imap_timer.stop(label='STOP')
             self.vlog(1, '** IMAP import time breakdown:\n', imap_timer)
             return task_id
@@ -163,3 +238,42 @@ class DatimImapImport(datimbase.DatimBase):
             imap_timer.stop(label='STOP')
             self.vlog(1, '** IMAP import time breakdown:\n', imap_timer)
         return None
+
+    def is_imap_fingerprint_match(self, imap_input):
+        """
+        Returns True if the fingerprint of the IMAP matches the confirmed fingerprint saved for the
+        current country source version in OCL. A pending fingerprint saved by a previous import is
+        first confirmed if its bulk import succeeded, or removed if it failed.
+        :param imap_input: DatimImap object
+        :return: <bool>
+        """
+        country_source_url = '%s/orgs/%s/sources/%s/' % (
+            self.oclenv, imap_input.country_org, self.DATIM_MOH_COUNTRY_SOURCE_ID)
+        try:
+            country_version = datimimap.DatimImapFactory.get_repo_latest_period_version(
+                repo_url=country_source_url, period=imap_input.period, oclapitoken=self.oclapitoken)
+        except requests.exceptions.HTTPError as err:
+            if err.response is None or err.response.status_code != 404:
+                raise
+            country_version = None
+
+        # Confirm or remove the fingerprint of a previous import
+        entry = self.fingerprint_store.get(imap_input.country_org, reload=True)
+        if entry and entry.get('status') == datimimapfingerprint.DatimImapFingerprintStore.STATUS_PENDING:
+            import_results = None
+            if entry.get('ocl_bulk_import_task_id'):
+                import_results = ocldev.oclfleximporter.OclBulkImporter.get_bulk_import_results(
+                    task_id=entry['ocl_bulk_import_task_id'], api_url_root=self.oclenv,
+                    api_token=self.oclapitoken)
+                if import_results is None:
+                    self.vlog(1, 'Bulk import "%s" of org "%s" is still being processed' % (
+                        entry['ocl_bulk_import_task_id'], imap_input.country_org))
+                    return False
+            if import_results is None or import_results.has_error_status_code():
+                self.vlog(1, 'Bulk import "%s" of org "%s" failed. Removing its fingerprint...' % (
+                    entry.get('ocl_bulk_import_task_id'), imap_input.country_org))
+                self.fingerprint_store.remove(imap_input.country_org)
+                return False
+            self.fingerprint_store.confirm(imap_input.country_org, country_version)
+
+        return self.fingerprint_store.is_match(imap_input, country_version)
@@ -0,0 +1,231 @@
+"""
+Class to incrementally read JSON values from a text stream, used to parse large IMAP backups and
+OCL exports one item at a time instead of loading the whole document in memory.
+
+Values are decoded with json.JSONDecoder.raw_decode. A string, object or list that decodes is
+complete, since it ends with its closing character. Otherwise its end is found by scanning the
+input for string quotes and brackets, resuming where the scan stopped as more input is read,
+and it is decoded once more; a number or literal ends at the next delimiter. Whether a value is
+complete is thus decided from its delimiters alone, and any error decoding a complete value is
+reported as malformed JSON.
+"""
+import io
+import json
+import re
+
+
+class DatimJsonStreamReader(object):
+    """
+    Incremental reader of JSON values from a text or binary file-like object
+    """
+
+    DEFAULT_CHUNK_SIZE = 65536
+
+    # Characters that may follow a complete JSON value
+    VALUE_DELIMITERS = ' \t\n\r,:]}'
+
+    # Characters that end a number or literal, that open, close or end a string, and that
+    # open or close an object or list
+    DELIMITER_RE = re.compile(r'[ \t\n\r,:\]}]')
+    STRING_RE = re.compile(r'["\\]')
+    STRUCTURE_RE = re.compile(r'["\[\]{}]')
+
+    # Python type of a JSON value by its first character, used in error messages
+    FIRST_CHAR_TYPES = {'{': dict, '[': list, '"': str, 't': bool, 'f': bool, 'n': type(None)}
+
+    def __init__(self, stream, source_name='', chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        :param stream: Text or binary file-like object. Binary input is decoded as UTF-8.
+        :param source_name: Name of the input used in error messages, e.g. the filename
+        :param chunk_size: Number of characters to read at a time
+        """
+        if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)):
+            stream = io.TextIOWrapper(stream, encoding='utf8')
+        self.stream = stream
+        self.source_name = source_name
+        self.chunk_size = chunk_size
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ''
+        self.__pos = 0
+        self.__eof = False
+
+    def error(self, msg):
+        """ Returns a ValueError for malformed input """
+        return ValueError("ERROR: Invalid JSON in '%s': %s" % (self.source_name, msg))
+
+    def read_chunk(self):
+        """
+        Appends the next chunk of input to the buffer, dropping the text already consumed. At
+        least as much input as is pending is read, so that a value spanning many chunks is
+        copied in linear time overall.
+        """
+        chunk = self.stream.read(max(self.chunk_size, len(self.__buffer) - self.__pos))
+        if not chunk:
+            self.__eof = True
+        self.__buffer = self.__buffer[self.__pos:] + chunk
+        self.__pos = 0
+
+    def peek(self):
+        """ Returns the next non-whitespace character without consuming it, or '' at the end """
+        while True:
+            buffer, pos = self.__buffer, self.__pos
+            while pos < len(buffer) and buffer[pos] in ' \t\n\r':
+                pos += 1
+            self.__pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if self.__eof:
+                return ''
+            self.read_chunk()
+
+    def read_char(self, expected_chars):
+        """
+        Consumes and returns the next non-whitespace character, which must be one of
+        expected_chars. Raises ValueError otherwise.
+        """
+        char = self.peek()
+        if not char:
+            raise self.error('Unexpected end of input, expected one of "%s"' % expected_chars)
+        if char not in expected_chars:
+            raise self.error('Unexpected character %r, expected one of "%s"' % (char, expected_chars))
+        self.__pos += 1
+        return char
+
+    def get_next_type(self):
+        """ Returns the Python type of the next value from its first character, or None """
+        char = self.peek()
+        if char in self.FIRST_CHAR_TYPES:
+            return self.FIRST_CHAR_TYPES[char]
+        elif char and char in '-0123456789':
+            return float if char == '-' else int
+        return None
+
+    def read_value(self):
+        """
+        Consumes and returns the next JSON value. Raises ValueError for malformed or truncated
+        input.
+        """
+        first_char = self.peek()
+        if not first_char:
+            raise self.error('Unexpected end of input')
+        if first_char in '[{"':
+            # A string, object or list decoded in full ends with its closing character, so it
+            # is complete. Otherwise scan for its end, reading more input as needed.
+            try:
+                value, self.__pos = self.__decoder.raw_decode(self.__buffer, self.__pos)
+                return value
+            except json.JSONDecodeError:
+                length = self.get_structure_length(first_char)
+        else:
+            length = self.get_scalar_length()
+        buffer, pos = self.__buffer, self.__pos
+        try:
+            value, end = self.__decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as err:
+            raise self.error(str(err))
+        if end != pos + length:
+            raise self.error('Unexpected character %r after value' % buffer[end])
+        self.__pos = end
+        return value
+
+    def get_scalar_length(self):
+        """ Returns the length of the number or literal at the current position """
+        offset = 0
+        while True:
+            match = self.DELIMITER_RE.search(self.__buffer, self.__pos + offset)
+            if match:
+                return match.start() - self.__pos
+            offset = len(self.__buffer) - self.__pos
+            if self.__eof:
+                return offset
+            self.read_chunk()
+
+    def get_structure_length(self, first_char):
+        """
+        Returns the length of the string, object or list at the current position. The scan
+        resumes where it stopped when more input is read, so each character is scanned once.
+        """
+        offset = 1
+        depth = 0 if first_char == '"' else 1
+        in_string = first_char == '"'
+        while True:
+            buffer, pos = self.__buffer, self.__pos
+            while True:
+                match = (self.STRING_RE if in_string else self.STRUCTURE_RE).search(buffer, pos + offset)
+                if not match:
+                    break
+                char = match.group()
+                offset = match.end() - pos
+                if char == '\\':
+                    # Skip the escaped character, which may not have been read yet
+                    offset += 1
+                elif char == '"':
+                    in_string = not in_string
+                    if not in_string and not depth:
+                        return offset
+                elif char in '[{':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if not depth:
+                        return offset
+            if self.__eof:
+                raise self.error('Unexpected end of input')
+            offset = max(offset, len(buffer) - pos)
+            self.read_chunk()
+
+    def iter_list(self):
+        """
+        Generator that yields each item of the JSON list at the current position as soon as it
+        has been read. Raises TypeError if the next value is not a list.
+        """
+        if self.peek() != '[':
+            self.raise_unexpected_type(list)
+        self.read_char('[')
+        if self.peek() == ']':
+            self.read_char(']')
+            return
+        while True:
+            yield self.read_value()
+            if self.read_char(',]') == ']':
+                return
+
+    def iter_object_lists(self, keys):
+        """
+        Generator that reads the JSON object at the current position and yields (key, item) for
+        each item of its lists whose key is in keys, as soon as it has been read. Other values of
+        the object are read and skipped. Raises TypeError if the next value is not an object.
+        :param keys: Keys of the lists to yield items from, e.g. ('concepts', 'mappings')
+        """
+        if self.peek() != '{':
+            self.raise_unexpected_type(dict)
+        self.read_char('{')
+        if self.peek() == '}':
+            self.read_char('}')
+            return
+        while True:
+            key = self.read_value()
+            self.read_char(':')
+            if key in keys and self.peek() == '[':
+                for item in self.iter_list():
+                    yield key, item
+            else:
+                self.read_value()
+            if self.read_char(',}') == '}':
+                return
+
+    def read_end(self):
+        """ Raises ValueError if anything other than whitespace follows the value just read """
+        char = self.peek()
+        if char:
+            raise self.error('Unexpected character %r after the end of the JSON content' % char)
+
+    def raise_unexpected_type(self, expected_type):
+        """ Raises TypeError (or ValueError if the input is not JSON) for an unexpected value """
+        found_type = self.get_next_type()
+        if found_type is None:
+            if not self.peek():
+                raise self.error('No JSON content found')
+            raise self.error('Unexpected character %r' % self.peek())
+        raise TypeError("ERROR: Expected JSON %s in '%s'. '%s' found." % (
+            expected_type.__name__, self.source_name, found_type))
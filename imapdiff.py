@@ -3,11 +3,15 @@ Perform diff on an IMAP stored in OCL and one stored in a JSON or CSV file
 
 EXAMPLE:
 python imapdiff.py --env=staging -t=token -c=BI -pFY19 imap-samples/BI-FY19-baseline.csv
+
+Write the diff as JSON lines (one object per diff record followed by a summary object):
+python imapdiff.py --env=staging -t=token -c=BI -pFY19 --format=jsonl imap-samples/BI-FY19-baseline.csv
 """
 import argparse
+import sys
 
 import common
-from datim import datimimap, datimimaptests
+from datim import datimimap, datimimapexport, datimimaptests
 
 # Script argument parser
 parser = argparse.ArgumentParser("imap-diff", description="Diff 2 IMAPs")
@@ -19,6 +23,12 @@ parser.add_argument('-c', '--country_code', help='Country code, eg "BI" or "UG"'
 parser.add_argument('-p', '--period', help='Period, eg "FY19" or "FY20"', required=True)
 parser.add_argument(
     '-v', '--verbosity', help='Verbosity level: 0 (default), 1, or 2', default=0, type=int)
+parser.add_argument(
+    '--format', help='Output format: text (default) or jsonl', default='text',
+    choices=['text', 'jsonl'])
+parser.add_argument(
+    '--summary_only', action='store_true', default=False,
+    help='Only write the summary object of a jsonl diff')
 parser.add_argument('--version', action='version', version='%(prog)s v' + common.APP_VERSION)
 parser.add_argument(
     'file', type=argparse.FileType('r'), help='IMAP file (JSON or CSV), eg "BI-FY20.csv"')
@@ -54,6 +64,18 @@ imap_test_batch = [
     }
 ]
 
+# Stream the diff as JSON lines. Nothing else is written to stdout in this mode.
+if args.format == 'jsonl':
+    imap_a = datimimapexport.DatimImapExport(
+        oclenv=ocl_env_url, oclapitoken=args.token, verbosity=0, run_ocl_offline=False).get_imap(
+            period=args.period, country_org=country_org, country_code=args.country_code)
+    imap_b = datimimap.DatimImapFactory.load_imap_from_file(
+        imap_filename=imap_filename, period=args.period, country_org=country_org,
+        country_name=args.country_code, country_code=args.country_code)
+    imap_diff = imap_a.diff(imap_b, evaluate=False)
+    diff_summary = imap_diff.write_jsonl(sys.stdout, summary_only=args.summary_only)
+    sys.exit(1 if diff_summary['num_diffs'] else 0)
+
 # Run the tests and display the results
 datimimaptests.DatimImapTests.display_test_summary(imap_test_batch)
 imap_tester = datimimaptests.DatimImapTests()
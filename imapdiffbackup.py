@@ -3,12 +3,18 @@ Perform diff on an IMAP stored in OCL and one stored in a JSON or CSV file
 
 EXAMPLE:
 python imapdiffbackup.py --env=production-aws -t=2925899a86b7601de02b7b0f22cafda494ad2a5e -v1 imap-samples/production-v1-imap-backup-20210405.json
+
+Batch mode exports and diffs up to --max_workers IMAPs at a time and prints one summary line per IMAP:
+python imapdiffbackup.py --env=production-aws -t=2925899a86b7601de02b7b0f22cafda494ad2a5e --batch --max_workers=8 imap-samples/production-v1-imap-backup-20210405.json
 """
 import argparse
+import collections
+import concurrent.futures
 import json
+import sys
 
 import common
-from datim import datimimap, datimimaptests
+from datim import datimimap, datimimapexport, datimimaptests
 
 # Script argument parser
 parser = argparse.ArgumentParser(
@@ -23,6 +29,12 @@ parser.add_argument(
     '-p', '--period', help='Filter backup by period, eg "FY19" or "FY20"', default='')
 parser.add_argument(
     '-v', '--verbosity', help='Verbosity level: 0 (default), 1, or 2', default=0, type=int)
+parser.add_argument(
+    '--batch', action='store_true', default=False,
+    help='Export and diff the IMAPs concurrently and print a one line summary per IMAP')
+parser.add_argument(
+    '--max_workers', help='Maximum number of concurrent IMAP exports in batch mode (default 4)',
+    default=4, type=int)
 parser.add_argument('--version', action='version', version='%(prog)s v' + common.APP_VERSION)
 parser.add_argument(
     'file', type=argparse.FileType('r'), help='IMAP backup file #1')
@@ -37,15 +49,9 @@ country_code_filter = ''
 if args.country_code:
     country_code_filter = [x.strip() for x in args.country_code.split(',')]
 
-# Filter IMAPs
-all_imap_backups = json.load(args.file)
-imap_backups = []
-for imap_backup in all_imap_backups:
-    if period_filter and imap_backup['period'] not in period_filter:
-        continue
-    elif country_code_filter and imap_backup['country_code'] not in country_code_filter:
-        continue
-    imap_backups.append(imap_backup)
+# Load and filter IMAPs one backup entry at a time, as they are processed
+imap_backups = datimimap.DatimImapFactory.iter_imap_backups(
+    args.file, period_filter=period_filter, country_code_filter=country_code_filter)
 
 # Display debug info
 if args.verbosity:
@@ -53,20 +59,97 @@ if args.verbosity:
     print('ocl_env_url=%s' % ocl_env_url)
     print('country_codes=%s' % country_code_filter)
     print('periods=%s' % period_filter)
-    print('%s IMAPs (after filter) of %s IMAP backups loaded' % (
-        len(imap_backups), len(all_imap_backups)))
+
+
+def diff_imap_backup(imap_export, imap_backup, imap_input):
+    """
+    Exports the IMAP of a backup entry from OCL and diffs it with the backup
+    :param imap_export: DatimImapExport object shared by all backup entries
+    :param imap_backup: IMAP backup entry
+    :param imap_input: DatimImap loaded from the backup entry
+    :return: <dict> Summary of the diff
+    """
+    summary = {
+        'country_org': imap_backup['country_org'],
+        'period': imap_backup['period'],
+        'status': 'Success',
+        'message': '',
+        'num_added': 0,
+        'num_removed': 0,
+        'num_changed': 0,
+    }
+    if imap_backup['status'] != 'Success':
+        summary['status'] = 'Invalid'
+        summary['message'] = 'Invalid IMAP backup'
+        return summary
+    try:
+        imap_ocl = imap_export.get_imap(
+            period=imap_backup['period'], country_org=imap_backup['country_org'],
+            country_code=imap_backup['country_code'])
+        imap_diff = imap_input.diff(imap_ocl)
+    except Exception as err:
+        summary['status'] = 'Error'
+        summary['message'] = '%s: %s' % (err.__class__.__name__, str(err))
+        return summary
+    summary['num_added'] = len(imap_diff.get_added())
+    summary['num_removed'] = len(imap_diff.get_removed())
+    summary['num_changed'] = len(imap_diff.get_changed())
+    if imap_diff.get_num_diffs():
+        summary['status'] = 'Diff'
+    return summary
+
+
+def iter_results_in_order(executor, fn, items, max_pending):
+    """
+    Like executor.map, but only takes the next item once fewer than max_pending items are
+    being processed, so that the items are not all read into memory up front
+    :param executor: concurrent.futures.Executor
+    :param fn: Function called with each item
+    :param items: Iterable of items, e.g. a generator
+    :param max_pending: Maximum number of items submitted but not yet returned
+    :return: <generator> of results in the order of the items
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# Batch mode: Export and diff with bounded concurrency. The exporter is shared so that the
+# DATIM-MOH codelist is downloaded only once per period.
+if args.batch:
+    imap_export = datimimapexport.DatimImapExport(
+        oclenv=ocl_env_url, oclapitoken=args.token, verbosity=max(args.verbosity - 1, 0),
+        run_ocl_offline=False)
+    num_by_status = {}
+    max_workers = max(args.max_workers, 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summaries = iter_results_in_order(
+            executor, lambda imap_backup_pair: diff_imap_backup(imap_export, *imap_backup_pair),
+            imap_backups, max_pending=2 * max_workers)
+        for summary in summaries:
+            num_by_status[summary['status']] = num_by_status.get(summary['status'], 0) + 1
+            print('%-32s %-10s %-8s added=%-5s removed=%-5s changed=%-5s %s' % (
+                summary['country_org'], summary['period'], summary['status'], summary['num_added'],
+                summary['num_removed'], summary['num_changed'], summary['message']))
+    print('%s IMAPs compared: %s' % (sum(num_by_status.values()), ', '.join(
+        '%s %s' % (num, status) for status, num in sorted(num_by_status.items()))))
+    sys.exit(1 if num_by_status.get('Error') else 0)
 
 # Loop through each and import
 current_num = 0
-for imap_backup in imap_backups:
+for imap_backup, imap_input in imap_backups:
     current_num += 1
 
     # Display debug info for the current IMAP org
     if args.verbosity:
         if args.verbosity > 1:
             print('\n\n' + '*' * 100)
-        print('** [IMAP %s of %s] Org: %s, Country Code: %s, Country Name: %s, Period: %s' % (
-            current_num, len(imap_backups), imap_backup['country_org'],
+        print('** [IMAP %s] Org: %s, Country Code: %s, Country Name: %s, Period: %s' % (
+            current_num, imap_backup['country_org'],
             imap_backup['country_code'], imap_backup['country_name'], imap_backup['period']))
         if args.verbosity > 1:
             print('*' * 100)
@@ -75,12 +158,6 @@ for imap_backup in imap_backups:
     if imap_backup['status'] != 'Success':
         print('WARNING: Invalid IMAP backup:', json.dumps(imap_backup))
         continue
-    imap_input = datimimap.DatimImap(
-        imap_data=imap_backup['imap'],
-        period=imap_backup['period'],
-        country_org=imap_backup['country_org'],
-        country_name=imap_backup['country_name'],
-        country_code=imap_backup['country_code'])
     if args.verbosity > 1 and imap_input:
         imap_input.display(sort=True, exclude_empty_maps=True)
         # print 'INFO: IMAP import file "%s" loaded successfully' % args.file.name
@@ -114,3 +191,7 @@ for imap_backup in imap_backups:
     imap_tester = datimimaptests.DatimImapTests()
     imap_tester.run_tests(imap_test_batch)
     imap_tester.display_test_results()
+
+# Display debug info
+if args.verbosity:
+    print('%s IMAPs (after filter) loaded from IMAP backup' % current_num)
@@ -6,6 +6,10 @@ mapping template.
 Example Usage:
 - Import IMAP:
     python imapimport.py --env=staging -t="your-token-here" -c="BDI" --country_name="Burundi" -p="DAA-FY21" imap-samples/DEMO-DAA-FY21.csv
+- Import even if the IMAP matches the previous import or export of the country org:
+    python imapimport.py --env=staging -t="your-token-here" -c="BDI" --country_name="Burundi" -p="DAA-FY21" --force imap-samples/DEMO-DAA-FY21.csv
+- Import only the differences with the IMAP currently in OCL, if the country org already exists:
+    python imapimport.py --env=staging -t="your-token-here" -c="BDI" --country_name="Burundi" -p="DAA-FY21" --patch imap-samples/DEMO-DAA-FY21.csv
 - Use test mode (produces import script but does not submit):
     python imapimport.py --env=staging -t="your-token-here" -c="BDI" --country_name="Burundi" -p="DAA-FY21" --test_mode imap-samples/DEMO-DAA-FY21.json
 
@@ -29,6 +33,13 @@ group.add_argument('--env', help='Name of the OCL API environment', type=common.
 group.add_argument('--envurl', help='URL of the OCL API environment')
 parser.add_argument('-t', '--token', help='OCL API token', required=True)
 parser.add_argument('--test_mode', action="store_true", help='Enable test mode', default=False)
+parser.add_argument(
+    '--force', action="store_true", default=False,
+    help='Import even if the IMAP fingerprint matches the previous import or export of the country org')
+parser.add_argument(
+    '--patch', action="store_true", default=False,
+    help='If the country org exists, import only the differences with the IMAP currently in OCL '
+         'instead of deleting and re-creating the org')
 parser.add_argument(
     '-v', '--verbosity', help='Verbosity level: 0 (default), 1, or 2', default=0, type=int)
 parser.add_argument('--public_access', help="Level of public access: View, None", default='View')
@@ -126,7 +137,8 @@ try:
     imap_import = datimimapimport.DatimImapImport(
         oclenv=ocl_env_url, oclapitoken=args.token, verbosity=args.verbosity,
         run_ocl_offline=False, test_mode=args.test_mode,
-        country_public_access=args.public_access)
+        country_public_access=args.public_access,
+        compare2previousexport=False if args.force else None, patch_mode=args.patch)
     bulk_import_task_id = imap_import.import_imap(imap_input=imap_input)
 except Exception as err:
     output_json["status"] = "Error"
@@ -135,6 +147,15 @@ except Exception as err:
 else:
     if args.test_mode:
         output_json["status"] = "Test"
+    if imap_import.is_imap_unchanged:
+        output_json["status"] = "Unchanged"
+        if args.patch:
+            output_json["message"] = ("IMAP matches the IMAP in OCL for this country and period. "
+                                      "Nothing to import.")
+        else:
+            output_json["message"] = ("IMAP matches the previous import or export of this country and "
+                                      "period. Nothing to import.")
+        output_json["imap_fingerprint"] = imap_input.get_fingerprint()
     if bulk_import_task_id:
         output_json["status"] = "Success"
         output_json["message"] = ("IMAP successfully queued for loading into OCL. "
@@ -43,15 +43,9 @@ country_code_filter = ''
 if args.country_code:
     country_code_filter = [x.strip() for x in args.country_code.split(',')]
 
-# Filter IMAPs
-all_imap_backups = json.load(args.file)
-imap_backups = []
-for imap_backup in all_imap_backups:
-    if period_filter and imap_backup['period'] not in period_filter:
-        continue
-    elif country_code_filter and imap_backup['country_code'] not in country_code_filter:
-        continue
-    imap_backups.append(imap_backup)
+# Load and filter IMAPs one backup entry at a time, as they are processed
+imap_backups = datimimap.DatimImapFactory.iter_imap_backups(
+    args.file, period_filter=period_filter, country_code_filter=country_code_filter)
 
 # Display debug info
 if args.verbosity:
@@ -59,20 +53,18 @@ if args.verbosity:
     print('ocl_env_url=%s' % ocl_env_url)
     print('country_codes=%s' % country_code_filter)
     print('periods=%s' % period_filter)
-    print('%s IMAPs (after filter) of %s IMAP backups loaded' % (
-        len(imap_backups), len(all_imap_backups)))
 
 # Loop through each and import
 current_num = 0
-for imap_backup in imap_backups:
+for imap_backup, imap_input in imap_backups:
     current_num += 1
 
     # Display debug info for the current IMAP org
     if args.verbosity:
         if args.verbosity > 1:
             print('\n\n' + '*' * 100)
-        print('** [IMAP %s of %s] Org: %s, Country Code: %s, Country Name: %s, Period: %s' % (
-            current_num, len(imap_backups), imap_backup['country_org'],
+        print('** [IMAP %s] Org: %s, Country Code: %s, Country Name: %s, Period: %s' % (
+            current_num, imap_backup['country_org'],
             imap_backup['country_code'], imap_backup['country_name'], imap_backup['period']))
         if args.verbosity > 1:
             print('*' * 100)
@@ -81,12 +73,6 @@ for imap_backup in imap_backups:
     if imap_backup['status'] != 'Success':
         print('WARNING: Invalid IMAP backup:', json.dumps(imap_backup))
         continue
-    imap_input = datimimap.DatimImap(
-        imap_data=imap_backup['imap'],
-        period=imap_backup['period'],
-        country_org=imap_backup['country_org'],
-        country_name=imap_backup['country_name'],
-        country_code=imap_backup['country_code'])
     if args.verbosity > 1 and imap_input:
         imap_input.display(sort=True, exclude_empty_maps=True)
         # print 'INFO: IMAP import file "%s" loaded successfully' % args.file.name
@@ -125,3 +111,7 @@ for imap_backup in imap_backups:
                 ocl_env_url, bulk_import_task_id)
     if output_json and not args.test_mode:
         print(json.dumps(output_json))
+
+# Display debug info
+if args.verbosity:
+    print('%s IMAPs (after filter) loaded from IMAP backup' % current_num)
@@ -23,6 +23,36 @@ ocl_api_url_who_staging = 'https://api.staging.who.openconceptlab.org'
 ocl_api_url_demo = 'https://api.demo.openconceptlab.org'
 ocl_api_url_dev = 'https://api.dev.openconceptlab.org'
 
+# Whether to skip IMAP imports that match the previous import or export of the country org
+compare2previousexport = os.environ.get('COMPARE_PREVIOUS_EXPORT', '') in ['true', 'True']
+
+# Concurrent OCL collection export requests when exporting an IMAP. Either an integer or a
+# dictionary keyed by OCL API URL root (e.g. ocl_api_url_production), where '' is the default
+ocl_export_concurrency = {
+    '': int(os.environ.get('OCL_EXPORT_CONCURRENCY', '2')),
+}
+
+# Whether to raise or lower the export concurrency based on latency and 429/5xx responses, and
+# the highest concurrency allowed in that mode
+ocl_export_adaptive_concurrency = os.environ.get('OCL_EXPORT_ADAPTIVE_CONCURRENCY', '') in ['true', 'True']
+ocl_export_max_concurrency = int(os.environ.get('OCL_EXPORT_MAX_CONCURRENCY', '8'))
+
+# Size limit in bytes of the on-disk cache of OCL repository version exports (0 disables it)
+ocl_export_cache_max_bytes = int(os.environ.get('OCL_EXPORT_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+# Whether IMAP exports also save the OCL exports they load to the data folder, e.g. for debugging
+# or to run later exports offline
+save_ocl_exports = os.environ.get('SAVE_OCL_EXPORTS', '') in ['true', 'True']
+
+# Shared HTTP engine for OCL API requests: number of threads for concurrent requests, timeout in
+# seconds of each request as a (connect, read) tuple, and number of retries on connection errors
+ocl_http_max_workers = int(os.environ.get('OCL_HTTP_MAX_WORKERS', '8'))
+ocl_http_timeout = (
+    float(os.environ.get('OCL_HTTP_CONNECT_TIMEOUT', '10')),
+    float(os.environ.get('OCL_HTTP_READ_TIMEOUT', '300')),
+)
+ocl_http_retries = int(os.environ.get('OCL_HTTP_RETRIES', '5'))
+
 # IMAP Mediator URL roots - no slash at the end
 imap_mediator_url_test = 'https://test.ohie.datim.org:5000'
 imap_mediator_url_production = 'https://ohie.datim4u.org:5000'
@@ -0,0 +1,141 @@
+"""
+Tests of the on-disk cache of OCL repository version exports
+
+Run from the repository root:
+python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from datim import datimexportcache
+
+
+OCLENV = 'https://api.example.org'
+
+
+def get_key(repo_endpoint, repo_version_id='FY21.v1'):
+    return datimexportcache.DatimExportCache.get_key(OCLENV, repo_endpoint, repo_version_id)
+
+
+class DatimExportCacheTest(unittest.TestCase):
+    """ Tests of DatimExportCache """
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def get_cache(self, max_bytes=1000):
+        return datimexportcache.DatimExportCache(dirname=self.dirname, max_bytes=max_bytes)
+
+    def get_export_filenames(self):
+        return sorted(filename for filename in os.listdir(self.dirname) if filename.endswith('.zip'))
+
+    def test_get_key(self):
+        self.assertEqual(
+            datimexportcache.DatimExportCache.get_key(
+                OCLENV + '/', '/orgs/PEPFAR/sources/DATIM-MOH-FY21', 'FY21.v1'),
+            'https://api.example.org|/orgs/PEPFAR/sources/DATIM-MOH-FY21/|FY21.v1')
+        for repo_version_id in ('latest', 'HEAD', '', None):
+            with self.subTest(repo_version_id=repo_version_id):
+                self.assertIsNone(get_key('/orgs/PEPFAR/sources/DATIM-MOH-FY21/', repo_version_id))
+
+    def test_put_and_get(self):
+        key = get_key('/orgs/DATIM-MOH-DM-FY21/collections/A/')
+        self.get_cache().put(key, b'export A')
+        self.assertEqual(self.get_cache().get(key), b'export A')
+        self.assertIsNone(self.get_cache().get(get_key('/orgs/DATIM-MOH-DM-FY21/collections/B/')))
+        self.assertIsNone(self.get_cache().get(None))
+
+    def test_checksum_mismatch(self):
+        key = get_key('/orgs/DATIM-MOH-DM-FY21/collections/A/')
+        self.get_cache().put(key, b'export A')
+        export_filename = os.path.join(self.dirname, self.get_export_filenames()[0])
+        with open(export_filename, 'wb') as handle:
+            handle.write(b'corrupted export A')
+
+        # The entry and its export are removed, also from the index file
+        self.assertIsNone(self.get_cache().get(key))
+        self.assertFalse(os.path.exists(export_filename))
+        self.assertNotIn(key, self.get_cache().load())
+
+    def test_missing_export_file(self):
+        key = get_key('/orgs/DATIM-MOH-DM-FY21/collections/A/')
+        self.get_cache().put(key, b'export A')
+        os.remove(os.path.join(self.dirname, self.get_export_filenames()[0]))
+        self.assertEqual(self.get_cache().get_many([key]), {})
+        self.assertNotIn(key, self.get_cache().load())
+
+    def test_shared_export_files(self):
+        cache = self.get_cache()
+        key_a = get_key('/orgs/DATIM-MOH-DM-FY21/collections/A/')
+        key_b = get_key('/orgs/DATIM-MOH-DM-FY21/collections/B/')
+        cache.put_many([(key_a, b'same export'), (key_b, b'same export')])
+        self.assertEqual(len(self.get_export_filenames()), 1)
+        cache.remove(key_a)
+        self.assertEqual(cache.get(key_b), b'same export')
+        cache.remove(key_b)
+        self.assertEqual(self.get_export_filenames(), [])
+
+    def test_evict_least_recently_used(self):
+        cache = self.get_cache(max_bytes=30)
+        keys = [get_key('/orgs/DATIM-MOH-DM-FY21/collections/%s/' % name) for name in 'ABCD']
+        cache.put_many([(keys[0], b'0123456789'), (keys[1], b'0123456789')])
+        cache.put(keys[2], b'abcdefghij')
+        index = cache.load()
+        index[keys[0]]['last_used'] = 1.0
+        index[keys[1]]['last_used'] = 2.0
+        index[keys[2]]['last_used'] = 3.0
+        cache.save()
+
+        # A and B share one 10-byte export, so it is only deleted once neither key uses it
+        cache.put(keys[3], b'klmnopqrstuvwxyz')
+        self.assertEqual(sorted(cache.load()), sorted(keys[2:]))
+        self.assertEqual(cache.get_many(keys), {keys[2]: b'abcdefghij', keys[3]: b'klmnopqrstuvwxyz'})
+        self.assertEqual(len(self.get_export_filenames()), 2)
+
+    def test_evict_keeps_shared_export_of_remaining_key(self):
+        cache = self.get_cache(max_bytes=25)
+        keys = [get_key('/orgs/DATIM-MOH-DM-FY21/collections/%s/' % name) for name in 'ABC']
+        cache.put_many([(keys[0], b'0123456789'), (keys[1], b'abcdefghij')])
+        cache.put(keys[2], b'abcdefghij')
+        index = cache.load()
+        index[keys[0]]['last_used'] = 2.0
+        index[keys[1]]['last_used'] = 1.0
+        index[keys[2]]['last_used'] = 3.0
+        cache.save()
+
+        # Evicting B does not free its export, which C still uses, so A is evicted too
+        key_d = get_key('/orgs/DATIM-MOH-DM-FY21/collections/D/')
+        cache.put(key_d, b'0123456')
+        self.assertEqual(sorted(cache.load()), sorted([keys[2], key_d]))
+        self.assertEqual(cache.get(keys[2]), b'abcdefghij')
+        self.assertEqual(len(self.get_export_filenames()), 2)
+
+    def test_content_larger_than_cache(self):
+        key = get_key('/orgs/DATIM-MOH-DM-FY21/collections/A/')
+        cache = self.get_cache(max_bytes=5)
+        cache.put(key, b'0123456789')
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(self.get_export_filenames(), [])
+
+    def test_remove_prefix(self):
+        cache = self.get_cache()
+        key_a = get_key('/orgs/DATIM-MOH-DM-FY21/collections/A/')
+        key_b = get_key('/orgs/DATIM-MOH-DM-FY21/collections/B/', 'FY21.v2')
+        key_other_org = get_key('/orgs/DATIM-MOH-DM-FY210/collections/A/')
+        key_other_oclenv = datimexportcache.DatimExportCache.get_key(
+            'https://api.other.org', '/orgs/DATIM-MOH-DM-FY21/collections/A/', 'FY21.v1')
+        cache.put_many([(key_a, b'export A'), (key_b, b'export B'),
+                        (key_other_org, b'export A'), (key_other_oclenv, b'export C')])
+        cache.remove_prefix(OCLENV, '/orgs/DATIM-MOH-DM-FY21/')
+        self.assertEqual(sorted(self.get_cache().load()), sorted([key_other_org, key_other_oclenv]))
+        self.assertEqual(len(self.get_export_filenames()), 2)
+        self.assertEqual(self.get_cache().get(key_other_org), b'export A')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+Tests that DatimImapDiff.get_diff returns the same results as the former DeepDiff-based diff
+
+Run from the repository root with the dev packages of the Pipfile installed, which include
+deepdiff (the tests are skipped without it):
+pipenv install --dev
+pipenv run python -m unittest discover tests
+"""
+import inspect
+import os
+import re
+import unittest
+
+try:
+    import deepdiff
+except ImportError:
+    deepdiff = None
+
+from datim import datimimap
+
+
+IMAP_SAMPLES_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'imap-samples')
+
+# Pairs of IMAP samples to compare, loaded into the same country org
+IMAP_SAMPLE_PAIRS = [
+    ('DEMO-DAA-FY21.csv', 'DEMO-DAA-FY21.json'),
+    ('DEMO-CS-FY21.csv', 'DEMO-CS-FY21.json'),
+    ('BI-FY19-baseline.csv', 'BI-FY19.csv'),
+    ('ZWE-DAA-FY21.json', 'ZWE3-DAA-FY21.json'),
+    ('DEMO-FY19.csv', 'DEMO-FY20.csv'),
+    ('KE-FY17-baseline.csv', 'ZW-FY18-baseline.csv'),
+]
+
+COUNTRY_ORG = 'DATIM-MOH-DM'
+
+
+def load_imap_sample(filename, imap_data=None):
+    """ Loads an IMAP sample, or an IMAP with the rows of imap_data """
+    if imap_data is not None:
+        return datimimap.DatimImap(imap_data=imap_data, country_org=COUNTRY_ORG, period='FY19')
+    full_filename = os.path.join(IMAP_SAMPLES_PATH, filename)
+    if filename.endswith('.csv'):
+        return datimimap.DatimImapFactory.load_imap_from_csv(
+            csv_filename=full_filename, country_org=COUNTRY_ORG, period='FY19')
+    return datimimap.DatimImapFactory.load_imap_from_json(
+        json_filename=full_filename, country_org=COUNTRY_ORG, period='FY19')
+
+
+def get_mapped_rows(imap):
+    """ Returns copies of the rows of an IMAP that map to a country indicator and disag """
+    return [row for row in imap.get_imap_data() if row['MOH_Disag_ID'] not in ('', 'null-disag')]
+
+
+def get_deepdiff(imap_a, imap_b, exclude_empty_maps=False):
+    """ Returns the diff computed as DatimImapDiff did before it stopped using DeepDiff """
+    def get_keyed_imap_data(imap):
+        return dict((str(row_key), row) for row_key, row in imap.get_imap_data(
+            sort=True, exclude_empty_maps=exclude_empty_maps, exclude_classification=True,
+            convert_to_dict=True).items())
+
+    # deepdiff 8+ reports a changed root instead of the added and removed rows when the IMAPs
+    # have few rows in common, unlike the deepdiff version the former diff was written for
+    kwargs = {'verbose_level': 2}
+    if 'threshold_to_diff_deeper' in inspect.signature(deepdiff.DeepDiff).parameters:
+        kwargs['threshold_to_diff_deeper'] = 0
+    diff_data = deepdiff.DeepDiff(get_keyed_imap_data(imap_a), get_keyed_imap_data(imap_b), **kwargs)
+    diff_data = dict((category, dict(diffs)) for category, diffs in diff_data.items())
+
+    # Remove the Total vs. default differences and the DATIM disag name discrepancies
+    if 'values_changed' in diff_data:
+        for diff_key in list(diff_data['values_changed'].keys()):
+            value_change = diff_data['values_changed'][diff_key]
+            if value_change['new_value'] == 'Total' and value_change['old_value'] == 'default':
+                del diff_data['values_changed'][diff_key]
+            elif re.match(r"^root\['[a-zA-Z0-9.\-_,]+'\]\['DATIM_Disag_Name'\]$", diff_key):
+                del diff_data['values_changed'][diff_key]
+    return diff_data
+
+
+@unittest.skipIf(deepdiff is None, 'deepdiff is not installed')
+class DatimImapDiffDeepDiffTest(unittest.TestCase):
+    """ Compares DatimImapDiff.get_diff with the former DeepDiff output """
+
+    def assert_same_diff(self, imap_a, imap_b, exclude_empty_maps=False):
+        expected = get_deepdiff(imap_a, imap_b, exclude_empty_maps=exclude_empty_maps)
+        imap_diff = imap_a.diff(imap_b, exclude_empty_maps=exclude_empty_maps)
+        self.assertEqual(imap_diff.get_diff(), expected)
+        self.assertEqual(imap_diff.get_num_diffs(), sum(len(diffs) for diffs in expected.values()))
+        return expected
+
+    def get_changed_imaps(self):
+        """ Returns an IMAP sample and a copy of it with changed, added and removed rows """
+        imap_a = load_imap_sample('DEMO-DAA-FY21.json')
+        rows = imap_a.get_imap_data()
+        mapped_rows = [row for row in rows if row['MOH_Disag_ID'] not in ('', 'null-disag')]
+        mapped_rows[0]['MOH_Disag_Name'] = 'Renamed disag'
+        mapped_rows[1]['MOH_Indicator_Name'] = 'Renamed\nindicator'
+        mapped_rows[2]['DATIM_Indicator_Category'] = 12
+        mapped_rows[3]['MOH_Disag_Name'] = None
+        mapped_rows[4]['MOH_Disag_ID'] = 'new-disag'
+        rows.remove(mapped_rows[5])
+        return imap_a, load_imap_sample('', imap_data=rows)
+
+    def test_imap_sample_pairs(self):
+        for filename_a, filename_b in IMAP_SAMPLE_PAIRS:
+            imap_a = load_imap_sample(filename_a)
+            imap_b = load_imap_sample(filename_b)
+            for exclude_empty_maps in (False, True):
+                with self.subTest(a=filename_a, b=filename_b, exclude_empty_maps=exclude_empty_maps):
+                    self.assert_same_diff(imap_a, imap_b, exclude_empty_maps=exclude_empty_maps)
+                    self.assert_same_diff(imap_b, imap_a, exclude_empty_maps=exclude_empty_maps)
+
+    def test_added_removed_changed_and_type_change_rows(self):
+        imap_a, imap_b = self.get_changed_imaps()
+        for exclude_empty_maps in (False, True):
+            expected = self.assert_same_diff(imap_a, imap_b, exclude_empty_maps=exclude_empty_maps)
+            self.assertEqual(
+                sorted(expected.keys()),
+                ['dictionary_item_added', 'dictionary_item_removed', 'type_changes', 'values_changed'])
+            self.assertEqual(len(expected['dictionary_item_added']), 1)
+            self.assertEqual(len(expected['dictionary_item_removed']), 2)
+            self.assertEqual(len(expected['type_changes']), 2)
+            self.assertEqual(len(expected['values_changed']), 2)
+
+    def test_empty_map_exclusion(self):
+        imap_a = load_imap_sample('DEMO-FY20.csv')
+        rows = [row for row in imap_a.get_imap_data() if row['MOH_Indicator_ID']]
+        imap_b = load_imap_sample('', imap_data=rows)
+        self.assertTrue(self.assert_same_diff(imap_a, imap_b).get('dictionary_item_removed'))
+        self.assertEqual(self.assert_same_diff(imap_a, imap_b, exclude_empty_maps=True), {})
+
+    def test_ignored_changes(self):
+        rows_a = get_mapped_rows(load_imap_sample('DEMO-DAA-FY21.json'))
+        rows_a[0]['MOH_Disag_Name'] = 'default'
+        rows_b = [row.copy() for row in rows_a]
+        rows_b[0]['MOH_Disag_Name'] = 'Total'
+        rows_b[1]['DATIM_Disag_Name'] = 'Renamed DATIM disag'
+        imap_a = load_imap_sample('', imap_data=rows_a)
+        for imap_b in (load_imap_sample('', imap_data=rows_b),
+                       load_imap_sample('', imap_data=[rows_b[0]] + rows_a[1:]),
+                       load_imap_sample('', imap_data=rows_a[:1] + rows_b[1:])):
+            # Ignored changes leave an empty values_changed category and are not counted
+            self.assertEqual(self.assert_same_diff(imap_a, imap_b), {'values_changed': {}})
+
+    def test_duplicate_row_keys(self):
+        # Two rows with the same row key differ only in a name. Reordering them changes the row
+        # that wins in a diff keyed by row key, but not the hash of their indicator group.
+        rows = get_mapped_rows(load_imap_sample('DEMO-DAA-FY21.json'))
+        duplicate_row = rows[0].copy()
+        duplicate_row['MOH_Indicator_Name'] = 'Duplicate indicator'
+        imap_a = load_imap_sample('', imap_data=rows + [duplicate_row])
+        imap_b = load_imap_sample('', imap_data=[duplicate_row] + rows)
+        self.assertEqual(imap_a.get_indicator_fingerprints(), imap_b.get_indicator_fingerprints())
+        for exclude_empty_maps in (False, True):
+            expected = self.assert_same_diff(imap_a, imap_b, exclude_empty_maps=exclude_empty_maps)
+            self.assertEqual(len(expected['values_changed']), 1)
+
+    def test_deferred_evaluation(self):
+        imap_a, imap_b = self.get_changed_imaps()
+        imap_diff = imap_a.diff(imap_b, evaluate=False)
+        self.assertEqual(imap_diff.get_diff(), get_deepdiff(imap_a, imap_b))
+
+
+if __name__ == '__main__':
+    unittest.main()
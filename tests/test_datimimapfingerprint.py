@@ -0,0 +1,146 @@
+"""
+Tests of the IMAP fingerprint store and of its use to skip imports of unchanged IMAPs
+
+Run from the repository root:
+python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from datim import datimimap, datimimapfingerprint, datimimapimport
+
+
+COUNTRY_ORG = 'DATIM-MOH-DM-FY21'
+
+REPO_VERSION = {'id': 'FY21.v1', 'created_on': '2021-06-01T11:58:02.123Z'}
+
+
+def get_imap(moh_indicator_name='Indicator 1'):
+    """ Returns a one-row IMAP of the test country org """
+    return datimimap.DatimImap(country_org=COUNTRY_ORG, period='FY21', imap_data=[{
+        datimimap.DatimImap.IMAP_FIELD_DATIM_INDICATOR_CATEGORY: 'HTS_TST',
+        datimimap.DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID: 'HTS_TST_N',
+        datimimap.DatimImap.IMAP_FIELD_DATIM_DISAG_NAME: 'DATIM disag 1',
+        datimimap.DatimImap.IMAP_FIELD_DATIM_DISAG_ID: 'd1',
+        datimimap.DatimImap.IMAP_FIELD_OPERATION: 'ADD',
+        datimimap.DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME: moh_indicator_name,
+        datimimap.DatimImap.IMAP_FIELD_MOH_INDICATOR_ID: 'I1',
+        datimimap.DatimImap.IMAP_FIELD_MOH_DISAG_NAME: 'Disag 1',
+        datimimap.DatimImap.IMAP_FIELD_MOH_DISAG_ID: 'D1',
+    }])
+
+
+class DatimImapFingerprintTestCase(unittest.TestCase):
+    """ Base class of the tests, with a fingerprint store in a temporary folder """
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(
+            self.dirname, datimimapfingerprint.DatimImapFingerprintStore.DEFAULT_FILENAME)
+        self.store = datimimapfingerprint.DatimImapFingerprintStore(filename=self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def set_pending(self, imap, ocl_bulk_import_task_id='task-1'):
+        return self.store.set(
+            COUNTRY_ORG, imap.get_fingerprint(), version=REPO_VERSION['id'],
+            source=datimimapfingerprint.DatimImapFingerprintStore.SOURCE_IMPORT,
+            ocl_bulk_import_task_id=ocl_bulk_import_task_id,
+            status=datimimapfingerprint.DatimImapFingerprintStore.STATUS_PENDING)
+
+
+class DatimImapFingerprintStoreTest(DatimImapFingerprintTestCase):
+    """ Tests of DatimImapFingerprintStore """
+
+    def test_confirm_matching_repo_version(self):
+        imap = get_imap()
+        self.set_pending(imap)
+        self.assertFalse(self.store.is_match(imap, REPO_VERSION))
+        entry = self.store.confirm(COUNTRY_ORG, REPO_VERSION)
+        self.assertEqual(entry['status'], datimimapfingerprint.DatimImapFingerprintStore.STATUS_CONFIRMED)
+        self.assertEqual(entry['version_created_on'], REPO_VERSION['created_on'])
+        self.assertTrue(self.store.is_match(imap, REPO_VERSION))
+
+        # The confirmed entry is saved for other processes
+        other_store = datimimapfingerprint.DatimImapFingerprintStore(filename=self.filename)
+        self.assertTrue(other_store.is_match(imap, REPO_VERSION))
+
+    def test_confirm_mismatching_repo_version(self):
+        for repo_version in ({'id': 'FY21.v0', 'created_on': REPO_VERSION['created_on']}, None):
+            with self.subTest(repo_version=repo_version):
+                self.set_pending(get_imap())
+                self.assertIsNone(self.store.confirm(COUNTRY_ORG, repo_version))
+                self.assertIsNone(self.store.get(COUNTRY_ORG, reload=True))
+
+    def test_confirm_confirmed_entry(self):
+        imap = get_imap()
+        entry = self.store.set(COUNTRY_ORG, imap.get_fingerprint(), version=REPO_VERSION['id'],
+                               version_created_on=REPO_VERSION['created_on'])
+        self.assertEqual(self.store.confirm(COUNTRY_ORG, {'id': 'FY21.v2'}), entry)
+
+    def test_is_match(self):
+        imap = get_imap()
+        self.store.set(COUNTRY_ORG, imap.get_fingerprint(), version=REPO_VERSION['id'],
+                       version_created_on=REPO_VERSION['created_on'])
+        self.assertTrue(self.store.is_match(imap, REPO_VERSION))
+        self.assertFalse(self.store.is_match(get_imap('Renamed indicator'), REPO_VERSION))
+        self.assertFalse(self.store.is_match(imap, None))
+
+        # The version was deleted and created again with the same ID
+        self.assertFalse(self.store.is_match(imap, dict(REPO_VERSION, created_on='2021-07-01T08:00:00.000Z')))
+
+    def test_remove(self):
+        self.store.set(COUNTRY_ORG, get_imap().get_fingerprint())
+        self.store.remove(COUNTRY_ORG)
+        self.assertIsNone(self.store.get(COUNTRY_ORG, reload=True))
+
+
+class DatimImapImportFingerprintMatchTest(DatimImapFingerprintTestCase):
+    """ Tests of DatimImapImport.is_imap_fingerprint_match """
+
+    def is_imap_fingerprint_match(self, imap, import_results=None):
+        imap_import = datimimapimport.DatimImapImport(
+            oclenv='https://api.example.org', oclapitoken='token', compare2previousexport=True,
+            fingerprint_store=self.store)
+        with mock.patch.object(datimimap.DatimImapFactory, 'get_repo_latest_period_version',
+                               return_value=REPO_VERSION), \
+                mock.patch('ocldev.oclfleximporter.OclBulkImporter.get_bulk_import_results',
+                           return_value=import_results):
+            return imap_import.is_imap_fingerprint_match(imap)
+
+    def get_import_results(self, is_error):
+        return mock.Mock(has_error_status_code=mock.Mock(return_value=is_error))
+
+    def test_pending_import_succeeded(self):
+        imap = get_imap()
+        self.set_pending(imap)
+        self.assertTrue(self.is_imap_fingerprint_match(imap, self.get_import_results(False)))
+        self.assertEqual(self.store.get(COUNTRY_ORG)['status'],
+                         datimimapfingerprint.DatimImapFingerprintStore.STATUS_CONFIRMED)
+
+    def test_pending_import_failed(self):
+        imap = get_imap()
+        self.set_pending(imap)
+        self.assertFalse(self.is_imap_fingerprint_match(imap, self.get_import_results(True)))
+        self.assertIsNone(self.store.get(COUNTRY_ORG))
+
+    def test_pending_import_processing(self):
+        imap = get_imap()
+        self.set_pending(imap)
+        self.assertFalse(self.is_imap_fingerprint_match(imap, None))
+        self.assertEqual(self.store.get(COUNTRY_ORG)['status'],
+                         datimimapfingerprint.DatimImapFingerprintStore.STATUS_PENDING)
+
+    def test_pending_without_import_task(self):
+        imap = get_imap()
+        self.set_pending(imap, ocl_bulk_import_task_id=None)
+        self.assertFalse(self.is_imap_fingerprint_match(imap))
+        self.assertIsNone(self.store.get(COUNTRY_ORG))
+
+
+if __name__ == '__main__':
+    unittest.main()
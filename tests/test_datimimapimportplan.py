@@ -0,0 +1,171 @@
+"""
+Tests of the import plan that DatimImapFactory.plan_import_from_diff derives from an IMAP diff
+
+Run from the repository root:
+python -m unittest discover tests
+"""
+import unittest
+
+from datim import datimbase, datimimap
+
+
+COUNTRY_ORG = 'DATIM-MOH-DM-FY21'
+COUNTRY_SOURCE_ENDPOINT = '/orgs/%s/sources/DATIM-Alignment-Indicators/' % COUNTRY_ORG
+
+
+def get_row(datim_indicator_id, datim_disag_id, moh_indicator_id, moh_indicator_name,
+            moh_disag_id, moh_disag_name):
+    """ Returns an IMAP row mapping a country indicator+disag to a DATIM indicator+disag """
+    return {
+        datimimap.DatimImap.IMAP_FIELD_DATIM_INDICATOR_CATEGORY: 'HTS_TST',
+        datimimap.DatimImap.IMAP_FIELD_DATIM_INDICATOR_ID: datim_indicator_id,
+        datimimap.DatimImap.IMAP_FIELD_DATIM_DISAG_NAME: 'DATIM disag %s' % datim_disag_id,
+        datimimap.DatimImap.IMAP_FIELD_DATIM_DISAG_ID: datim_disag_id,
+        datimimap.DatimImap.IMAP_FIELD_OPERATION: 'ADD',
+        datimimap.DatimImap.IMAP_FIELD_MOH_INDICATOR_NAME: moh_indicator_name,
+        datimimap.DatimImap.IMAP_FIELD_MOH_INDICATOR_ID: moh_indicator_id,
+        datimimap.DatimImap.IMAP_FIELD_MOH_DISAG_NAME: moh_disag_name,
+        datimimap.DatimImap.IMAP_FIELD_MOH_DISAG_ID: moh_disag_id,
+    }
+
+
+def get_mapping_expression(mapping_id):
+    """ Returns the reference expression of a country mapping """
+    return '%smappings/%s/' % (COUNTRY_SOURCE_ENDPOINT, mapping_id)
+
+
+# IMAP A is exported from version FY21.v1, in which HTS-TST-N-d1 was left unchanged since FY21.v0.
+# IMAP B renames I1, moves the I2+D3 mapping from HTS_TST_N+d3 to TX_CURR+d4, which empties
+# HTS-TST-N-d3 and leaves I3 and D4 unused, and adds I4+D5 to a new TX-CURR-d5 collection.
+ROWS_A = [
+    get_row('HTS_TST_N', 'd1', 'I1', 'Indicator 1', 'D1', 'Disag 1'),
+    get_row('HTS_TST_N', 'd2', 'I1', 'Indicator 1', 'D2', 'Disag 2'),
+    get_row('HTS_TST_N', 'd3', 'I2', 'Indicator 2', 'D3', 'Disag 3'),
+    get_row('TX_CURR', 'd4', 'I3', 'Indicator 3', 'D4', 'Disag 4'),
+]
+ROWS_B = [
+    get_row('HTS_TST_N', 'd1', 'I1', 'Indicator 1', 'D1', 'Disag 1'),
+    get_row('HTS_TST_N', 'd2', 'I1', 'Renamed indicator 1', 'D2', 'Disag 2'),
+    get_row('TX_CURR', 'd4', 'I2', 'Indicator 2', 'D3', 'Disag 3'),
+    get_row('TX_CURR', 'd5', 'I4', 'Indicator 4', 'D5', 'Disag 5'),
+]
+
+
+class DatimImapImportPlanTest(unittest.TestCase):
+    """ Tests of DatimImapFactory.plan_import_from_diff """
+
+    def get_import_plan(self, rows_b=None, include_repo_versions=True):
+        imap_a = datimimap.DatimImap(
+            imap_data=ROWS_A, country_org=COUNTRY_ORG, period='FY21', version='FY21.v1',
+            collection_versions={'HTS-TST-N-d1': 'FY21.v0'})
+        imap_b = datimimap.DatimImap(
+            imap_data=ROWS_B if rows_b is None else rows_b, country_org=COUNTRY_ORG, period='FY21')
+        return datimimap.DatimImapFactory.plan_import_from_diff(
+            imap_a.diff(imap_b), include_repo_versions=include_repo_versions)
+
+    def get_resources(self, import_plan, resource_type):
+        return [resource for _, resources in import_plan for resource in resources
+                if resource['type'] == resource_type]
+
+    def get_references(self, import_plan, action=None):
+        """ Returns {collection_id: expressions} of the references added, or deleted if action is set """
+        return dict(
+            (reference['collection'], reference['data']['expressions'])
+            for reference in self.get_resources(import_plan, datimbase.DatimBase.RESOURCE_TYPE_REFERENCE)
+            if reference.get('__action') == action)
+
+    def test_retired_definitions(self):
+        import_plan = self.get_import_plan()
+        retired_ids = sorted(
+            resource['id'] for resource in
+            self.get_resources(import_plan, datimbase.DatimBase.RESOURCE_TYPE_CONCEPT) +
+            self.get_resources(import_plan, datimbase.DatimBase.RESOURCE_TYPE_MAPPING)
+            if resource['retired'])
+        self.assertEqual(retired_ids, [
+            'MAP-DATIM-HAS-OPTION-HTS_TST_N-d3', 'MAP-MOH-ADD-OPERATION-de-I3-disag-D4',
+            'de-I3', 'disag-D4'])
+
+    def test_created_and_updated_definitions(self):
+        import_plan = self.get_import_plan()
+        narratives = [narrative for narrative, _ in import_plan]
+        self.assertIn('Create new country indicator: I4, Indicator 4', narratives)
+        self.assertIn('Create new country disag: D5, Disag 5', narratives)
+        self.assertIn('Create country collection: TX-CURR-d5', narratives)
+        self.assertIn('Update country indicator name: I1, Renamed indicator 1', narratives)
+        self.assertNotIn('Create country collection: TX-CURR-d4', narratives)
+
+    def test_moved_mapping(self):
+        import_plan = self.get_import_plan()
+        expression = get_mapping_expression('MAP-MOH-ADD-OPERATION-de-I2-disag-D3')
+        self.assertEqual(self.get_references(import_plan, action='DELETE'), {
+            'HTS-TST-N-d3': [expression],
+            'TX-CURR-d4': [get_mapping_expression('MAP-MOH-ADD-OPERATION-de-I3-disag-D4')],
+        })
+        self.assertIn(expression, self.get_references(import_plan)['TX-CURR-d4'])
+
+        # The country mapping is still used, so it is neither retired nor created again
+        mapping_ids = [mapping['id'] for mapping in self.get_resources(
+            import_plan, datimbase.DatimBase.RESOURCE_TYPE_MAPPING)]
+        self.assertNotIn('MAP-MOH-ADD-OPERATION-de-I2-disag-D3', mapping_ids)
+
+    def test_reference_deletes_before_adds(self):
+        actions = [reference.get('__action') for reference in self.get_resources(
+            self.get_import_plan(), datimbase.DatimBase.RESOURCE_TYPE_REFERENCE)]
+        self.assertEqual(actions, ['DELETE', 'DELETE', None, None])
+
+    def test_emptied_collection(self):
+        # The only row of HTS-TST-N-d3 is removed, so its only reference is deleted and the
+        # collection is versioned without it
+        import_plan = self.get_import_plan(rows_b=ROWS_A[:2] + ROWS_A[3:])
+        self.assertEqual(self.get_references(import_plan, action='DELETE'), {
+            'HTS-TST-N-d3': [get_mapping_expression('MAP-MOH-ADD-OPERATION-de-I2-disag-D3')]})
+        self.assertEqual(self.get_references(import_plan), {})
+        collection_versions = self.get_resources(
+            import_plan, datimbase.DatimBase.RESOURCE_TYPE_COLLECTION_VERSION)
+        self.assertEqual([version['collection'] for version in collection_versions], ['HTS-TST-N-d3'])
+
+    def test_selective_collection_versions(self):
+        import_plan = self.get_import_plan()
+        self.assertEqual(import_plan[-2][0], 'Create country source version: FY21.v2')
+        self.assertEqual(import_plan[-1][0], 'Create collection versions: FY21.v2')
+        collection_versions = self.get_resources(
+            import_plan, datimbase.DatimBase.RESOURCE_TYPE_COLLECTION_VERSION)
+        self.assertEqual(
+            [(version['collection'], version['id']) for version in collection_versions],
+            [('HTS-TST-N-d3', 'FY21.v2'), ('TX-CURR-d4', 'FY21.v2'), ('TX-CURR-d5', 'FY21.v2')])
+
+        # The source version records the version of the unchanged collections too
+        source_versions = self.get_resources(
+            import_plan, datimbase.DatimBase.RESOURCE_TYPE_SOURCE_VERSION)
+        self.assertEqual(len(source_versions), 1)
+        self.assertEqual(source_versions[0]['id'], 'FY21.v2')
+        self.assertEqual(source_versions[0]['extras'], {
+            datimbase.DatimBase.DATIM_MOH_COLLECTION_VERSIONS_ATTRIBUTE: {
+                'HTS-TST-N-d1': 'FY21.v0', 'HTS-TST-N-d2': 'FY21.v1', 'HTS-TST-N-d3': 'FY21.v2',
+                'TX-CURR-d4': 'FY21.v2', 'TX-CURR-d5': 'FY21.v2'}})
+
+    def test_without_repo_versions(self):
+        import_plan = self.get_import_plan(include_repo_versions=False)
+        self.assertEqual(self.get_resources(
+            import_plan, datimbase.DatimBase.RESOURCE_TYPE_SOURCE_VERSION), [])
+        self.assertEqual(self.get_resources(
+            import_plan, datimbase.DatimBase.RESOURCE_TYPE_COLLECTION_VERSION), [])
+
+    def test_no_changes(self):
+        self.assertEqual(self.get_import_plan(rows_b=ROWS_A), [])
+
+    def test_get_next_version_id(self):
+        for imap_version_id, period, next_version_id in (
+                ('FY21.v1', 'FY21', 'FY21.v2'),
+                ('FY21.v9', 'FY21', 'FY21.v10'),
+                ('FY20.v3', 'FY21', 'FY21.v0'),
+                ('FY21.vx', 'FY21', 'FY21.v0'),
+                ('', 'FY21', 'FY21.v0'),
+                (None, 'FY21', 'FY21.v0')):
+            with self.subTest(imap_version_id=imap_version_id, period=period):
+                self.assertEqual(datimimap.DatimImapFactory.get_next_version_id(
+                    imap_version_id, period), next_version_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
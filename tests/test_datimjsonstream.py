@@ -0,0 +1,153 @@
+"""
+Tests of the incremental JSON parsing of IMAP backups and OCL exports
+
+Run from the repository root:
+python -m unittest discover tests
+"""
+import io
+import json
+import unittest
+
+from datim import datimbase, datimimap, datimjsonstream
+
+
+# Items with numbers, literals, escapes and brackets inside strings, so that every chunk size
+# splits some number, escape sequence or string in the middle
+ITEMS = [
+    {'id': 'HTS_TST', 'value': -1.25e-10, 'count': 1234567890, 'active': True, 'note': None},
+    {'text': 'quote " backslash \\ slash / tab \t newline \n', 'unicode': 'café ☃ \U0001f600'},
+    {'brackets': '[{]}', 'nested': [[], {}, [1, [2, [3]]], {'a': {'b': ['c']}}]},
+    12345678901234567890,
+    -0.5,
+    'a string with an escaped quote \\" at the end \\',
+    [],
+    {},
+    False,
+]
+
+
+class DatimJsonStreamReaderTest(unittest.TestCase):
+    """ Tests of DatimJsonStreamReader """
+
+    def get_reader(self, text, chunk_size=datimjsonstream.DatimJsonStreamReader.DEFAULT_CHUNK_SIZE):
+        return datimjsonstream.DatimJsonStreamReader(
+            io.StringIO(text), source_name='test.json', chunk_size=chunk_size)
+
+    def test_values_split_across_chunks(self):
+        for text in (json.dumps(ITEMS), json.dumps(ITEMS, indent=2, ensure_ascii=False)):
+            for chunk_size in range(1, len(text) + 2):
+                reader = self.get_reader(text, chunk_size=chunk_size)
+                self.assertEqual(list(reader.iter_list()), ITEMS, 'chunk_size=%s' % chunk_size)
+                reader.read_end()
+
+    def test_binary_stream(self):
+        text = json.dumps(ITEMS, ensure_ascii=False)
+        for chunk_size in (1, 7, 65536):
+            reader = datimjsonstream.DatimJsonStreamReader(
+                io.BytesIO(text.encode('utf-8')), chunk_size=chunk_size)
+            self.assertEqual(list(reader.iter_list()), ITEMS)
+
+    def test_numbers_at_end_of_input(self):
+        for text in ('123', '-1.5e3', ' 7 '):
+            for chunk_size in (1, 2, 65536):
+                self.assertEqual(self.get_reader(text, chunk_size).read_value(), json.loads(text))
+
+    def test_empty_list(self):
+        for text in ('[]', ' [ ] ', '[\n]'):
+            self.assertEqual(list(self.get_reader(text, chunk_size=1).iter_list()), [])
+
+    def test_empty_object(self):
+        self.assertEqual(list(self.get_reader('{}').iter_object_lists(('concepts',))), [])
+
+    def test_object_lists(self):
+        export = {
+            'id': 'FY21.v1', 'extras': {'concepts': ['not a top-level list']}, 'concepts': ITEMS,
+            'mappings': [{'map_type': 'Has Option'}], 'references': [1, 2], 'concept_count': 9}
+        text = json.dumps(export)
+        expected = [('concepts', item) for item in ITEMS] + [('mappings', {'map_type': 'Has Option'})]
+        for chunk_size in (1, 3, 65536):
+            reader = self.get_reader(text, chunk_size=chunk_size)
+            self.assertEqual(list(reader.iter_object_lists(('concepts', 'mappings'))), expected)
+
+    def test_wrong_top_level_type(self):
+        for text, found_type in (('{"a": [1]}', dict), ('"[1]"', str), ('1', int), ('null', type(None))):
+            with self.assertRaises(TypeError) as context:
+                list(self.get_reader(text).iter_list())
+            self.assertIn(str(found_type), str(context.exception))
+        with self.assertRaises(TypeError):
+            list(self.get_reader('[{"concepts": []}]').iter_object_lists(('concepts',)))
+
+    def test_truncated_input(self):
+        text = json.dumps(ITEMS)
+        for length in range(len(text)):
+            for chunk_size in (1, 65536):
+                reader = self.get_reader(text[:length], chunk_size=chunk_size)
+                with self.assertRaises(ValueError, msg='length=%s' % length):
+                    list(reader.iter_list())
+
+    def test_malformed_input(self):
+        for text in ('[1 2]', '[1,]', '[tru]', '[1.]', '[{"a": 1]', '["a" "b"]', '[1]]', 'x', ''):
+            for chunk_size in (1, 65536):
+                reader = self.get_reader(text, chunk_size=chunk_size)
+                with self.assertRaises(ValueError, msg=text):
+                    list(reader.iter_list())
+                    reader.read_end()
+
+    def test_items_yielded_before_end_of_input(self):
+        reader = self.get_reader('[{"a": 1}, {"b": 2}, ', chunk_size=1)
+        items = reader.iter_list()
+        self.assertEqual(next(items), {'a': 1})
+        self.assertEqual(next(items), {'b': 2})
+        with self.assertRaises(ValueError):
+            next(items)
+
+
+class DatimImapFactoryIterJsonListTest(unittest.TestCase):
+    """ Tests of DatimImapFactory.iter_json_list """
+
+    def test_list(self):
+        for chunk_size in (1, 5, 65536):
+            items = datimimap.DatimImapFactory.iter_json_list(
+                io.StringIO(json.dumps(ITEMS)), chunk_size=chunk_size)
+            self.assertEqual(list(items), ITEMS)
+
+    def test_empty_list(self):
+        self.assertEqual(list(datimimap.DatimImapFactory.iter_json_list(io.StringIO('[]'))), [])
+
+    def test_wrong_top_level_type(self):
+        with self.assertRaises(TypeError):
+            list(datimimap.DatimImapFactory.iter_json_list(io.StringIO('{"imap": []}')))
+
+    def test_extra_data(self):
+        with self.assertRaises(ValueError):
+            list(datimimap.DatimImapFactory.iter_json_list(io.StringIO('[1] [2]')))
+
+
+class DatimBaseIterExportResourcesTest(unittest.TestCase):
+    """ Tests of DatimBase.iter_export_resources """
+
+    def test_resources(self):
+        export = {'concepts': [{'id': 'HTS_TST', 'extras': {'x': -1.5}}], 'mappings': [{'id': 'm\\"1'}]}
+        for chunk_size in (1, 4, 65536):
+            resources = datimbase.DatimBase.iter_export_resources(
+                io.StringIO(json.dumps(export)), chunk_size=chunk_size)
+            self.assertEqual(list(resources), [
+                ('concepts', export['concepts'][0]), ('mappings', export['mappings'][0])])
+
+    def test_empty_lists(self):
+        for text in ('{}', '{"concepts": [], "mappings": []}'):
+            self.assertEqual(list(datimbase.DatimBase.iter_export_resources(io.StringIO(text))), [])
+
+    def test_wrong_top_level_type(self):
+        with self.assertRaises(TypeError):
+            list(datimbase.DatimBase.iter_export_resources(io.StringIO('[{"concepts": []}]')))
+
+    def test_truncated_input(self):
+        text = json.dumps({'concepts': [{'id': 'HTS_TST'}], 'mappings': [{'id': 1}]})
+        for length in range(len(text)):
+            with self.assertRaises(ValueError, msg='length=%s' % length):
+                list(datimbase.DatimBase.iter_export_resources(io.StringIO(text[:length]), chunk_size=2))
+
+
+if __name__ == '__main__':
+    unittest.main()